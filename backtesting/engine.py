@@ -0,0 +1,275 @@
+import abc
+from typing import Optional
+
+import numpy as np
+
+from backtesting.market_data import MarketData
+from broker_simulator.fees import calculate_fee
+from broker_simulator.trigger_book import FALLING_TRIGGER_TYPES, RISING_TRIGGER_TYPES
+from utils.timeseries import RECORD_DTYPE, write_timeseries
+
+ORDER_TYPES = FALLING_TRIGGER_TYPES + RISING_TRIGGER_TYPES
+
+# rebuild the pending order arrays once filled orders outnumber pending ones
+_COMPACTION_THRESHOLD = 64
+
+
+class Account:
+    """
+    Cash and holdings (amount per symbol, in MarketData.symbols order) of the simulated user.
+    """
+
+    def __init__(self, cash: float, num_symbols: int):
+        self.cash = cash
+        self.holdings = np.zeros(num_symbols)
+
+    @property
+    def portfolio(self) -> dict[int, float]:
+        return {int(i): float(self.holdings[i]) for i in np.flatnonzero(self.holdings)}
+
+
+class Orders:
+    """
+    Orders a strategy places during one step.
+
+    Market orders can be placed one at a time with `buy`/`sell` or for all symbols at once by writing the amount
+    arrays directly; buys are filled before sells. Pending orders are executed by the engine once their trigger is
+    crossed, in this or any later step.
+    """
+
+    def __init__(self, num_symbols: int):
+        self.buy_amounts = np.zeros(num_symbols)
+        self.sell_amounts = np.zeros(num_symbols)
+        self.submitted: list[tuple[str, int, float, float]] = []
+
+    def buy(self, symbol_index: int, amount: float) -> None:
+        self.buy_amounts[symbol_index] += amount
+
+    def sell(self, symbol_index: int, amount: float) -> None:
+        self.sell_amounts[symbol_index] += amount
+
+    def submit_order(self, order_type: str, symbol_index: int, amount: float, trigger_price: float) -> None:
+        if order_type not in ORDER_TYPES:
+            raise ValueError(f"Order is of type {order_type}, Only limit, stop_loss and take_profit orders are "
+                             f"accepted")
+        self.submitted.append((order_type, symbol_index, amount, trigger_price))
+
+    def clear(self) -> None:
+        self.buy_amounts[:] = 0
+        self.sell_amounts[:] = 0
+        self.submitted.clear()
+
+
+class Strategy(abc.ABC):
+    def start(self, market_data: MarketData, account: Account) -> None:
+        """
+        Called once before the first step.
+        """
+        pass
+
+    @abc.abstractmethod
+    def on_step(self, step: int, prices: np.ndarray, account: Account, orders: Orders) -> None:
+        """
+        Places the orders of one step.
+
+        :param prices: The price of every symbol at this step, NaN for symbols without a price yet.
+        """
+        pass
+
+
+class _PendingOrders:
+    """
+    Pending orders as parallel arrays so that every order can be checked against the step's prices at once.
+    """
+
+    def __init__(self):
+        self.symbols = np.zeros(0, dtype=np.int64)
+        self.amounts = np.zeros(0)
+        self.trigger_prices = np.zeros(0)
+        self.is_buy = np.zeros(0, dtype=bool)  # limit orders buy, stop_loss and take_profit orders sell
+        self.is_falling = np.zeros(0, dtype=bool)
+        self.active = np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return int(self.active.sum())
+
+    def add(self, submitted: list[tuple[str, int, float, float]]) -> None:
+        order_types = [order_type for order_type, _, _, _ in submitted]
+        self.symbols = np.concatenate([self.symbols, [symbol for _, symbol, _, _ in submitted]]).astype(np.int64)
+        self.amounts = np.concatenate([self.amounts, [amount for _, _, amount, _ in submitted]])
+        self.trigger_prices = np.concatenate([self.trigger_prices, [trigger for _, _, _, trigger in submitted]])
+        self.is_buy = np.concatenate([self.is_buy, [order_type == "limit" for order_type in order_types]])
+        self.is_falling = np.concatenate([self.is_falling,
+                                          [order_type in FALLING_TRIGGER_TYPES for order_type in order_types]])
+        self.active = np.concatenate([self.active, np.ones(len(submitted), dtype=bool)])
+
+    def compact(self) -> None:
+        if len(self.active) - len(self) < max(_COMPACTION_THRESHOLD, len(self)):
+            return
+        keep = self.active
+        self.symbols = self.symbols[keep]
+        self.amounts = self.amounts[keep]
+        self.trigger_prices = self.trigger_prices[keep]
+        self.is_buy = self.is_buy[keep]
+        self.is_falling = self.is_falling[keep]
+        self.active = self.active[keep]
+
+
+class BacktestResult:
+    def __init__(self, market_data: MarketData, cash: np.ndarray, positions_value: np.ndarray, account: Account,
+                 trades: int, rejected: int, fees: float, pending_orders: int):
+        self.timestamps = market_data.timestamps
+        self.symbols = market_data.symbols
+        self.cash = cash
+        self.positions_value = positions_value
+        self.net_worth = cash + positions_value
+        self.holdings = account.holdings
+        self.trades = trades
+        self.rejected = rejected
+        self.fees = fees
+        self.pending_orders = pending_orders
+
+    def summary(self) -> dict[str, float]:
+        if len(self.net_worth) == 0:
+            return {"steps": 0, "trades": self.trades, "rejected": self.rejected, "fees": self.fees}
+
+        peaks = np.maximum.accumulate(self.net_worth)
+        drawdowns = np.where(peaks > 0, (peaks - self.net_worth) / peaks, 0.0)
+        return {
+            "steps": len(self.net_worth),
+            "start_net_worth": float(self.net_worth[0]),
+            "final_net_worth": float(self.net_worth[-1]),
+            "total_return": float(self.net_worth[-1] / self.net_worth[0] - 1) if self.net_worth[0] else 0.0,
+            "max_drawdown": float(drawdowns.max()),
+            "trades": self.trades,
+            "rejected": self.rejected,
+            "fees": self.fees,
+            "pending_orders": self.pending_orders,
+        }
+
+    def write_log(self, filename: str, every: int = 1) -> None:
+        """
+        Writes every `every`-th step as a time-series file in the format of the bots' logs.
+        """
+        records = np.zeros(len(self.timestamps[::every]), dtype=RECORD_DTYPE)
+        records["timestamp"] = self.timestamps[::every]
+        records["net_worth"] = self.net_worth[::every]
+        records["cash"] = self.cash[::every]
+        records["positions_value"] = self.positions_value[::every]
+        write_timeseries(filename, records)
+
+
+class Backtest:
+    """
+    Runs a strategy against historical prices in-process, settling trades the way the broker does.
+
+    Trades are priced at the step's price and charged the broker's fee. Like the broker, a buy is not limited by
+    the cash available, a sell is rejected if the position is empty, and an order for a symbol without a price is
+    rejected. Pending limit orders buy once the price falls to the trigger price, stop_loss orders sell once it falls
+    to it and take_profit orders sell once it rises to it; a triggered sell of an empty position is rejected and
+    dropped, as the broker deletes orders that can never execute.
+    """
+
+    def __init__(self, market_data: MarketData, strategy: Strategy, starting_cash: float):
+        self.market_data = market_data
+        self.strategy = strategy
+        self.starting_cash = starting_cash
+
+        self.trades = 0
+        self.rejected = 0
+        self.fees = 0.0
+
+    def _settle(self, account: Account, prices: np.ndarray, symbols: np.ndarray, amounts: np.ndarray,
+                is_buy: bool) -> None:
+        totals = amounts * prices[symbols]
+        fees = calculate_fee(totals)
+
+        if is_buy:
+            np.add.at(account.holdings, symbols, amounts)
+            account.cash -= float(totals.sum() + fees.sum())
+        else:
+            np.subtract.at(account.holdings, symbols, amounts)
+            account.cash += float(totals.sum() - fees.sum())
+
+        self.trades += len(symbols)
+        self.fees += float(fees.sum())
+
+    def _fill_market_orders(self, account: Account, prices: np.ndarray, orders: Orders) -> None:
+        has_price = ~np.isnan(prices)
+
+        for amounts, is_buy in ((orders.buy_amounts, True), (orders.sell_amounts, False)):
+            placed = amounts != 0
+            valid = placed & (amounts > 0) & has_price
+            if not is_buy:
+                valid &= account.holdings != 0
+            self.rejected += int((placed & ~valid).sum())
+
+            symbols = np.flatnonzero(valid)
+            if len(symbols):
+                self._settle(account, prices, symbols, amounts[symbols], is_buy)
+
+    def _fill_pending_orders(self, account: Account, prices: np.ndarray, pending: _PendingOrders) -> None:
+        candidates = np.flatnonzero(pending.active)
+        if len(candidates) == 0:
+            return
+
+        order_prices = prices[pending.symbols[candidates]]
+        triggers = pending.trigger_prices[candidates]
+        crossed = np.where(pending.is_falling[candidates], order_prices <= triggers, order_prices >= triggers)
+        triggered = candidates[crossed & ~np.isnan(order_prices)]
+
+        buys = triggered[pending.is_buy[triggered]]
+        sells = triggered[~pending.is_buy[triggered]]
+        owned = account.holdings[pending.symbols[sells]] != 0
+        pending.active[sells[~owned]] = False
+        self.rejected += int((~owned).sum())
+        sells = sells[owned]
+
+        for filled, is_buy in ((buys, True), (sells, False)):
+            if len(filled):
+                self._settle(account, prices, pending.symbols[filled], pending.amounts[filled], is_buy)
+                pending.active[filled] = False
+
+        pending.compact()
+
+    def run(self) -> BacktestResult:
+        market_data = self.market_data
+        num_steps, num_symbols = market_data.prices.shape
+
+        account = Account(self.starting_cash, num_symbols)
+        orders = Orders(num_symbols)
+        pending = _PendingOrders()
+
+        cash = np.zeros(num_steps)
+        positions_value = np.zeros(num_steps)
+
+        self.strategy.start(market_data, account)
+        for step in range(num_steps):
+            prices = market_data.prices[step]
+
+            orders.clear()
+            self.strategy.on_step(step, prices, account, orders)
+            self._fill_market_orders(account, prices, orders)
+
+            if orders.submitted:
+                # amounts have to be positive, like for orders submitted to the broker
+                valid = [order for order in orders.submitted if order[2] > 0]
+                self.rejected += len(orders.submitted) - len(valid)
+                if valid:
+                    pending.add(valid)
+            # new orders may already be crossed at the current price
+            self._fill_pending_orders(account, prices, pending)
+
+            cash[step] = account.cash
+            positions_value[step] = np.nansum(account.holdings * prices)
+
+        return BacktestResult(market_data, cash, positions_value, account, self.trades, self.rejected, self.fees,
+                              len(pending))
+
+
+def run_backtest(market_data: MarketData, strategy: Strategy, starting_cash: float,
+                 log_filename: Optional[str] = None) -> BacktestResult:
+    result = Backtest(market_data, strategy, starting_cash).run()
+    if log_filename is not None:
+        result.write_log(log_filename)
+    return result
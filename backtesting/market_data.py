@@ -0,0 +1,86 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from broker_simulator.price_source import ReplayPriceSource, SimulatedClock
+
+
+class MarketData:
+    """
+    Prices of many symbols on one shared timeline.
+
+    `prices[t, i]` is the price of `symbols[i]` at `timestamps[t]` (unix seconds): the close of its last bar at or
+    before that time, as the replay price source would serve it, or NaN before the symbol's first bar.
+    """
+
+    def __init__(self, timestamps: np.ndarray, symbols: list[str], prices: np.ndarray):
+        if prices.shape != (len(timestamps), len(symbols)):
+            raise ValueError(f"Prices of shape {prices.shape} don't match {len(timestamps)} timestamps "
+                             f"and {len(symbols)} symbols")
+
+        self.timestamps = timestamps
+        self.symbols = symbols
+        self.prices = prices
+        self._index = {symbol: i for i, symbol in enumerate(symbols)}
+
+    def index_of(self, symbol: str) -> int:
+        return self._index[symbol]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_series(cls, series: dict[str, tuple[np.ndarray, np.ndarray]]) -> "MarketData":
+        """
+        Aligns per-symbol (timestamps, prices) series, sorted by time, on the union of their timestamps.
+        """
+        symbols = sorted(series)
+        timestamps = np.unique(np.concatenate([series[symbol][0] for symbol in symbols])) if symbols \
+            else np.zeros(0, dtype=np.int64)
+
+        prices = np.full((len(timestamps), len(symbols)), np.nan)
+        for i, symbol in enumerate(symbols):
+            symbol_timestamps, symbol_prices = series[symbol]
+            if len(symbol_timestamps) == 0:
+                continue
+            # the last bar at or before every timestamp of the timeline
+            last_bar = np.searchsorted(symbol_timestamps, timestamps, side="right") - 1
+            prices[:, i] = np.where(last_bar >= 0, symbol_prices[np.maximum(last_bar, 0)], np.nan)
+
+        return cls(timestamps, symbols, prices)
+
+
+def load_market_data(data_dir: str, symbols: Optional[list[str]] = None, start: Optional[str] = None,
+                     end: Optional[str] = None, price_column: str = "Close") -> MarketData:
+    """
+    Loads the bars the replay price source reads (`<SYMBOL>.csv` or `<SYMBOL>.parquet` files in `data_dir`).
+
+    :param symbols: The symbols to load, defaults to every file in `data_dir`.
+    :param start: First date of the timeline (inclusive), e.g. "2020-01-01".
+    :param end: Last date of the timeline (inclusive).
+    """
+    if symbols is None:
+        symbols = sorted({os.path.splitext(name)[0] for name in os.listdir(data_dir)
+                          if name.endswith((".csv", ".parquet"))})
+
+    source = ReplayPriceSource(data_dir, SimulatedClock(), price_column=price_column)
+    series = {}
+    for symbol in symbols:
+        symbol_series = source.series(symbol)
+        if symbol_series is None:
+            print(f"No data available for {symbol}")
+            continue
+        series[symbol] = symbol_series
+
+    market_data = MarketData.from_series(series)
+
+    # bars before the start still provide the opening prices, only the timeline is cut
+    mask = np.ones(len(market_data), dtype=bool)
+    if start is not None:
+        mask &= market_data.timestamps >= pd.Timestamp(start, tz="UTC").timestamp()
+    if end is not None:
+        mask &= market_data.timestamps < (pd.Timestamp(end, tz="UTC") + pd.Timedelta(days=1)).timestamp()
+
+    return MarketData(market_data.timestamps[mask], market_data.symbols, market_data.prices[mask])
@@ -0,0 +1,48 @@
+import argparse
+import os
+import time
+
+from backtesting.engine import run_backtest
+from backtesting.market_data import load_market_data
+from backtesting.strategies import MagnificentSevenStrategy, RandomStrategy, RoundTripStrategy
+
+# starting cash of the bots the strategies come from
+STRATEGIES = {
+    "random": (lambda args: RandomStrategy(args.seed), 1_000),
+    "magnificent_seven": (lambda args: MagnificentSevenStrategy(), 3_000),
+    "transaction_cost": (lambda args: RoundTripStrategy(), 1_000),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtests a bot's strategy against locally stored bars.")
+    parser.add_argument("strategy", choices=sorted(STRATEGIES))
+    parser.add_argument("--data-dir", default=os.environ.get('PRICE_REPLAY_DIR'),
+                        help="directory of <SYMBOL>.csv / <SYMBOL>.parquet files, defaults to PRICE_REPLAY_DIR")
+    parser.add_argument("--symbols", nargs="*", default=None, help="defaults to every symbol in the data directory")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--cash", type=float, default=None, help="defaults to the bot's starting cash")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log", default=None, help="time-series file to write the net worth series to")
+    args = parser.parse_args()
+
+    if args.data_dir is None:
+        parser.error("--data-dir or PRICE_REPLAY_DIR is required")
+
+    create_strategy, starting_cash = STRATEGIES[args.strategy]
+
+    started = time.perf_counter()
+    market_data = load_market_data(args.data_dir, args.symbols, args.start, args.end)
+    loaded = time.perf_counter()
+    result = run_backtest(market_data, create_strategy(args), args.cash or starting_cash, args.log)
+    finished = time.perf_counter()
+
+    print(f"{len(market_data)} steps x {len(market_data.symbols)} symbols, "
+          f"loaded in {loaded - started:.2f} s, backtested in {finished - loaded:.2f} s")
+    for key, value in result.summary().items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+from typing import Optional
+
+import numpy as np
+
+from backtesting.engine import Account, Orders, Strategy
+from backtesting.market_data import MarketData
+from utils.stock_symbols import MAGNIFICENT_SEVEN_STOCKS
+
+
+class RandomStrategy(Strategy):
+    """
+    RandomTradingBot's strategy, one random operation per step: either buy a random stock for a random share of
+    the balance or sell a random amount of a random holding.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = np.random.default_rng(seed)
+
+    def on_step(self, step: int, prices: np.ndarray, account: Account, orders: Orders) -> None:
+        if self.rng.random() < 0.5:
+            priced = np.flatnonzero(~np.isnan(prices))
+            if len(priced) == 0:
+                return
+
+            stock = self.rng.choice(priced)
+            max_amount_to_buy = account.cash / prices[stock]
+            if max_amount_to_buy > 0:
+                orders.buy(stock, self.rng.uniform(0, max_amount_to_buy))
+        else:
+            held = np.flatnonzero(account.holdings)
+            if len(held) == 0:
+                return
+
+            stock = self.rng.choice(held)
+            orders.sell(stock, self.rng.uniform(0, account.holdings[stock]))
+
+
+class BuyAndHoldStrategy(Strategy):
+    """
+    Buys fixed amounts of some stocks as soon as they have a price and holds them.
+    """
+
+    def __init__(self, amounts: dict[str, float]):
+        self.amounts = amounts
+        self._targets: Optional[np.ndarray] = None
+        self._bought: Optional[np.ndarray] = None
+
+    def start(self, market_data: MarketData, account: Account) -> None:
+        self._targets = np.zeros(len(market_data.symbols))
+        for stock, amount in self.amounts.items():
+            if stock in market_data.symbols:
+                self._targets[market_data.index_of(stock)] = amount
+            else:
+                print(f"No data available for {stock}")
+        self._bought = self._targets == 0
+
+    def on_step(self, step: int, prices: np.ndarray, account: Account, orders: Orders) -> None:
+        to_buy = ~self._bought & ~np.isnan(prices)
+        orders.buy_amounts[to_buy] = self._targets[to_buy]
+        self._bought |= to_buy
+
+
+class MagnificentSevenStrategy(BuyAndHoldStrategy):
+    """
+    MagnificentSevenTradingBot's strategy: one share of each of the magnificent seven, held.
+    """
+
+    def __init__(self):
+        super().__init__({stock: 1 for stock in MAGNIFICENT_SEVEN_STOCKS})
+
+
+class RoundTripStrategy(Strategy):
+    """
+    TransactionCostTradingBot's strategy: buys and sells the same amount of one stock every step, so the net worth
+    only moves by the fees paid.
+    """
+
+    def __init__(self, stock: str = "MSFT", round_trips: int = 300, amount: float = 1):
+        self.stock = stock
+        self.round_trips = round_trips
+        self.amount = amount
+        self._stock_index: Optional[int] = None
+        self._done = 0
+
+    def start(self, market_data: MarketData, account: Account) -> None:
+        self._stock_index = market_data.index_of(self.stock)
+
+    def on_step(self, step: int, prices: np.ndarray, account: Account, orders: Orders) -> None:
+        if self._done < self.round_trips and not np.isnan(prices[self._stock_index]):
+            orders.buy(self._stock_index, self.amount)
+            orders.sell(self._stock_index, self.amount)
+            self._done += 1
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Optional
+
+import httpx
+import numpy as np
+
+from utils.broker_connector import AsyncBrokerClient
+from utils.broker_response_parser import parse_auth_token, parse_stock_price
+
+DEFAULT_MIX = "buy=4,sell=3,get_net_worth=2,submit_order=1,get_order_book=1"
+DEFAULT_STOCKS = ["AAPL", "MSFT", "GOOG", "AMZN", "META", "NVDA", "TSLA", "NFLX", "AMD", "INTC"]
+OPERATIONS = ("buy", "sell", "get_net_worth", "submit_order", "get_order_book", "get_balance", "get_portfolio")
+ORDER_TYPES = ("limit", "stop_loss", "take_profit")
+PASSWORD = "load-test"
+STARTING_CASH = 1_000_000
+
+
+class LatencyLog:
+    """
+    Latencies and errors of every request, per endpoint.
+    """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def timed(self, endpoint: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            response = None
+        self.latencies[endpoint].append(time.perf_counter() - started)
+
+        if response is None or not response.is_success:
+            self.errors[endpoint] += 1
+            return None
+        return response
+
+    def results(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            endpoints[endpoint] = _summarize(np.array(latencies), self.errors[endpoint], duration)
+
+        all_latencies = np.concatenate([np.array(latencies) for latencies in self.latencies.values()]) \
+            if self.latencies else np.zeros(0)
+        return {"endpoints": endpoints, "total": _summarize(all_latencies, sum(self.errors.values()), duration)}
+
+
+def _summarize(latencies: np.ndarray, errors: int, duration: float) -> dict[str, float]:
+    if len(latencies) == 0:
+        return {"requests": 0, "errors": errors, "throughput": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / duration,  # requests per second
+        "mean": float(latencies.mean()),  # seconds
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+    }
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for entry in mix.split(","):
+        endpoint, _, weight = entry.partition("=")
+        weights[endpoint.strip()] = float(weight or 1)
+    return weights
+
+
+class VirtualUser:
+    """
+    One simulated trader, sending one request at a time from the configured mix until the deadline.
+    """
+
+    def __init__(self, client: AsyncBrokerClient, log: LatencyLog, username: str, stocks: list[str],
+                 reference_prices: dict[str, float], rng: random.Random):
+        self.client = client
+        self.log = log
+        self.username = username
+        self.stocks = stocks
+        self.reference_prices = reference_prices
+        self.rng = rng
+
+        self.token: Optional[str] = None
+        self.holdings: dict[str, float] = defaultdict(float)
+
+    async def setup(self) -> bool:
+        await self.log.timed("create_user", self.client.create_user(self.username, PASSWORD))
+        response = await self.log.timed("login", self.client.authenticate(self.username, PASSWORD))
+        if response is None:
+            return False
+        self.token = parse_auth_token(response)
+        return await self.log.timed("topup", self.client.topup(self.token, STARTING_CASH)) is not None
+
+    async def buy(self):
+        stock = self.rng.choice(self.stocks)
+        if await self.log.timed("buy", self.client.buy_stock(self.token, stock, 1)) is not None:
+            self.holdings[stock] += 1
+
+    async def sell(self):
+        owned = [stock for stock, amount in self.holdings.items() if amount >= 1]
+        if not owned:
+            return await self.buy()
+
+        stock = self.rng.choice(owned)
+        if await self.log.timed("sell", self.client.sell_stock(self.token, stock, 1)) is not None:
+            self.holdings[stock] -= 1
+
+    async def get_net_worth(self):
+        await self.log.timed("get_net_worth", self.client.get_net_worth(self.token))
+
+    async def submit_order(self):
+        # triggers within 2% of the price at the start, so some orders execute during the run
+        stock = self.rng.choice(self.stocks)
+        trigger_price = self.reference_prices[stock] * self.rng.uniform(0.98, 1.02)
+        await self.log.timed("submit_order", self.client.submit_order(self.token, self.rng.choice(ORDER_TYPES),
+                                                                      stock, 1, trigger_price))
+
+    async def get_order_book(self):
+        await self.log.timed("get_order_book", self.client.get_order_book(self.token))
+
+    async def get_balance(self):
+        await self.log.timed("get_balance", self.client.get_balance(self.token))
+
+    async def get_portfolio(self):
+        await self.log.timed("get_portfolio", self.client.get_portfolio(self.token))
+
+    async def run(self, mix: dict[str, float], deadline: float):
+        operations = [getattr(self, endpoint) for endpoint in mix]
+        weights = list(mix.values())
+        while time.perf_counter() < deadline:
+            await self.rng.choices(operations, weights)[0]()
+
+
+async def run_load_test(client: AsyncBrokerClient, users: int, duration: float, mix: dict[str, float],
+                        stocks: list[str], seed: int) -> dict:
+    """
+    Sets up `users` virtual users (price lookups, create_user, login and topup), lets them trade for `duration`
+    seconds and deletes them again.
+
+    :return: Stats per endpoint, setup endpoints over the setup phase and the rest over the trading phase, and the
+        total over the trading phase.
+    """
+    setup_log = LatencyLog()
+    started = time.perf_counter()
+
+    reference_prices = {}
+    for stock in stocks:
+        response = await setup_log.timed("get_stock_price", client.get_stock_price(stock))
+        if response is not None:
+            reference_prices[stock] = parse_stock_price(response)
+    stocks = [stock for stock in stocks if stock in reference_prices]
+    if not stocks:
+        raise RuntimeError("No prices available for any of the stocks")
+
+    run_log = LatencyLog()
+    run_id = f"{int(time.time()):x}"
+    virtual_users = [VirtualUser(client, setup_log, f"load_test_{run_id}_{i}", stocks, reference_prices,
+                                 random.Random(seed + i)) for i in range(users)]
+
+    ready = await asyncio.gather(*(user.setup() for user in virtual_users))
+    setup_duration = time.perf_counter() - started
+    virtual_users = [user for user, is_ready in zip(virtual_users, ready) if is_ready]
+    print(f"{len(virtual_users)} of {users} users ready in {setup_duration:.1f} s")
+
+    for user in virtual_users:
+        user.log = run_log
+    started = time.perf_counter()
+    await asyncio.gather(*(user.run(mix, started + duration) for user in virtual_users))
+    run_duration = time.perf_counter() - started
+
+    # users are cleaned up outside of the measurements
+    cleanup_log = LatencyLog()
+    await asyncio.gather(*(cleanup_log.timed("delete_user", client.delete_user(user.token))
+                           for user in virtual_users))
+
+    results = run_log.results(run_duration)
+    results["endpoints"].update(setup_log.results(setup_duration)["endpoints"])
+    results["endpoints"] = dict(sorted(results["endpoints"].items()))
+    return results
+
+
+@contextlib.asynccontextmanager
+async def in_process_client(pool_size: int):
+    """
+    Runs the app in this process against the in-memory database and synthetic prices, unless configured otherwise.
+    """
+    os.environ.setdefault('DATABASE_BACKEND', 'memory')
+    os.environ.setdefault('PRICE_SOURCE', 'synthetic')
+    os.environ.setdefault('JWT_SECRET_KEY', 'load-test')
+
+    from broker_simulator.app import app  # imported lazily so the environment above is in place
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with AsyncBrokerClient("http://broker", retries=0, pool_size=pool_size, transport=transport) as client:
+            yield client
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict) -> None:
+    print(f"{'endpoint':>16} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in [*results["endpoints"].items(), ("total", results["total"])]:
+        print(f"{endpoint:>16} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>9.1f} "
+              f"{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f}")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Prints the change of every endpoint's throughput and p99 latency against a baseline run.
+
+    :return: The endpoints whose throughput dropped or whose p99 latency rose by more than `threshold` (a fraction).
+    """
+    print(f"{'endpoint':>16} {'req/s':>9} {'baseline':>9} {'change':>8} {'p99 ms':>8} {'baseline':>9} {'change':>8}")
+    regressions = []
+    for endpoint, stats in [*results["endpoints"].items(), ("total", results["total"])]:
+        base = baseline["total"] if endpoint == "total" else baseline["endpoints"].get(endpoint)
+        if base is None or not base["throughput"] or not base["p99"]:
+            continue
+
+        throughput_change = stats["throughput"] / base["throughput"] - 1
+        p99_change = stats["p99"] / base["p99"] - 1
+        regressed = throughput_change < -threshold or p99_change > threshold
+        if regressed:
+            regressions.append(endpoint)
+
+        print(f"{endpoint:>16} {stats['throughput']:>9.1f} {base['throughput']:>9.1f} {throughput_change:>+8.1%} "
+              f"{stats['p99'] * 1000:>8.1f} {base['p99'] * 1000:>9.1f} {p99_change:>+8.1%}"
+              f"{'  regression' if regressed else ''}")
+    return regressions
+
+
+async def _main(args) -> dict:
+    mix = parse_mix(args.mix)
+    unknown = [endpoint for endpoint in mix if endpoint not in OPERATIONS]
+    if unknown:
+        raise ValueError(f"Unknown operations in mix: {', '.join(unknown)}, only {', '.join(OPERATIONS)} are "
+                         f"supported")
+
+    if args.url is None:
+        client_context = in_process_client(args.users)
+    else:
+        client_context = AsyncBrokerClient(args.url, retries=0, pool_size=args.users)
+
+    async with client_context as client:
+        return await run_load_test(client, args.users, args.duration, mix, args.stocks, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests the broker API and reports throughput and latency "
+                                                 "percentiles per endpoint.")
+    parser.add_argument("--url", default=None,
+                        help="broker to test, by default the app runs in this process with DATABASE_BACKEND=memory "
+                             "and PRICE_SOURCE=synthetic")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="weights of the operations every user picks from, also get_balance and get_portfolio")
+    parser.add_argument("--stocks", nargs="*", default=DEFAULT_STOCKS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to store the results in")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative throughput drop or p99 rise counted as a regression")
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = asyncio.run(_main(args))
+    results["meta"] = {
+        "started_at": started_at,
+        "git_commit": _git_commit(),
+        "target": args.url or "in-process",
+        "database_backend": None if args.url else os.environ.get('DATABASE_BACKEND'),
+        "price_source": None if args.url else os.environ.get('PRICE_SOURCE'),
+        "users": args.users,
+        "duration": args.duration,
+        "mix": args.mix,
+        "stocks": args.stocks,
+    }
+
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from broker_simulator.database import Database
+from broker_simulator.matching_engine import MatchingEngine, SIDES
+from broker_simulator.memory_database import InMemoryDatabase
+
+USERNAME_PREFIX = "matching_engine_benchmark"
+STOCK = "MSFT"
+MID_PRICE = 400.0
+USERS = 100
+
+
+def generate_events(count: int, cancel_ratio: float, seed: int) -> list[tuple]:
+    """
+    Random submits around a fixed mid price, a tick of 0.01 apart, and cancels of earlier orders (possibly filled
+    by then). Generated up front so only the engine is timed.
+    """
+    rng = np.random.default_rng(seed)
+    is_cancel = rng.random(count) < cancel_ratio
+    sides = rng.integers(0, 2, count)
+    prices = np.round(MID_PRICE + rng.normal(0, 0.5, count), 2)
+    amounts = rng.integers(1, 101, count).astype(np.float64)
+    users = rng.integers(0, USERS, count)
+
+    events: list[tuple] = []
+    order_ids: list[int] = []
+    for i in range(count):
+        if is_cancel[i] and order_ids:
+            events.append(("cancel", order_ids[rng.integers(len(order_ids))]))
+        else:
+            order_ids.append(i + 1)
+            events.append(("submit", i + 1, f"{USERNAME_PREFIX}_{users[i]}", SIDES[sides[i]], float(prices[i]),
+                           float(amounts[i])))
+    return events
+
+
+def run_engine(events: list[tuple]) -> list:
+    engine = MatchingEngine()
+    latencies = np.empty(len(events), dtype=np.int64)
+    fills = []
+
+    started_at = time.perf_counter()
+    for i, event in enumerate(events):
+        event_started_at = time.perf_counter_ns()
+        if event[0] == "submit":
+            fills.extend(engine.submit(event[1], event[2], STOCK, event[3], event[4], event[5]))
+        else:
+            engine.cancel(event[1])
+        latencies[i] = time.perf_counter_ns() - event_started_at
+    elapsed = time.perf_counter() - started_at
+
+    print(f"  engine: {len(events)} events in {elapsed:.2f}s, {len(events) / elapsed:.0f} events/s, "
+          f"{len(fills)} fills, {len(engine)} orders resting, "
+          f"p50 {np.percentile(latencies, 50) / 1e3:.1f} us, p99 {np.percentile(latencies, 99) / 1e3:.1f} us")
+
+    top = engine.top_of_book(STOCK)
+    print(f"  top of book: {top['bid_amount']:.0f} @ {top['bid']} / {top['ask_amount']:.0f} @ {top['ask']}")
+    return fills
+
+
+def run_settlement(db, fills: list, batch_size: int) -> float:
+    # settling doesn't look up prices, any source will do
+    os.environ.setdefault('PRICE_SOURCE', 'synthetic')
+    from broker_simulator.service import Service  # imported lazily so the environment above is in place
+
+    # every order gets a row to take the filled amounts from, and sellers own enough of the stock
+    usernames = [f"{USERNAME_PREFIX}_{user}" for user in range(USERS)]
+    for username in usernames:
+        if db.user_exists(username):
+            db.delete_user(username)
+        db.create_user(username, "-", "-")
+        db.buy_stock(username, STOCK, 1e12, 0.0, 0.0)
+
+    row_ids: dict[int, int] = {}
+    for fill in fills:
+        for order_id, username, order_type in ((fill.buy_order_id, fill.buyer, "limit"),
+                                               (fill.sell_order_id, fill.seller, "take_profit")):
+            if order_id not in row_ids:
+                row_ids[order_id] = db.submit_order(username, order_type, STOCK, 1e12, fill.price)
+    fills = [fill._replace(buy_order_id=row_ids[fill.buy_order_id], sell_order_id=row_ids[fill.sell_order_id])
+             for fill in fills]
+
+    service = Service(db)
+    try:
+        started_at = time.perf_counter()
+        failed = 0
+        for start in range(0, len(fills), batch_size):
+            failed += len(service.settle_fills(fills[start:start + batch_size]))
+        elapsed = time.perf_counter() - started_at
+    finally:
+        for row_id in row_ids.values():
+            db.delete_order(row_id)
+        for username in usernames:
+            db.delete_user(username)
+
+    fills_per_second = len(fills) / elapsed
+    print(f"  settle in batches of {batch_size:>4}: {len(fills)} fills in {elapsed:.2f}s, "
+          f"{fills_per_second:.0f} fills/s, {failed} failed")
+    return fills_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures order events per second of the matching engine, and fills "
+                                                 "per second settled one per transaction and in batches")
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--cancel-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--settle-fills", type=int, default=2_000, help="fills settled per run")
+    parser.add_argument("--backend", choices=("postgres", "memory"), default="postgres",
+                        help="postgres is the database configured in .env")
+    args = parser.parse_args()
+
+    events = generate_events(args.events, args.cancel_ratio, args.seed)
+    fills = run_engine(events)[:args.settle_fills]
+
+    db = Database() if args.backend == "postgres" else InMemoryDatabase()
+    single = run_settlement(db, fills, 1)
+    batched = run_settlement(db, fills, args.batch_size)
+    print(f"  batching speedup: {batched / single:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import time
+
+from broker_simulator.database import Database
+from broker_simulator.memory_database import InMemoryDatabase
+
+USERNAME = "trade_throughput_benchmark"
+STOCK = "MSFT"
+
+
+def legacy_buy_stock(db: Database, username: str, stock: str, amount: float, total: float, fee: float) -> None:
+    # the previous implementation: existence check, balance update, portfolio read, optional insert, amount update
+    with db.transaction() as cursor:
+        if not db.user_exists(username):
+            raise Exception("This user doesn't exist")
+
+        cursor.execute("UPDATE users_balance SET balance = balance - (%s + %s) WHERE username = %s;",
+                       (total, fee, username))
+
+        if stock not in db.get_portfolio(username):
+            cursor.execute("INSERT INTO users_stocks VALUES (%s, %s, %s);", (username, stock, 0))
+
+        cursor.execute("UPDATE users_stocks SET amount = amount + %s WHERE username = %s AND stock = %s;",
+                       (amount, username, stock))
+
+
+def legacy_sell_stock(db: Database, username: str, stock: str, amount: float, total: float, fee: float) -> None:
+    # the previous implementation: existence check, portfolio read, balance update, amount update, delete
+    with db.transaction() as cursor:
+        if not db.user_exists(username):
+            raise Exception("This user doesn't exist")
+
+        if stock not in db.get_portfolio(username):
+            raise Exception("User doesn't own this stock")
+
+        cursor.execute("UPDATE users_balance SET balance = balance + (%s - %s) WHERE username = %s;",
+                       (total, fee, username))
+        cursor.execute("UPDATE users_stocks SET amount = amount - %s WHERE username = %s AND stock = %s;",
+                       (amount, username, stock))
+        cursor.execute("DELETE FROM users_stocks WHERE username = %s AND stock = %s AND amount = 0;",
+                       (username, stock))
+
+
+def run(name: str, buy, sell, trades: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(trades // 2):
+        buy(USERNAME, STOCK, 1, 100.0, 0.1)
+        sell(USERNAME, STOCK, 1, 100.0, 0.1)
+    elapsed = time.perf_counter() - started_at
+
+    trades_per_second = trades / elapsed
+    print(f"{name:>8}: {trades} trades in {elapsed:.2f}s, {trades_per_second:.0f} trades/s")
+    return trades_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares trades per second of the legacy and single-statement "
+                                                 "trade paths against the database configured in .env, and of the "
+                                                 "in-memory backend")
+    parser.add_argument("--trades", type=int, default=2_000)
+    args = parser.parse_args()
+
+    db = Database()
+    if db.user_exists(USERNAME):
+        db.delete_user(USERNAME)
+    db.create_user(USERNAME, "-", "-")
+    db.topup(USERNAME, 1_000_000)
+
+    try:
+        before = run("legacy",
+                     lambda *trade: legacy_buy_stock(db, *trade),
+                     lambda *trade: legacy_sell_stock(db, *trade),
+                     args.trades)
+        after = run("current", db.buy_stock, db.sell_stock, args.trades)
+        print(f"speedup: {after / before:.2f}x")
+
+        # the same trades without Postgres, the difference is what the database costs per trade
+        memory_db = InMemoryDatabase()
+        memory_db.create_user(USERNAME, "-", "-")
+        memory_db.topup(USERNAME, 1_000_000)
+        baseline = run("memory", memory_db.buy_stock, memory_db.sell_stock, args.trades)
+        print(f"database overhead: {(1 / after - 1 / baseline) * 1e6:.0f} us per trade")
+    finally:
+        db.delete_user(USERNAME)
+
+
+if __name__ == "__main__":
+    main()
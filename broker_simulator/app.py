@@ -1,24 +1,93 @@
+import asyncio
+import hmac
 import os
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
+from broker_simulator.concurrency import blocking_executor, password_executor, run_blocking, run_password_hashing
 from broker_simulator.data_models import UserCreate, UserLogin, BuyStockRequest, SellStockRequest, TopUpRequest, StockPriceRequest, \
-    SubmitOrderRequest
-from broker_simulator.database import Database
+    SubmitOrderRequest, RefreshTokenRequest, BatchRequest, MessageResponse, TokenResponse, BalanceResponse, \
+    StockPriceResponse, PortfolioResponse, NetWorthResponse, SubmitOrderResponse, BatchResponse, OrderBookPage, \
+    TopOfBook, OrderBookDepth, ProfilingConfigRequest, ProfileDumpResponse
+from broker_simulator.database import create_database, DATABASE_BACKEND
+from broker_simulator.matching_engine import DEPTH_LEVELS
+from broker_simulator.metrics import Counter, Gauge, Histogram, HttpMetricsMiddleware, REGISTRY, CONTENT_TYPE
+from broker_simulator.order_processor import OrderProcessor
+from broker_simulator.profiling import ProfilingMiddleware, profiler
 from broker_simulator.salted_password import SaltedPassword
-from broker_simulator.service import Service
+from broker_simulator.service import Service, ORDER_BOOK_PAGE_SIZE, ORDER_BOOK_MAX_PAGE_SIZE
+from broker_simulator.stock_info import get_price_cache_stats, get_stock_prices
+from broker_simulator.streaming import EventBus, PriceStreamer, OrderFillListener, price_topic, account_topic, \
+    STREAM_QUEUE_SIZE
+from broker_simulator.token_cache import VerifiedTokenCache
+from broker_simulator.trigger_book import TriggerBook
 
 load_dotenv()
 
-app = FastAPI()
-db = Database()
-service = Service(db)
+# the in-memory database isn't shared with other processes, so its orders have to be processed by the app
+ORDER_PROCESSOR_IN_APP = os.environ.get('ORDER_PROCESSOR_IN_APP',
+                                        'true' if DATABASE_BACKEND == 'memory' else 'false').lower() == 'true'
+# admin endpoints are only served when a token is set, requests authenticate with the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_DUMP_DIR = os.environ.get('PROFILE_DUMP_DIR', 'profiles')
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    order_fill_listener.start()
+    price_streamer_task = asyncio.create_task(price_streamer.run())
+
+    order_processor_thread = None
+    if order_processor is not None:
+        order_processor_thread = threading.Thread(target=order_processor.run, daemon=True)
+        order_processor_thread.start()
+
+    yield
+
+    if order_processor_thread is not None:
+        order_processor.stop()
+        order_processor_thread.join()
+    price_streamer_task.cancel()
+    order_fill_listener.stop()
+
+
+# responses are rendered with orjson, numbers and objects are sent as JSON values
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(HttpMetricsMiddleware,
+                   duration=Histogram("broker_http_request_duration_seconds", "Duration of HTTP requests",
+                                      ("endpoint",)),
+                   requests=Counter("broker_http_requests", "HTTP requests answered", ("endpoint", "status")),
+                   in_flight=Gauge("broker_http_requests_in_flight", "HTTP requests in progress", ("endpoint",)))
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+db = create_database()
+event_bus = EventBus()
+service = Service(db, event_bus=event_bus)
+price_streamer = PriceStreamer(event_bus, get_stock_prices)
+order_fill_listener = OrderFillListener(event_bus, db)
+
+order_processor = None
+if ORDER_PROCESSOR_IN_APP:
+    order_processor_trigger_book = TriggerBook()
+    order_processor = OrderProcessor(Service(db, order_processor_trigger_book), order_processor_trigger_book)
+    # book snapshots straight from the matching engine instead of aggregating the pending orders
+    service.matching_engine = order_processor.matching_engine
+    service.add_deleted_order_listener(order_processor.forget)
 
 JWT_SECRET_KEY = os.environ['JWT_SECRET_KEY']
 JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = float(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 60))
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 7))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 10_000))
+
+token_cache = VerifiedTokenCache(TOKEN_CACHE_MAX_SIZE)
 
 # Define the OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -27,162 +96,433 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 # Utility function to create access token
 def create_access_token(data: dict):
     to_encode = data.copy()
+    to_encode["exp"] = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 
+# Utility function to create a long-lived token that can be exchanged for access tokens without a password check
+def create_refresh_token(username: str):
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {"sub": username, "type": "refresh", "exp": expire}
+    return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
 # Utility function to get current user
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    # tokens seen before skip the signature check until they expire
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("type") == "refresh":
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        token_cache.put(token, username, payload.get("exp"))
         return username
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
 
-@app.post("/create_user", status_code=200)
+@app.post("/create_user", status_code=200, response_model=MessageResponse)
 async def create_user(user: UserCreate):
     try:
-        password_object = SaltedPassword(user.password)
-        service.create_user(user.username, password_object.password_hash, password_object.salt)
+        password_object = await run_password_hashing(SaltedPassword, user.password)
+        await run_blocking(service.create_user, user.username, password_object.password_hash, password_object.salt)
         return {"message": "User created successfully"}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.post("/delete_user", status_code=200)
+@app.post("/delete_user", status_code=200, response_model=MessageResponse)
 async def delete_user(username: str = Depends(get_current_user)):
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        service.delete_user(username)
+        await run_blocking(service.delete_user, username)
         return {"message": "User deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.post("/login", status_code=200)
+@app.post("/login", status_code=200, response_model=TokenResponse)
 async def login(user: UserLogin):
     username = user.username
     password = user.password
     try:
-        stored_password_hash, salt = service.get_user_password_and_salt(username)
-        if SaltedPassword.check_password(password, stored_password_hash, salt):
+        stored_password_hash, salt = await run_blocking(service.get_user_password_and_salt, username)
+        if await run_password_hashing(SaltedPassword.check_password, password, stored_password_hash, salt):
             access_token = create_access_token(data={"sub": username})
-            return {"access_token": access_token, "token_type": "bearer"}
+            refresh_token = create_refresh_token(username)
+            return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+
+@app.post("/refresh", status_code=200, response_model=TokenResponse)
+async def refresh(refresh_request: RefreshTokenRequest):
+    try:
+        payload = jwt.decode(refresh_request.refresh_token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+    username: str = payload.get("sub")
+    if username is None or payload.get("type") != "refresh":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+    try:
+        if not await run_blocking(service.user_exists, username):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+        access_token = create_access_token(data={"sub": username})
+        return {"access_token": access_token, "refresh_token": refresh_request.refresh_token, "token_type": "bearer"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.get("/get_balance", status_code=200)
+@app.get("/get_balance", status_code=200, response_model=BalanceResponse)
 async def get_balance(token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        return {"balance": f"{service.get_balance(username)}"}
+        balance = await run_blocking(service.get_balance, username)
+        return {"balance": balance}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.put("/topup", status_code=200)
+@app.put("/topup", status_code=200, response_model=MessageResponse)
 async def topup(topup_request: TopUpRequest, token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        service.topup(username, topup_request.amount)
+        await run_blocking(service.topup, username, topup_request.amount)
         return {"message": "Operation was successful"}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.get("/get_stock_price", status_code=200)
+@app.get("/get_stock_price", status_code=200, response_model=StockPriceResponse)
 async def get_stock_price(stock_request: StockPriceRequest):
     try:
-        return {"stock_price": Service.stock_price(stock_request.stock)}
+        return {"stock_price": await run_blocking(Service.stock_price, stock_request.stock)}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.put("/buy", status_code=200)
+@app.put("/buy", status_code=200, response_model=MessageResponse)
 async def buy_stock(buy_stock_request: BuyStockRequest, token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        service.buy_stock(username, buy_stock_request.stock, buy_stock_request.amount)
+        await run_blocking(service.buy_stock, username, buy_stock_request.stock, buy_stock_request.amount)
         return {"message": "Operation was successful"}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.put("/sell", status_code=200)
+@app.put("/sell", status_code=200, response_model=MessageResponse)
 async def sell_stock(sell_stock_request: SellStockRequest, token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        service.sell_stock(username, sell_stock_request.stock, sell_stock_request.amount)
+        await run_blocking(service.sell_stock, username, sell_stock_request.stock, sell_stock_request.amount)
         return {"message": "Operation was successful"}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.get("/get_portfolio", status_code=200)
+@app.get("/get_portfolio", status_code=200, response_model=PortfolioResponse)
 async def get_portfolio(token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        portfolio = service.get_portfolio(username)
-        return {"portfolio": f"{portfolio}"}
+        portfolio = await run_blocking(service.get_portfolio, username)
+        return {"portfolio": portfolio}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.get("/get_net_worth", status_code=200)
-async def get_net_worth(token: str = Depends(oauth2_scheme)):
+@app.get("/get_net_worth", status_code=200, response_model=NetWorthResponse,
+         response_model_exclude_none=True)
+async def get_net_worth(breakdown: bool = False, token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        net_worth = service.get_net_worth(username)
-        return {"net_worth": f"{net_worth}"}
+        net_worth_breakdown = await run_blocking(service.get_net_worth_breakdown, username)
+        if breakdown:
+            return {"net_worth": net_worth_breakdown["net_worth"], "breakdown": net_worth_breakdown}
+        return {"net_worth": net_worth_breakdown["net_worth"]}
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.put("/submit_order", status_code=200)
+@app.put("/submit_order", status_code=200, response_model=SubmitOrderResponse)
 async def submit_order(submit_order_request: SubmitOrderRequest, token: str = Depends(oauth2_scheme)):
     username: str = get_current_user(token)
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     try:
-        service.submit_order(username, submit_order_request.order_type,
-                             submit_order_request.stock,
-                             submit_order_request.amount,
-                             submit_order_request.trigger_price)
+        order_id = await run_blocking(service.submit_order, username, submit_order_request.order_type,
+                                      submit_order_request.stock,
+                                      submit_order_request.amount,
+                                      submit_order_request.trigger_price)
+
+        return {"message": "Order submitted successfully", "order_id": order_id}
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+
+@app.post("/batch", status_code=200, response_model=BatchResponse)
+async def batch(batch_request: BatchRequest, token: str = Depends(oauth2_scheme)):
+    username: str = get_current_user(token)
+    if username is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+    try:
+        committed, results = await run_blocking(service.execute_batch, username, batch_request.operations,
+                                                batch_request.mode)
+        return {"committed": committed, "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+
+def _check_order_book_filter(token: str, username: str | None) -> None:
+    # the book is open to every logged in user, the orders of a single user only to that user
+    current_user: str = get_current_user(token)
+    if username is not None and username != current_user:
+        raise HTTPException(status_code=403, detail="Only your own orders can be filtered by username")
+
+
+@app.get("/get_order_book", status_code=200, response_model=OrderBookPage)
+async def get_order_book(after: int = 0, limit: int = ORDER_BOOK_PAGE_SIZE, stock: str | None = None,
+                         order_type: str | None = None, username: str | None = None,
+                         token: str = Depends(oauth2_scheme)):
+    _check_order_book_filter(token, username)
+    try:
+        page = await run_blocking(service.get_order_book, after, limit, stock, order_type, username)
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+    # returned as a response so the rows go straight to orjson, response_model then only documents the schema
+    # instead of validating every row into an Order
+    return ORJSONResponse(page)
+
+
+@app.get("/stream_order_book", status_code=200)
+async def stream_order_book(stock: str | None = None, order_type: str | None = None, username: str | None = None,
+                            token: str = Depends(oauth2_scheme)):
+    _check_order_book_filter(token, username)
+    # the first page is read before responding so invalid filters still get an error status
+    try:
+        page = await run_blocking(service.get_order_book, 0, ORDER_BOOK_MAX_PAGE_SIZE, stock, order_type, username,
+                                  False)
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+    # every order on its own line, sent page by page so the full dump is never held in memory
+    async def lines():
+        nonlocal page
+        while True:
+            yield b"".join(orjson.dumps(order) + b"\n" for order in page["order_book"])
+            if page["next_cursor"] is None:
+                return
+            page = await run_blocking(service.get_order_book, page["next_cursor"], ORDER_BOOK_MAX_PAGE_SIZE, stock,
+                                      order_type, username, False)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/get_top_of_book", status_code=200, response_model=TopOfBook)
+async def get_top_of_book(stock: str):
+    try:
+        return await run_blocking(service.get_top_of_book, stock)
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+
+@app.get("/get_order_book_depth", status_code=200, response_model=OrderBookDepth)
+async def get_order_book_depth(stock: str, levels: int = DEPTH_LEVELS):
+    try:
+        return await run_blocking(service.get_order_book_depth, stock, levels)
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+
+async def _serve_stream(websocket: WebSocket, queue: asyncio.Queue, on_message, transform):
+    # events are sent and client messages received concurrently until either side fails or disconnects
+    async def send_events():
+        while True:
+            event = await queue.get()
+            await websocket.send_text(orjson.dumps(await transform(event)).decode())
+
+    async def receive_messages():
+        while True:
+            await on_message(await websocket.receive_json())
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_messages())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"WebSocket stream closed: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        event_bus.unsubscribe_all(queue)
+
+
+def _is_symbol_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(stock, str) for stock in value)
+
+
+@app.websocket("/ws/prices")
+async def stream_prices(websocket: WebSocket):
+    await websocket.accept()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    async def on_message(message):
+        # a bare string would be iterated character by character, and a message that isn't an object has neither key
+        invalid = [key for key in ("subscribe", "unsubscribe")
+                   if not isinstance(message, dict) or not _is_symbol_list(message.get(key, []))]
+        if invalid:
+            if not queue.full():
+                queue.put_nowait({"type": "error", "detail": f"{' and '.join(invalid)} has to be a list of symbols"})
+            return
+
+        for stock in message.get("unsubscribe", []):
+            event_bus.unsubscribe(price_topic(stock), queue)
+
+        subscribe = message.get("subscribe", [])
+        for stock in subscribe:
+            event_bus.subscribe(price_topic(stock), queue)
+
+        # new subscribers get the current price right away instead of waiting for the next change
+        if subscribe:
+            for stock, stock_price in (await run_blocking(Service.stock_prices, subscribe)).items():
+                if stock_price is not None and not queue.full():
+                    queue.put_nowait({"type": "price", "stock": stock, "price": float(stock_price)})
+
+    async def transform(event: dict):
+        return event
+
+    await _serve_stream(websocket, queue, on_message, transform)
+
+
+@app.websocket("/ws/account")
+async def stream_account(websocket: WebSocket, token: str | None = None):
+    if token is None:
+        authorization = websocket.headers.get("authorization", "")
+        token = authorization.removeprefix("Bearer ").strip() or None
+
+    try:
+        if token is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        username: str = get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    event_bus.subscribe(account_topic(username), queue)
+
+    # every event is sent together with the balance and portfolio it resulted in
+    async def transform(event: dict):
+        account = await run_blocking(service.get_account, username)
+        return {**event, "balance": account["balance"], "portfolio": account["portfolio"]}
+
+    async def on_message(_: dict):
+        pass
+
+    queue.put_nowait({"type": "snapshot"})
+    await _serve_stream(websocket, queue, on_message, transform)
+
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
 
-        return {"Order submitted successfully"}
+@app.get("/admin/profiling", status_code=200, dependencies=[Depends(require_admin)])
+async def get_profiling():
+    return profiler.stats()
+
+
+@app.put("/admin/profiling", status_code=200, dependencies=[Depends(require_admin)])
+async def configure_profiling(config: ProfilingConfigRequest):
+    try:
+        profiler.configure(config.enabled, config.sample_rate, config.endpoints, config.interval)
+        return profiler.stats()
     except Exception as e:
         raise HTTPException(status_code=403, detail=f"Exception: {e}")
 
 
-@app.get("/get_order_book", status_code=200)
-async def get_order_book():
+@app.delete("/admin/profiling", status_code=200, response_model=MessageResponse, dependencies=[Depends(require_admin)])
+async def reset_profiling():
+    profiler.reset()
+    return {"message": "Profiles cleared"}
+
+
+@app.get("/admin/profiling/flamegraph", status_code=200, response_class=PlainTextResponse,
+         dependencies=[Depends(require_admin)])
+async def get_flamegraph(endpoint: str | None = None):
+    # folded stacks: pipe into flamegraph.pl or open in speedscope
+    return PlainTextResponse(profiler.folded_stacks(endpoint))
+
+
+@app.post("/admin/profiling/dump", status_code=200, response_model=ProfileDumpResponse,
+          dependencies=[Depends(require_admin)])
+async def dump_profile(endpoint: str | None = None):
+    # only endpoints the profiler labelled, route paths or "other", go into the file name, anything else the request
+    # sends is rejected before a path is built from it
+    if endpoint is not None and endpoint not in profiler.stats()["profiled"]:
+        raise HTTPException(status_code=404, detail=f"No profile for the endpoint {endpoint}")
+    suffix = f"-{endpoint.strip('/').replace('/', '_')}" if endpoint else ""
+    path = os.path.join(PROFILE_DUMP_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}{suffix}.folded")
     try:
-        return {"order_book": service.get_order_book()}
+        stacks = await run_blocking(profiler.dump, path, endpoint)
+        return {"path": path, "stacks": stacks}
     except Exception as e:
-        raise HTTPException(status_code=403, detail=f"Exception: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=403, detail=f"Exception: {e}")
+
+
+@app.get("/metrics", status_code=200, response_class=PlainTextResponse)
+async def metrics():
+    # rendering is a walk over the series already aggregated in memory, nothing is computed per scrape
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats", status_code=200)
+async def stats():
+    return {
+        "price_cache": get_price_cache_stats(),
+        "db_pool": db.pool_stats(),
+        "executor": blocking_executor.stats(),
+        "password_verifier": password_executor.stats(),
+        "token_cache": token_cache.stats(),
+        "streams": event_bus.stats(),
+        "order_book_cache": service.order_book_cache.stats(),
+    }
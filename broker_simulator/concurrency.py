@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from dotenv import load_dotenv
+
+from broker_simulator.profiling import profiled_endpoint, profiler
+
+load_dotenv()  # load .env variables
+
+BLOCKING_EXECUTOR_MAX_WORKERS = int(os.environ.get('BLOCKING_EXECUTOR_MAX_WORKERS', 32))
+# bcrypt is CPU bound and releases the GIL, so more workers than cores only adds contention
+PASSWORD_EXECUTOR_MAX_WORKERS = int(os.environ.get('PASSWORD_EXECUTOR_MAX_WORKERS', os.cpu_count() or 2))
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """
+    Bounded thread pool for the blocking work (psycopg2 queries, price fetches) done on behalf of async handlers,
+    so the event loop keeps serving other requests while a query or an HTTP fetch is in progress.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.completed = 0
+
+    def _call(self, started: threading.Event, context: contextvars.Context, func: Callable[..., T], *args,
+              **kwargs) -> T:
+        with self._lock:
+            if not started.is_set():
+                started.set()
+                self._pending -= 1
+            self._running += 1
+        try:
+            endpoint = context.get(profiled_endpoint)
+            if endpoint is None:
+                return context.run(func, *args, **kwargs)
+            with profiler.profile_thread(endpoint):
+                return context.run(func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._pending += 1
+
+        # the context is copied so that context variables set by the handler are visible to the worker thread
+        started = threading.Event()
+        call = functools.partial(self._call, started, contextvars.copy_context(), func, *args, **kwargs)
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        finally:
+            with self._lock:
+                if not started.is_set():  # cancelled before a worker picked it up
+                    started.set()
+                    self._pending -= 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": self._pending,
+                "completed": self.completed,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+blocking_executor = BlockingExecutor(BLOCKING_EXECUTOR_MAX_WORKERS)
+password_executor = BlockingExecutor(PASSWORD_EXECUTOR_MAX_WORKERS)
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    return await blocking_executor.run(func, *args, **kwargs)
+
+
+async def run_password_hashing(func: Callable[..., T], *args, **kwargs) -> T:
+    return await password_executor.run(func, *args, **kwargs)
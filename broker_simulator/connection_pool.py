@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from broker_simulator.custom_exceptions import DBException
+
+postgres_connection = psycopg2.extensions.connection
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are created lazily up to `max_size`, `min_size` of them are opened up front. Idle connections that
+    have not been used for `health_check_interval` seconds are checked with `SELECT 1` before being handed out and
+    replaced if they turn out to be broken. `on_connect` runs once for every new connection.
+    """
+
+    def __init__(self, connect: Callable[[], postgres_connection], min_size: int = 1, max_size: int = 10,
+                 acquire_timeout: float = 30.0, health_check_interval: float = 30.0,
+                 on_connect: Optional[Callable[[postgres_connection], None]] = None):
+        if min_size < 0 or max_size <= 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size. min_size: {min_size}, max_size: {max_size}")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.on_connect = on_connect
+
+        self._condition = threading.Condition()
+        self._idle: deque[tuple[postgres_connection, float]] = deque()  # (connection, released_at)
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+            self._size += 1
+
+    def _new_connection(self) -> postgres_connection:
+        conn = self._connect()
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        self.created += 1
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: postgres_connection) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: postgres_connection) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self.discarded += 1
+
+    def acquire(self) -> postgres_connection:
+        started_at = time.monotonic()
+        deadline = started_at + self.acquire_timeout
+
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise DBException("Connection pool is closed")
+
+                    if self._idle:
+                        conn, released_at = self._idle.pop()
+                        needs_check = time.monotonic() - released_at >= self.health_check_interval
+                        break
+
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, needs_check = None, False
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise DBException(f"Timed out after {self.acquire_timeout}s waiting for a database connection")
+                    self._condition.wait(remaining)
+
+            # connecting and health checks happen outside the lock, the slot is already reserved
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception as e:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise DBException(f"Could not connect to the database: {e}")
+            elif conn.closed or (needs_check and not self._is_healthy(conn)):
+                self._discard(conn)
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                continue
+
+            with self._condition:
+                waited = time.monotonic() - started_at
+                self._in_use += 1
+                self.acquisitions += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+            return conn
+
+    def release(self, conn: postgres_connection) -> None:
+        reusable = not conn.closed
+        if reusable:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                reusable = False  # broken connection, its slot goes to a new one
+
+        with self._condition:
+            self._in_use -= 1
+
+            if self._closed or not reusable or conn.closed:
+                self._discard(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[postgres_connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict[str, float]:
+        with self._condition:
+            return {
+                "size": self._size,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "utilization": self._in_use / self.max_size,
+                "acquisitions": self.acquisitions,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "mean_wait": self.total_wait / self.acquisitions if self.acquisitions else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+                self._size -= 1
+            self._condition.notify_all()
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -20,6 +22,10 @@ class UserLogin(BaseModel):
     password: str
 
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
 class BuyStockRequest(BaseModel):
     stock: str
     amount: float
@@ -42,4 +48,110 @@ class SubmitOrderRequest(BaseModel):
     order_type: str
     stock: str
     amount: float
-    trigger_price: float
\ No newline at end of file
+    trigger_price: float
+
+
+class BatchOperation(BaseModel):
+    operation: str  # buy, sell or submit_order
+    stock: str
+    amount: float
+    order_type: Optional[str] = None
+    trigger_price: Optional[float] = None
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation]
+    mode: str = "all_or_nothing"  # or best_effort
+
+
+class ProfilingConfigRequest(BaseModel):
+    # settings left out are kept
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = None
+    endpoints: Optional[list[str]] = None
+    interval: Optional[float] = None
+
+
+class MessageResponse(BaseModel):
+    message: str
+
+
+class TokenResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+
+
+class BalanceResponse(BaseModel):
+    balance: float
+
+
+class StockPriceResponse(BaseModel):
+    stock_price: Optional[float]
+
+
+class PortfolioResponse(BaseModel):
+    portfolio: dict[str, float]  # stock -> amount
+
+
+class Holding(BaseModel):
+    amount: float
+    price: float
+    value: float
+
+
+class NetWorthBreakdown(BaseModel):
+    net_worth: float
+    cash: float
+    holdings: dict[str, Holding]
+
+
+class NetWorthResponse(BaseModel):
+    net_worth: float
+    breakdown: Optional[NetWorthBreakdown] = None
+
+
+class SubmitOrderResponse(BaseModel):
+    message: str
+    order_id: int
+
+
+class BatchResult(BaseModel):
+    success: bool
+    order_id: Optional[int]
+    detail: Optional[str]
+
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: list[BatchResult]
+
+
+class OrderBookPage(BaseModel):
+    order_book: list[Order]
+    next_cursor: Optional[int]
+
+
+class TopOfBook(BaseModel):
+    stock: str
+    bid: Optional[float]
+    bid_amount: float
+    ask: Optional[float]
+    ask_amount: float
+
+
+class PriceLevel(BaseModel):
+    price: float
+    amount: float
+    orders: int
+
+
+class OrderBookDepth(BaseModel):
+    stock: str
+    bids: list[PriceLevel]
+    asks: list[PriceLevel]
+
+
+class ProfileDumpResponse(BaseModel):
+    path: str
+    stacks: int
@@ -1,144 +1,274 @@
 import os
+import select
 import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 import psycopg2
 from dotenv import load_dotenv
 
+from broker_simulator.connection_pool import ConnectionPool
 from broker_simulator.custom_exceptions import DBException
 from broker_simulator.data_models import Order
+from broker_simulator.metrics import Counter, Gauge, Histogram, instrument
 
 load_dotenv()  # load .env variables
 
 postgres_connection = psycopg2.extensions.connection
 postgres_cursor = psycopg2.extensions.cursor
 
+ORDERS_CHANNEL = "users_orders"  # notified with the order id whenever an order is submitted
+ORDER_FILLS_CHANNEL = "order_fills"  # notified with a JSON description of every executed order
 
+DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'postgres')  # "postgres" or "memory"
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', 30.0))  # seconds
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30.0))  # seconds
+
+# methods that manage transactions and connections rather than run queries
+UNTIMED_METHODS = ("transaction", "snapshot", "savepoint", "listen", "pool_stats", "close")
+
+db_query_duration = Histogram("broker_db_query_duration_seconds", "Duration of database queries", ("query",))
+db_query_errors = Counter("broker_db_query_errors", "Database queries that raised", ("query",))
+db_queries_in_flight = Gauge("broker_db_queries_in_flight", "Database queries in progress", ("query",))
+
+
+def _connect() -> postgres_connection:
+    dbname = os.environ['RDS_DB_NAME']
+    user = os.environ['RDS_USERNAME']
+    host = os.environ['RDS_ENDPOINT']
+    password = os.environ['RDS_PASSWORD']
+    port = os.environ['RDS_PORT']
+
+    sys.stdout.flush()
+
+    return psycopg2.connect(database=dbname,
+                            user=user,
+                            host=host,
+                            password=password,
+                            port=port)
+
+
+def instrument_queries(cls):
+    """
+    Class decorator recording the duration, errors and calls in flight of every public query method of a storage
+    backend, labelled by the method name. Nested calls, such as get_balance checking user_exists, are recorded too.
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or name in UNTIMED_METHODS or not callable(method):
+            continue
+        setattr(cls, name, instrument(method, db_query_duration.labels(name), db_queries_in_flight.labels(name),
+                                      db_query_errors.labels(name)))
+    return cls
+
+
+@instrument_queries
 class Database:
     def __init__(self):
-        dbname = os.environ['RDS_DB_NAME']
-        user = os.environ['RDS_USERNAME']
-        host = os.environ['RDS_ENDPOINT']
-        password = os.environ['RDS_PASSWORD']
-        port = os.environ['RDS_PORT']
-
-        sys.stdout.flush()
-
-        self.conn: postgres_connection = psycopg2.connect(database=dbname,
-                                                          user=user,
-                                                          host=host,
-                                                          password=password,
-                                                          port=port)
-
-        self.cursor: postgres_cursor = self.conn.cursor()
-        self._execute_prepared_statements()
-
-    def _execute_prepared_statements(self):
-        self.cursor.execute("""
-                                            PREPARE insert_user_plan AS 
-                                            INSERT INTO users (username, password_hash, salt) 
-                                            VALUES ($1, $2, $3);
-                                        """)
-
-        self.cursor.execute("""
-                                            PREPARE insert_user_balance_plan AS 
-                                            INSERT INTO users_balance (username, balance) 
-                                            VALUES ($1, 0);
-                                        """)
+        self.pool = ConnectionPool(_connect,
+                                   min_size=DB_POOL_MIN_SIZE,
+                                   max_size=DB_POOL_MAX_SIZE,
+                                   acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+                                   health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+                                   on_connect=self._execute_prepared_statements)
+
+        # cursor of the transaction currently open on each thread
+        self._local = threading.local()
+
+    @staticmethod
+    def _execute_prepared_statements(conn: postgres_connection):
+        # prepared statements belong to the session, so every pooled connection needs its own
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                                                PREPARE insert_user_plan AS 
+                                                INSERT INTO users (username, password_hash, salt) 
+                                                VALUES ($1, $2, $3);
+                                            """)
+
+            cursor.execute("""
+                                                PREPARE insert_user_balance_plan AS 
+                                                INSERT INTO users_balance (username, balance) 
+                                                VALUES ($1, 0);
+                                            """)
+        conn.commit()
+
+    @contextmanager
+    def transaction(self) -> Iterator[postgres_cursor]:
+        """
+        Runs the enclosed queries in one transaction on a pooled connection.
+
+        The transaction is committed when the block exits normally and rolled back when it raises. Nested calls on
+        the same thread join the enclosing transaction instead of opening a new one.
+        """
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is not None:
+            yield cursor
+            return
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self._local.cursor = cursor
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._local.cursor = None
+                cursor.close()
+
+    @contextmanager
+    def snapshot(self) -> Iterator[postgres_cursor]:
+        """
+        Runs the enclosed reads in a REPEATABLE READ transaction, so they all see the database as of the first one.
+        The default READ COMMITTED level gives every statement a fresh snapshot, so a write committed between two
+        reads would show in the second only. Inside an enclosing transaction the reads join it at its level.
+        """
+        in_transaction = getattr(self._local, "cursor", None) is not None
+        with self.transaction() as cursor:
+            if not in_transaction:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            yield cursor
+
+    @contextmanager
+    def savepoint(self) -> Iterator[postgres_cursor]:
+        """
+        Runs the enclosed queries in a savepoint of the current transaction, so a failure only undoes them.
+        """
+        with self.transaction() as cursor:
+            self._local.savepoints = getattr(self._local, "savepoints", 0) + 1
+            name = f"savepoint_{self._local.savepoints}"
+
+            cursor.execute(f"SAVEPOINT {name};")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {name};")
+                raise
+            else:
+                cursor.execute(f"RELEASE SAVEPOINT {name};")
+            finally:
+                self._local.savepoints -= 1
+
+    def _write_transaction(self, commit: bool):
+        # with commit=False the caller owns the transaction and has to have opened it already
+        if not commit and getattr(self._local, "cursor", None) is None:
+            raise DBException("commit=False requires an enclosing transaction")
+        return self.transaction()
+
+    def notify(self, channel: str, payload: str) -> None:
+        # delivered to listeners when the current transaction commits, dropped if it rolls back
+        with self.transaction() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s);", (channel, payload))
+
+    def notify_many(self, channel: str, payloads: list[str]) -> None:
+        with self.transaction() as cursor:
+            cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload;", (channel, payloads))
+
+    def listen(self, channel: str) -> "NotificationListener":
+        return NotificationListener(channel)
+
+    def pool_stats(self) -> dict[str, float]:
+        return self.pool.stats()
 
     def user_exists(self, username: str) -> bool:
         # Prepare the SQL query using parameterized statements for safety
         query = "SELECT EXISTS(SELECT 1 FROM users WHERE username = %s);"
 
-        # Execute the query with the username parameter
-        self.cursor.execute(query, (username,))
+        with self.transaction() as cursor:
+            # Execute the query with the username parameter
+            cursor.execute(query, (username,))
 
-        # Fetch the result
-        (exists,) = self.cursor.fetchone()
+            # Fetch the result
+            (exists,) = cursor.fetchone()
 
         return exists
 
     def get_user_password_and_salt(self, username: str) -> tuple[str, str]:
-        if not self.user_exists(username):
-            raise DBException("User doesn't exist")
+        with self.transaction() as cursor:
+            if not self.user_exists(username):
+                raise DBException("User doesn't exist")
 
-        # Prepare the SQL query using parameterized statements for safety
-        query = "SELECT password_hash, salt FROM users WHERE username = %s;"
+            # Prepare the SQL query using parameterized statements for safety
+            query = "SELECT password_hash, salt FROM users WHERE username = %s;"
 
-        # Execute the query with the username parameter
-        self.cursor.execute(query, (username,))
+            # Execute the query with the username parameter
+            cursor.execute(query, (username,))
 
-        # Fetch the result
-        query_result = self.cursor.fetchall()
+            # Fetch the result
+            query_result = cursor.fetchall()
 
         return query_result
 
     def create_user(self, username: str, hashed_password_hex: str, salt_hex: str) -> None:
-        if self.user_exists(username):
-            raise DBException("This user already exists")
-
-        try:
-            # Execute the prepared statement with provided parameters
-            self.cursor.execute("EXECUTE insert_user_plan (%s, %s, %s)", (username, hashed_password_hex, salt_hex))
-            self.cursor.execute("EXECUTE insert_user_balance_plan (%s)", (username,))
+        with self.transaction() as cursor:
+            if self.user_exists(username):
+                raise DBException("This user already exists")
 
-            self.conn.commit()
-        except Exception as e:
-            self.conn.rollback()
-            raise DBException(f"Operation failed: {e}")
+            try:
+                # Execute the prepared statement with provided parameters
+                cursor.execute("EXECUTE insert_user_plan (%s, %s, %s)", (username, hashed_password_hex, salt_hex))
+                cursor.execute("EXECUTE insert_user_balance_plan (%s)", (username,))
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
 
     def delete_user(self, username: str) -> None:
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
-
-        try:
-            delete_from_users_query = "DELETE FROM users WHERE username = %s;"
-            delete_from_balance_query = "DELETE FROM users_balance WHERE username = %s;"
-            delete_from_stocks_query = "DELETE FROM users_stocks WHERE username = %s;"
-
-            self.cursor.execute(delete_from_users_query, (username,))
-            self.cursor.execute(delete_from_balance_query, (username,))
-            self.cursor.execute(delete_from_stocks_query, (username,))
-
-            self.conn.commit()
-        except Exception as e:
-            self.conn.rollback()
-            raise DBException(f"Operation failed: {e}")
+        with self.transaction() as cursor:
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            try:
+                delete_from_users_query = "DELETE FROM users WHERE username = %s;"
+                delete_from_balance_query = "DELETE FROM users_balance WHERE username = %s;"
+                delete_from_stocks_query = "DELETE FROM users_stocks WHERE username = %s;"
+                delete_from_orders_query = "DELETE FROM users_orders WHERE username = %s;"
+
+                cursor.execute(delete_from_users_query, (username,))
+                cursor.execute(delete_from_balance_query, (username,))
+                cursor.execute(delete_from_stocks_query, (username,))
+                cursor.execute(delete_from_orders_query, (username,))
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
 
     def get_balance(self, username: str) -> list[tuple[any, any]]:
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
+        with self.transaction() as cursor:
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
 
-        query = "SELECT balance FROM users_balance WHERE username = %s;"
+            query = "SELECT balance FROM users_balance WHERE username = %s;"
 
-        # Execute the query with the username parameter
-        self.cursor.execute(query, (username,))
+            # Execute the query with the username parameter
+            cursor.execute(query, (username,))
 
-        # Fetch the result
-        query_result = self.cursor.fetchall()
+            # Fetch the result
+            query_result = cursor.fetchall()
 
         return query_result
 
     def topup(self, username: str, amount: float) -> None:
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
+        with self.transaction() as cursor:
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
 
-        try:
-            query = "UPDATE users_balance SET balance = balance + %s WHERE username = %s;"
-            self.cursor.execute(query, (amount, username))
-            self.conn.commit()
-        except Exception as e:
-            self.conn.rollback()
-            raise DBException(f"Operation failed: {e}")
+            try:
+                query = "UPDATE users_balance SET balance = balance + %s WHERE username = %s;"
+                cursor.execute(query, (amount, username))
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
 
     def get_portfolio(self, username: str) -> dict[str, float]:
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
+        with self.transaction() as cursor:
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
 
-        stocks: dict[str, float] = {}
+            stocks: dict[str, float] = {}
 
-        query = "SELECT stock, amount FROM users_stocks WHERE username = %s;"
-        self.cursor.execute(query, (username,))
-        query_result = self.cursor.fetchall()
+            query = "SELECT stock, amount FROM users_stocks WHERE username = %s;"
+            cursor.execute(query, (username,))
+            query_result = cursor.fetchall()
 
         for res in query_result:
             stocks[res[0]] = res[1]
@@ -146,97 +276,332 @@ class Database:
         return stocks
 
     def buy_stock(self, username: str, stock: str, amount: float, total: float, fee: float, commit=True) -> None:
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
-
-        try:
-            query_balance_subtract = "UPDATE users_balance SET balance = balance - (%s + %s) WHERE username = %s;"
-            self.cursor.execute(query_balance_subtract, (total, fee, username))
+        # debits the balance and upserts the position in one round trip, no row comes back if the user doesn't exist
+        query_buy = """
+            WITH debit AS (
+                UPDATE users_balance SET balance = balance - (%(total)s + %(fee)s)
+                WHERE username = %(username)s
+                RETURNING username, balance
+            ), position AS (
+                INSERT INTO users_stocks (username, stock, amount)
+                SELECT username, %(stock)s, %(amount)s FROM debit
+                ON CONFLICT (username, stock) DO UPDATE SET amount = users_stocks.amount + EXCLUDED.amount
+                RETURNING amount
+            )
+            SELECT debit.balance, position.amount FROM debit, position;
+        """
+
+        with self._write_transaction(commit) as cursor:
+            try:
+                cursor.execute(query_buy, {"username": username, "stock": stock, "amount": amount,
+                                           "total": total, "fee": fee})
+                query_result = cursor.fetchone()
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
+
+            if query_result is None:
+                raise DBException("This user doesn't exist")
 
-            user_stocks = self.get_portfolio(username)
-            if stock not in user_stocks:
-                query_create_stock_entry = "INSERT INTO users_stocks VALUES (%s, %s, %s);"
-                self.cursor.execute(query_create_stock_entry, (username, stock, 0))
+    def sell_stock(self, username: str, stock: str, amount: float, total: float, fee: float, commit=True) -> None:
+        # selling the whole position deletes it, otherwise it is reduced, the predicates are mutually exclusive so
+        # only one of the two statements touches the row; the balance is credited only if a position was found
+        query_sell = """
+            WITH closed AS (
+                DELETE FROM users_stocks
+                WHERE username = %(username)s AND stock = %(stock)s AND amount = %(amount)s
+                RETURNING username
+            ), reduced AS (
+                UPDATE users_stocks SET amount = amount - %(amount)s
+                WHERE username = %(username)s AND stock = %(stock)s AND amount <> %(amount)s
+                RETURNING username
+            ), credit AS (
+                UPDATE users_balance SET balance = balance + (%(total)s - %(fee)s)
+                WHERE username IN (SELECT username FROM closed UNION ALL SELECT username FROM reduced)
+                RETURNING balance
+            )
+            SELECT EXISTS(SELECT 1 FROM users WHERE username = %(username)s), (SELECT balance FROM credit);
+        """
+
+        with self._write_transaction(commit) as cursor:
+            try:
+                cursor.execute(query_sell, {"username": username, "stock": stock, "amount": amount,
+                                            "total": total, "fee": fee})
+                (user_exists, balance) = cursor.fetchone()
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
+
+            if not user_exists:
+                raise DBException("This user doesn't exist")
+            if balance is None:
+                raise DBException("User doesn't own this stock")
+
+    def submit_order(self, username: str, order_type: str, stock: str, amount: float, trigger_price: float) -> int:
+        with self.transaction() as cursor:
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            try:
+                # the notification is delivered to listeners only once the transaction commits
+                query_create_stock_entry = """
+                    WITH new_order AS (
+                        INSERT INTO users_orders VALUES (DEFAULT, %s, %s, %s, %s, %s) RETURNING id
+                    )
+                    SELECT id, pg_notify(%s, id::text) FROM new_order;
+                """
+                cursor.execute(query_create_stock_entry,
+                               (username, stock, order_type, trigger_price, amount, ORDERS_CHANNEL))
+                (order_id, _) = cursor.fetchone()
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
+
+        return order_id
 
-            query_stock_buy = "UPDATE users_stocks SET amount = amount + %s WHERE username = %s AND stock = %s;"
-            self.cursor.execute(query_stock_buy, (amount, username, stock))
+    def delete_order(self, order_id: int, commit=True):
+        with self._write_transaction(commit) as cursor:
+            try:
+                query_delete_order = "DELETE FROM users_orders WHERE id = %s;"
+                cursor.execute(query_delete_order, (order_id,))
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
+
+            # e.g. deleted by its user while the order processor was executing it
+            if cursor.rowcount == 0:
+                raise DBException("This order doesn't exist")
+
+    def fill_order(self, order_id: int, amount: float, commit=True) -> None:
+        # filling what is left of the order deletes it, otherwise it is reduced; like in sell_stock the predicates
+        # are mutually exclusive
+        query_fill = """
+            WITH closed AS (
+                DELETE FROM users_orders WHERE id = %(order_id)s AND amount <= %(amount)s RETURNING id
+            ), reduced AS (
+                UPDATE users_orders SET amount = amount - %(amount)s
+                WHERE id = %(order_id)s AND amount > %(amount)s
+                RETURNING id
+            )
+            SELECT EXISTS(SELECT 1 FROM closed UNION ALL SELECT 1 FROM reduced);
+        """
+
+        with self._write_transaction(commit) as cursor:
+            try:
+                cursor.execute(query_fill, {"order_id": order_id, "amount": amount})
+                (order_exists,) = cursor.fetchone()
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
+
+            if not order_exists:
+                raise DBException("This order doesn't exist")
+
+    def settle_fills(self, cash_changes: dict[str, float], position_changes: dict[tuple[str, str], float],
+                     sold_positions: set[tuple[str, str]], filled_orders: dict[int, float], commit=True) -> None:
+        """
+        Applies the net effect of many fills in a handful of statements: cash changes per user, position changes
+        per (user, stock), and filled amounts per order.
+
+        Fails as a whole if a user or an order doesn't exist or a position in `sold_positions` isn't owned or would
+        end below 0, which the fills applied one by one may have rejected after the position was sold out.
+        """
+        usernames, cash_deltas = list(cash_changes), list(cash_changes.values())
+        position_users, position_stocks = [key[0] for key in position_changes], [key[1] for key in position_changes]
+        sold_users, sold_stocks = [key[0] for key in sold_positions], [key[1] for key in sold_positions]
+        sold_deltas = [position_changes.get(key, 0.0) for key in sold_positions]
+        order_ids, order_amounts = list(filled_orders), list(filled_orders.values())
+
+        with self._write_transaction(commit) as cursor:
+            try:
+                cursor.execute("""
+                    SELECT COUNT(*), COUNT(*) FILTER (WHERE s.amount + sold.delta < 0)
+                    FROM users_stocks s, unnest(%s::text[], %s::text[], %s::float8[]) AS sold(username, stock, delta)
+                    WHERE s.username = sold.username AND s.stock = sold.stock;
+                """, (sold_users, sold_stocks, sold_deltas))
+                (owned, oversold) = cursor.fetchone()
+
+                cursor.execute("""
+                    UPDATE users_balance b SET balance = b.balance + change.delta
+                    FROM unnest(%s::text[], %s::float8[]) AS change(username, delta)
+                    WHERE b.username = change.username;
+                """, (usernames, cash_deltas))
+                updated_balances = cursor.rowcount
+
+                # like in buy_stock and sell_stock, a position that ends at exactly 0 is deleted
+                cursor.execute("""
+                    INSERT INTO users_stocks (username, stock, amount)
+                    SELECT * FROM unnest(%s::text[], %s::text[], %s::float8[])
+                    ON CONFLICT (username, stock) DO UPDATE SET amount = users_stocks.amount + EXCLUDED.amount;
+                    DELETE FROM users_stocks s USING unnest(%s::text[], %s::text[]) AS changed(username, stock)
+                    WHERE s.username = changed.username AND s.stock = changed.stock AND s.amount = 0;
+                """, (position_users, position_stocks, list(position_changes.values()), position_users,
+                      position_stocks))
+
+                cursor.execute("""
+                    WITH filled AS (
+                        SELECT * FROM unnest(%s::int[], %s::float8[]) AS filled(id, amount)
+                    ), closed AS (
+                        DELETE FROM users_orders o USING filled
+                        WHERE o.id = filled.id AND o.amount <= filled.amount
+                        RETURNING o.id
+                    ), reduced AS (
+                        UPDATE users_orders o SET amount = o.amount - filled.amount FROM filled
+                        WHERE o.id = filled.id AND o.amount > filled.amount
+                        RETURNING o.id
+                    )
+                    SELECT (SELECT COUNT(*) FROM closed) + (SELECT COUNT(*) FROM reduced);
+                """, (order_ids, order_amounts))
+                (updated_orders,) = cursor.fetchone()
+            except Exception as e:
+                raise DBException(f"Operation failed: {e}")
+
+            if owned != len(sold_positions) or oversold:
+                raise DBException("User doesn't own this stock")
+            if updated_balances != len(cash_changes):
+                raise DBException("This user doesn't exist")
+            if updated_orders != len(filled_orders):
+                raise DBException("This order doesn't exist")
+
+    def get_order_book_depth(self, stock: str, levels: int) -> dict[str, list[tuple[float, float, int]]]:
+        """
+        Aggregates the resting limit (bid) and take_profit (ask) orders of a stock by price, best prices first.
+
+        :return: (price, amount, number of orders) per level for "bids" and "asks".
+        """
+        query = """
+            SELECT trigger_price, SUM(amount), COUNT(*) FROM users_orders
+            WHERE stock = %s AND order_type = %s
+            GROUP BY trigger_price ORDER BY trigger_price {} LIMIT %s;
+        """
 
-            if commit:
-                self.conn.commit()
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(query.format("DESC"), (stock, "limit", levels))
+                bids = cursor.fetchall()
+                cursor.execute(query.format("ASC"), (stock, "take_profit", levels))
+                asks = cursor.fetchall()
         except Exception as e:
-            if commit:
-                self.conn.rollback()
-
             raise DBException(f"Operation failed: {e}")
 
-    def sell_stock(self, username: str, stock: str, amount: float, total: float, fee: float, commit=True) -> None:
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
-
-        user_stocks = self.get_portfolio(username)
-
-        if stock not in user_stocks:
-            raise DBException("User doesn't own this stock")
+        return {"bids": bids, "asks": asks}
 
+    def get_all_orders(self) -> list[Order]:
         try:
-            query_balance_subtract = "UPDATE users_balance SET balance = balance + (%s - %s) WHERE username = %s;"
-            self.cursor.execute(query_balance_subtract, (total, fee, username))
+            # Preparing the SQL query to select all rows from the users_orders table
+            query = "SELECT * FROM users_orders;"
 
-            query_stock_buy = "UPDATE users_stocks SET amount = amount - %s WHERE username = %s AND stock = %s;"
-            self.cursor.execute(query_stock_buy, (amount, username, stock))
+            with self.transaction() as cursor:
+                # Executing the query
+                cursor.execute(query)
 
-            query_remove_stock_if_zero = "DELETE FROM users_stocks WHERE username = %s AND stock = %s AND amount = 0;"
-            self.cursor.execute(query_remove_stock_if_zero, (username, stock))
+                # Fetching the results
+                orders_data = cursor.fetchall()
 
-            if commit:
-                self.conn.commit()
+            # Creating a list of Order instances
+            orders = [Order(id=order[0], username=order[1], stock=order[2], order_type=order[3], trigger_price=order[4],
+                            amount=order[5]) for order in orders_data]
+
+            return orders
         except Exception as e:
-            if commit:
-                self.conn.rollback()
             raise DBException(f"Operation failed: {e}")
 
-    def submit_order(self, username: str, order_type: str, stock: str, amount: float, trigger_price: float):
-        if not self.user_exists(username):
-            raise DBException("This user doesn't exist")
+    def get_orders_page(self, after: int, limit: int, stock: Optional[str] = None, order_type: Optional[str] = None,
+                        username: Optional[str] = None) -> list[tuple[int, str, str, str, float, float]]:
+        """
+        Keyset pagination over the pending orders: the first `limit` orders with an id greater than `after` that
+        match the given filters, ordered by id.
+
+        :return: (id, username, stock, order_type, trigger_price, amount) rows.
+        """
+        conditions = ["id > %s"]
+        params: list = [after]
+        for column, value in (("stock", stock), ("order_type", order_type), ("username", username)):
+            if value is not None:
+                conditions.append(f"{column} = %s")
+                params.append(value)
+
+        query = f"""
+            SELECT id, username, stock, order_type, trigger_price, amount FROM users_orders
+            WHERE {" AND ".join(conditions)} ORDER BY id LIMIT %s;
+        """
 
         try:
-            query_create_stock_entry = "INSERT INTO users_orders VALUES (DEFAULT, %s, %s, %s, %s, %s);"
-            self.cursor.execute(query_create_stock_entry, (username, stock, order_type, trigger_price, amount))
-            self.conn.commit()
+            with self.transaction() as cursor:
+                cursor.execute(query, (*params, limit))
+                return cursor.fetchall()
         except Exception as e:
-            self.conn.rollback()
             raise DBException(f"Operation failed: {e}")
 
-    def delete_order(self, order_id: int, commit=True):
+    def get_orders_after(self, order_id: int) -> list[Order]:
         try:
-            query_delete_order = "DELETE FROM users_orders WHERE id = %s;"
-            self.cursor.execute(query_delete_order, (order_id,))
-            if commit:
-                self.conn.commit()
+            query = "SELECT * FROM users_orders WHERE id > %s ORDER BY id;"
+            with self.transaction() as cursor:
+                cursor.execute(query, (order_id,))
+                orders_data = cursor.fetchall()
+
+            return [Order(id=order[0], username=order[1], stock=order[2], order_type=order[3], trigger_price=order[4],
+                          amount=order[5]) for order in orders_data]
         except Exception as e:
-            if commit:
-                self.conn.rollback()
             raise DBException(f"Operation failed: {e}")
 
-    def get_all_orders(self) -> list[Order]:
+    def get_orders(self, order_ids: list[int]) -> list[Order]:
         try:
-            # Preparing the SQL query to select all rows from the users_orders table
-            query = "SELECT * FROM users_orders;"
+            query = "SELECT * FROM users_orders WHERE id = ANY(%s) ORDER BY id;"
+            with self.transaction() as cursor:
+                cursor.execute(query, (order_ids,))
+                orders_data = cursor.fetchall()
 
-            # Executing the query
-            self.cursor.execute(query)
-
-            # Fetching the results
-            orders_data = self.cursor.fetchall()
-
-            # Creating a list of Order instances
-            orders = [Order(id=order[0], username=order[1], stock=order[2], order_type=order[3], trigger_price=order[4],
-                            amount=order[5]) for order in orders_data]
-
-            return orders
+            return [Order(id=order[0], username=order[1], stock=order[2], order_type=order[3], trigger_price=order[4],
+                          amount=order[5]) for order in orders_data]
         except Exception as e:
             raise DBException(f"Operation failed: {e}")
 
+    def close(self) -> None:
+        self.pool.close()
+
     def __del__(self):
-        self.cursor.close()
+        # the pool is missing if __init__ failed, e.g. when Postgres isn't reachable
+        if getattr(self, "pool", None) is not None:
+            self.close()
+
+
+class NotificationListener:
+    """
+    Dedicated connection that LISTENs on a channel and hands out the payloads of NOTIFY messages.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+
+        self.conn: postgres_connection = _connect()
+        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel};")
+
+    def wait(self, timeout: float) -> list[str]:
+        """
+        Blocks until at least one notification arrives or the timeout (in seconds) elapses.
+
+        :return: The payloads of all notifications received, possibly empty.
+        """
+        if select.select([self.conn], [], [], timeout) == ([], [], []):
+            return []
+
+        self.conn.poll()
+        payloads = [notification.payload for notification in self.conn.notifies]
+        self.conn.notifies.clear()
+
+        return payloads
+
+    def close(self) -> None:
         self.conn.close()
+
+
+def create_database():
+    """
+    Builds the storage backend selected by the DATABASE_BACKEND environment variable ("postgres" or "memory").
+    """
+    if DATABASE_BACKEND == 'postgres':
+        return Database()
+    elif DATABASE_BACKEND == 'memory':
+        from broker_simulator.memory_database import InMemoryDatabase  # imported lazily, it depends on this module
+        return InMemoryDatabase()
+    else:
+        raise ValueError(f"Unknown database backend: {DATABASE_BACKEND}. Only postgres and memory are supported")
@@ -0,0 +1,8 @@
+FEE_RATE = 0.001  # 0.1% of the total
+
+
+def calculate_fee(total):
+    """
+    Fee charged on a trade worth `total`, works on floats and NumPy arrays alike.
+    """
+    return total * FEE_RATE
@@ -0,0 +1,256 @@
+import heapq
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+
+from broker_simulator.custom_exceptions import ServiceException
+
+# limit orders rest as bids and take_profit orders as asks at their trigger price; stop_loss orders are stops, they
+# never rest in the book and only trigger on the market price
+BOOK_ORDER_SIDES = {"limit": "buy", "take_profit": "sell"}
+SIDES = ("buy", "sell")
+DEPTH_LEVELS = 10
+
+_COMPACTION_THRESHOLD = 64
+
+
+class Fill(NamedTuple):
+    stock: str
+    price: float
+    amount: float
+    buy_order_id: int
+    buyer: str
+    sell_order_id: int
+    seller: str
+    # amounts left on the orders after this fill, 0 when filled completely
+    buy_remaining: float
+    sell_remaining: float
+
+
+class _RestingOrder:
+    __slots__ = ("id", "username", "price", "amount")
+
+    def __init__(self, order_id: int, username: str, price: float, amount: float):
+        self.id = order_id
+        self.username = username
+        self.price = price
+        self.amount = amount  # 0 once filled or cancelled
+
+
+class _PriceLevel:
+    __slots__ = ("price", "orders", "amount", "count")
+
+    def __init__(self, price: float):
+        self.price = price
+        self.orders: deque[_RestingOrder] = deque()  # in arrival order, may hold cancelled orders
+        self.amount = 0.0
+        self.count = 0
+
+
+class _BookSide:
+    """
+    Price levels of one side of a book. The heap of prices has the best price on top; prices of removed levels are
+    dropped lazily, the top is cleaned on every removal so the best level is always a dict lookup away.
+    """
+
+    def __init__(self, is_bid: bool):
+        self.sign = -1.0 if is_bid else 1.0
+        self.levels: dict[float, _PriceLevel] = {}
+        self._heap: list[float] = []  # sign * price
+
+    def best(self) -> Optional[_PriceLevel]:
+        return self.levels[self.sign * self._heap[0]] if self._heap else None
+
+    def level(self, price: float) -> _PriceLevel:
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = _PriceLevel(price)
+            heapq.heappush(self._heap, self.sign * price)
+        return level
+
+    def remove_level(self, level: _PriceLevel) -> None:
+        del self.levels[level.price]
+
+        heap = self._heap
+        while heap and self.sign * heap[0] not in self.levels:
+            heapq.heappop(heap)
+
+        if len(heap) > 2 * len(self.levels) + _COMPACTION_THRESHOLD:
+            self._heap = [self.sign * price for price in self.levels]
+            heapq.heapify(self._heap)
+
+    def top(self, levels: int) -> list[_PriceLevel]:
+        return [self.levels[price] for price in heapq.nsmallest(levels, self.levels, key=lambda p: self.sign * p)]
+
+
+class OrderBook:
+    """
+    Limit order book of one stock with price-time priority.
+    """
+
+    def __init__(self, stock: str):
+        self.stock = stock
+        self.bids = _BookSide(is_bid=True)
+        self.asks = _BookSide(is_bid=False)
+        self._orders: dict[int, tuple[_BookSide, _RestingOrder]] = {}
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._orders
+
+    def submit(self, order_id: int, username: str, side: str, price: float, amount: float) -> list[Fill]:
+        """
+        Matches an incoming order against the resting orders it crosses, best price first and oldest first within a
+        price, at the resting order's price. Whatever is left of the order rests in the book.
+        """
+        is_buy = side == "buy"
+        opposite = self.asks if is_buy else self.bids
+        fills: list[Fill] = []
+
+        while amount > 0:
+            level = opposite.best()
+            if level is None or (level.price > price if is_buy else level.price < price):
+                break
+
+            resting = level.orders[0]
+            if resting.amount == 0:  # cancelled
+                level.orders.popleft()
+                continue
+
+            traded = min(amount, resting.amount)
+            amount -= traded
+            resting.amount -= traded
+            level.amount -= traded
+
+            if is_buy:
+                fills.append(Fill(self.stock, level.price, traded, order_id, username, resting.id, resting.username,
+                                  amount, resting.amount))
+            else:
+                fills.append(Fill(self.stock, level.price, traded, resting.id, resting.username, order_id, username,
+                                  resting.amount, amount))
+
+            if resting.amount == 0:
+                level.orders.popleft()
+                level.count -= 1
+                del self._orders[resting.id]
+                if level.count == 0:
+                    opposite.remove_level(level)
+
+        if amount > 0:
+            own_side = self.bids if is_buy else self.asks
+            resting = _RestingOrder(order_id, username, price, amount)
+            level = own_side.level(price)
+            level.orders.append(resting)
+            level.amount += amount
+            level.count += 1
+            self._orders[order_id] = (own_side, resting)
+
+        return fills
+
+    def cancel(self, order_id: int) -> bool:
+        entry = self._orders.pop(order_id, None)
+        if entry is None:
+            return False
+
+        side, resting = entry
+        level = side.levels[resting.price]
+        level.amount -= resting.amount
+        level.count -= 1
+        resting.amount = 0  # skipped once it reaches the front of the queue
+
+        if level.count == 0:
+            side.remove_level(level)
+        elif len(level.orders) > 2 * level.count + _COMPACTION_THRESHOLD:
+            level.orders = deque(order for order in level.orders if order.amount > 0)
+        return True
+
+    def top_of_book(self) -> dict:
+        bid, ask = self.bids.best(), self.asks.best()
+        return {
+            "stock": self.stock,
+            "bid": bid.price if bid else None,
+            "bid_amount": bid.amount if bid else 0.0,
+            "ask": ask.price if ask else None,
+            "ask_amount": ask.amount if ask else 0.0,
+        }
+
+    def depth(self, levels: int = DEPTH_LEVELS) -> dict:
+        def snapshot(side: _BookSide) -> list[dict]:
+            return [{"price": level.price, "amount": level.amount, "orders": level.count}
+                    for level in side.top(levels)]
+
+        return {"stock": self.stock, "bids": snapshot(self.bids), "asks": snapshot(self.asks)}
+
+
+class MatchingEngine:
+    """
+    One price-time priority order book per stock.
+
+    Submitting and cancelling take O(log n) in the number of price levels, the best bid and ask are read in O(1).
+    Cancelled orders are only flagged and skipped once they reach the front of their price level. Thread-safe, so
+    snapshots can be taken while another thread matches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books: dict[str, OrderBook] = {}
+        self._order_books: dict[int, OrderBook] = {}  # order id -> book of the stock it rests in
+
+    def __len__(self) -> int:
+        return len(self._order_books)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._order_books
+
+    def symbols(self) -> list[str]:
+        with self._lock:
+            return [stock for stock, book in self._books.items() if len(book) > 0]
+
+    def submit(self, order_id: int, username: str, stock: str, side: str, price: float, amount: float) -> list[Fill]:
+        """
+        Matches an order against the book of its stock and rests whatever isn't filled.
+
+        :return: The fills, in the order they happened.
+        """
+        if side not in SIDES:
+            raise ServiceException(f"Side is {side}, only {' and '.join(SIDES)} are accepted")
+        if amount <= 0:
+            raise ServiceException(f"Amount has to be positive. Amount provided: {amount}")
+
+        with self._lock:
+            if order_id in self._order_books:
+                raise ServiceException(f"Order {order_id} is already in the book")
+
+            book = self._books.get(stock)
+            if book is None:
+                book = self._books[stock] = OrderBook(stock)
+
+            fills = book.submit(order_id, username, side, price, amount)
+
+            for fill in fills:
+                resting_id, resting_remaining = (fill.sell_order_id, fill.sell_remaining) if side == "buy" \
+                    else (fill.buy_order_id, fill.buy_remaining)
+                if resting_remaining == 0:
+                    del self._order_books[resting_id]
+            if order_id in book:
+                self._order_books[order_id] = book
+
+        return fills
+
+    def cancel(self, order_id: int) -> bool:
+        """
+        :return: Whether the order was resting in the book.
+        """
+        with self._lock:
+            book = self._order_books.pop(order_id, None)
+            return book is not None and book.cancel(order_id)
+
+    def top_of_book(self, stock: str) -> dict:
+        with self._lock:
+            return (self._books.get(stock) or OrderBook(stock)).top_of_book()
+
+    def depth(self, stock: str, levels: int = DEPTH_LEVELS) -> dict:
+        with self._lock:
+            return (self._books.get(stock) or OrderBook(stock)).depth(levels)
@@ -0,0 +1,386 @@
+import bisect
+import itertools
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from broker_simulator.custom_exceptions import DBException
+from broker_simulator.data_models import Order
+from broker_simulator.database import ORDERS_CHANNEL, instrument_queries
+
+_MISSING = object()
+_COMPACTION_THRESHOLD = 64
+
+
+class MemoryNotificationListener:
+    """
+    In-process counterpart of NotificationListener, fed by InMemoryDatabase.notify.
+    """
+
+    def __init__(self, db: "InMemoryDatabase", channel: str):
+        self.db = db
+        self.channel = channel
+
+        self._condition = threading.Condition()
+        self._payloads: deque[str] = deque()
+
+    def _deliver(self, payload: str) -> None:
+        with self._condition:
+            self._payloads.append(payload)
+            self._condition.notify()
+
+    def wait(self, timeout: float) -> list[str]:
+        """
+        Blocks until at least one notification arrives or the timeout (in seconds) elapses.
+
+        :return: The payloads of all notifications received, possibly empty.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._payloads, timeout=timeout)
+            payloads = list(self._payloads)
+            self._payloads.clear()
+
+        return payloads
+
+    def close(self) -> None:
+        self.db._unlisten(self)
+
+
+@instrument_queries
+class InMemoryDatabase:
+    """
+    Storage backend with the interface of Database that keeps everything in the process's memory.
+
+    Transactions are serialized by one lock and record an undo log, so a rolled back transaction or savepoint
+    restores every value it changed. As with Postgres, notifications are delivered to listeners when the outermost
+    transaction commits and dropped when it rolls back. Data and notifications don't outlive the process and aren't
+    shared with other processes, so the order processor has to run in the same process as the app.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # state of the transaction currently open on each thread
+        self._local = threading.local()
+
+        self._users: dict[str, tuple[str, str]] = {}  # username -> (password hash, salt)
+        self._balances: dict[str, float] = {}
+        self._stocks: dict[str, dict[str, float]] = {}  # username -> stock -> amount
+        self._orders: dict[int, tuple[str, str, str, float, float]] = {}  # id -> (username, stock, order type,
+        # trigger price, amount)
+        # every id handed out, in increasing order; ids of deleted or rolled back orders are skipped when read and
+        # dropped once they make up half of the list
+        self._order_ids: list[int] = []
+        self._last_order_id = 0
+
+        self._listeners_lock = threading.Lock()
+        self._listeners: dict[str, set[MemoryNotificationListener]] = defaultdict(set)
+
+    def _in_transaction(self) -> bool:
+        return getattr(self._local, "undo_log", None) is not None
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Runs the enclosed operations in one transaction.
+
+        The transaction is committed when the block exits normally and rolled back when it raises. Nested calls on
+        the same thread join the enclosing transaction instead of opening a new one.
+        """
+        if self._in_transaction():
+            yield
+            return
+
+        with self._lock:
+            self._local.undo_log = []
+            self._local.notifications = []
+            try:
+                yield
+            except BaseException:
+                self._rollback_to(0)
+                raise
+            else:
+                notifications = self._local.notifications
+            finally:
+                self._local.undo_log = None
+                self._local.notifications = None
+
+        for channel, payload in notifications:
+            self._deliver(channel, payload)
+
+    @contextmanager
+    def snapshot(self) -> Iterator[None]:
+        # transactions are serialized, the reads of one never see another's writes half done
+        with self.transaction():
+            yield
+
+    @contextmanager
+    def savepoint(self) -> Iterator[None]:
+        """
+        Runs the enclosed operations in a savepoint of the current transaction, so a failure only undoes them.
+        """
+        with self.transaction():
+            undo_length = len(self._local.undo_log)
+            notifications_length = len(self._local.notifications)
+            try:
+                yield
+            except BaseException:
+                self._rollback_to(undo_length)
+                del self._local.notifications[notifications_length:]
+                raise
+
+    def _rollback_to(self, undo_length: int) -> None:
+        undo_log: list[Callable[[], None]] = self._local.undo_log
+        while len(undo_log) > undo_length:
+            undo_log.pop()()
+
+    def _write_transaction(self, commit: bool):
+        # with commit=False the caller owns the transaction and has to have opened it already
+        if not commit and not self._in_transaction():
+            raise DBException("commit=False requires an enclosing transaction")
+        return self.transaction()
+
+    def _set(self, mapping: dict, key, value) -> None:
+        previous = mapping.get(key, _MISSING)
+        self._local.undo_log.append(lambda: self._restore(mapping, key, previous))
+        mapping[key] = value
+
+    def _delete(self, mapping: dict, key) -> None:
+        previous = mapping.pop(key, _MISSING)
+        self._local.undo_log.append(lambda: self._restore(mapping, key, previous))
+
+    @staticmethod
+    def _restore(mapping: dict, key, previous) -> None:
+        if previous is _MISSING:
+            mapping.pop(key, None)
+        else:
+            mapping[key] = previous
+
+    def _set_position(self, username: str, stock: str, amount: float) -> None:
+        if username not in self._stocks:
+            self._set(self._stocks, username, {})
+        self._set(self._stocks[username], stock, amount)
+
+    def listen(self, channel: str) -> MemoryNotificationListener:
+        listener = MemoryNotificationListener(self, channel)
+        with self._listeners_lock:
+            self._listeners[channel].add(listener)
+        return listener
+
+    def _unlisten(self, listener: MemoryNotificationListener) -> None:
+        with self._listeners_lock:
+            self._listeners[listener.channel].discard(listener)
+
+    def _deliver(self, channel: str, payload: str) -> None:
+        with self._listeners_lock:
+            listeners = list(self._listeners.get(channel, ()))
+        for listener in listeners:
+            listener._deliver(payload)
+
+    def notify(self, channel: str, payload: str) -> None:
+        # delivered to listeners when the current transaction commits, dropped if it rolls back
+        with self.transaction():
+            self._local.notifications.append((channel, payload))
+
+    def notify_many(self, channel: str, payloads: list[str]) -> None:
+        with self.transaction():
+            self._local.notifications.extend((channel, payload) for payload in payloads)
+
+    def pool_stats(self) -> dict[str, float]:
+        # there is no connection pool, report the size of the data instead
+        with self.transaction():
+            return {
+                "users": len(self._users),
+                "positions": sum(len(stocks) for stocks in self._stocks.values()),
+                "orders": len(self._orders),
+            }
+
+    def user_exists(self, username: str) -> bool:
+        return username in self._users
+
+    def get_user_password_and_salt(self, username: str) -> list[tuple[str, str]]:
+        with self.transaction():
+            if not self.user_exists(username):
+                raise DBException("User doesn't exist")
+
+            return [self._users[username]]
+
+    def create_user(self, username: str, hashed_password_hex: str, salt_hex: str) -> None:
+        with self.transaction():
+            if self.user_exists(username):
+                raise DBException("This user already exists")
+
+            self._set(self._users, username, (hashed_password_hex, salt_hex))
+            self._set(self._balances, username, 0.0)
+
+    def delete_user(self, username: str) -> None:
+        with self.transaction():
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            self._delete(self._users, username)
+            self._delete(self._balances, username)
+            self._delete(self._stocks, username)
+            for order_id in [order_id for order_id, order in self._orders.items() if order[0] == username]:
+                self._delete(self._orders, order_id)
+
+    def get_balance(self, username: str) -> list[tuple[float]]:
+        with self.transaction():
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            return [(self._balances[username],)]
+
+    def topup(self, username: str, amount: float) -> None:
+        with self.transaction():
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            self._set(self._balances, username, self._balances[username] + amount)
+
+    def get_portfolio(self, username: str) -> dict[str, float]:
+        with self.transaction():
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            return dict(self._stocks.get(username, {}))
+
+    def buy_stock(self, username: str, stock: str, amount: float, total: float, fee: float, commit=True) -> None:
+        with self._write_transaction(commit):
+            if username not in self._balances:
+                raise DBException("This user doesn't exist")
+
+            self._set(self._balances, username, self._balances[username] - (total + fee))
+            self._set_position(username, stock, self._stocks.get(username, {}).get(stock, 0.0) + amount)
+
+    def sell_stock(self, username: str, stock: str, amount: float, total: float, fee: float, commit=True) -> None:
+        with self._write_transaction(commit):
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            owned = self._stocks.get(username, {}).get(stock)
+            if owned is None:
+                raise DBException("User doesn't own this stock")
+
+            # selling the whole position deletes it, otherwise it is reduced
+            if owned == amount:
+                self._delete(self._stocks[username], stock)
+            else:
+                self._set(self._stocks[username], stock, owned - amount)
+            self._set(self._balances, username, self._balances[username] + (total - fee))
+
+    def submit_order(self, username: str, order_type: str, stock: str, amount: float, trigger_price: float) -> int:
+        with self.transaction():
+            if not self.user_exists(username):
+                raise DBException("This user doesn't exist")
+
+            if order_type not in ("stop_loss", "limit", "take_profit"):
+                raise DBException(f"Operation failed: invalid order type {order_type}")
+
+            # like a sequence, an id is never handed out twice even if the transaction rolls back
+            self._last_order_id += 1
+            order_id = self._last_order_id
+            self._set(self._orders, order_id, (username, stock, order_type, trigger_price, amount))
+
+            self._order_ids.append(order_id)
+            if len(self._order_ids) > 2 * len(self._orders) + _COMPACTION_THRESHOLD:
+                self._order_ids = [id_ for id_ in self._order_ids if id_ in self._orders]
+            self.notify(ORDERS_CHANNEL, str(order_id))
+
+        return order_id
+
+    def delete_order(self, order_id: int, commit=True):
+        with self._write_transaction(commit):
+            if order_id not in self._orders:
+                raise DBException("This order doesn't exist")
+            self._delete(self._orders, order_id)
+
+    def fill_order(self, order_id: int, amount: float, commit=True) -> None:
+        with self._write_transaction(commit):
+            order = self._orders.get(order_id)
+            if order is None:
+                raise DBException("This order doesn't exist")
+
+            # filling what is left of the order deletes it, otherwise it is reduced
+            if order[4] <= amount:
+                self._delete(self._orders, order_id)
+            else:
+                self._set(self._orders, order_id, (*order[:4], order[4] - amount))
+
+    def settle_fills(self, cash_changes: dict[str, float], position_changes: dict[tuple[str, str], float],
+                     sold_positions: set[tuple[str, str]], filled_orders: dict[int, float], commit=True) -> None:
+        with self._write_transaction(commit):
+            if any(stock not in self._stocks.get(username, {}) for username, stock in sold_positions):
+                raise DBException("User doesn't own this stock")
+            if any(self._stocks[username][stock] + position_changes.get((username, stock), 0.0) < 0
+                   for username, stock in sold_positions):
+                raise DBException("User doesn't own this stock")
+            if any(username not in self._balances for username in cash_changes):
+                raise DBException("This user doesn't exist")
+            if any(order_id not in self._orders for order_id in filled_orders):
+                raise DBException("This order doesn't exist")
+
+            for username, delta in cash_changes.items():
+                self._set(self._balances, username, self._balances[username] + delta)
+
+            for (username, stock), delta in position_changes.items():
+                amount = self._stocks.get(username, {}).get(stock, 0.0) + delta
+                if amount == 0:
+                    if stock in self._stocks.get(username, {}):
+                        self._delete(self._stocks[username], stock)
+                else:
+                    self._set_position(username, stock, amount)
+
+            for order_id, amount in filled_orders.items():
+                self.fill_order(order_id, amount, commit=False)
+
+    def get_order_book_depth(self, stock: str, levels: int) -> dict[str, list[tuple[float, float, int]]]:
+        with self.transaction():
+            aggregated = {"limit": defaultdict(lambda: [0.0, 0]), "take_profit": defaultdict(lambda: [0.0, 0])}
+            for _, order_stock, order_type, trigger_price, amount in self._orders.values():
+                if order_stock == stock and order_type in aggregated:
+                    level = aggregated[order_type][trigger_price]
+                    level[0] += amount
+                    level[1] += 1
+
+        def best(order_type: str, highest_first: bool) -> list[tuple[float, float, int]]:
+            prices = sorted(aggregated[order_type], reverse=highest_first)[:levels]
+            return [(price, *aggregated[order_type][price]) for price in prices]
+
+        return {"bids": best("limit", True), "asks": best("take_profit", False)}
+
+    @staticmethod
+    def _to_order(order_id: int, order: tuple[str, str, str, float, float]) -> Order:
+        username, stock, order_type, trigger_price, amount = order
+        return Order(id=order_id, username=username, stock=stock, order_type=order_type, trigger_price=trigger_price,
+                     amount=amount)
+
+    def get_all_orders(self) -> list[Order]:
+        with self.transaction():
+            return [self._to_order(order_id, order) for order_id, order in self._orders.items()]
+
+    def _ids_after(self, order_id: int) -> Iterator[int]:
+        # binary search to the cursor, so a deep page costs the same as the first
+        order_ids = self._order_ids
+        return (order_ids[i] for i in range(bisect.bisect_right(order_ids, order_id), len(order_ids))
+                if order_ids[i] in self._orders)
+
+    def get_orders_after(self, order_id: int) -> list[Order]:
+        with self.transaction():
+            return [self._to_order(id_, self._orders[id_]) for id_ in self._ids_after(order_id)]
+
+    def get_orders_page(self, after: int, limit: int, stock: Optional[str] = None, order_type: Optional[str] = None,
+                        username: Optional[str] = None) -> list[tuple[int, str, str, str, float, float]]:
+        def matches(order: tuple[str, str, str, float, float]) -> bool:
+            order_username, order_stock, order_order_type, _, _ = order
+            return ((stock is None or order_stock == stock) and (order_type is None or order_order_type == order_type)
+                    and (username is None or order_username == username))
+
+        with self.transaction():
+            rows = ((order_id, *self._orders[order_id]) for order_id in self._ids_after(after))
+            return list(itertools.islice((row for row in rows if matches(row[1:])), limit))
+
+    def get_orders(self, order_ids: list[int]) -> list[Order]:
+        with self.transaction():
+            return [self._to_order(order_id, self._orders[order_id]) for order_id in sorted(set(order_ids))
+                    if order_id in self._orders]
@@ -0,0 +1,348 @@
+import abc
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional, TypeVar
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a cached lookup to a slow upstream fetch
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OVERFLOW_LABEL = "other"
+
+T = TypeVar("T")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: list[tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Registry:
+    """
+    The metrics of a process, rendered together in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, "_Metric"] = {}
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines: list[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            metric.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+
+class _Metric(abc.ABC):
+    """
+    A metric family with a fixed set of label names. Children, one per combination of label values, are created on
+    first use and kept for the life of the process; past `max_series` children new combinations are all counted
+    under the label value "other", so labels taken from user input can't grow the metric without bound.
+    """
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 max_series: Optional[int] = None, registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+
+        self._lock = threading.Lock()
+        self._children: dict[tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child(())
+
+        registry.register(self)
+
+    @abc.abstractmethod
+    def _new_child(self, values: tuple[str, ...]):
+        pass
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is not None:
+            return child
+
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames)}, got {values}")
+
+        with self._lock:
+            if values not in self._children and self.max_series is not None \
+                    and len(self._children) >= self.max_series:
+                values = (OVERFLOW_LABEL,) * len(values)
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child(values)
+        return child
+
+    def _snapshot(self) -> list:
+        with self._lock:
+            return list(self._children.values())
+
+    @abc.abstractmethod
+    def render(self, lines: list[str]) -> None:
+        pass
+
+
+class _Value:
+    __slots__ = ("label_text", "value", "_lock")
+
+    def __init__(self, label_text: str):
+        self.label_text = label_text
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    @contextmanager
+    def track_in_progress(self) -> Iterator[None]:
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self, values: tuple[str, ...]) -> _Value:
+        return _Value(_format_labels(list(zip(self.labelnames, values))))
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def render(self, lines: list[str]) -> None:
+        for child in self._snapshot():
+            lines.append(f"{self.name}_total{child.label_text} {_format_value(child.value)}")
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self, values: tuple[str, ...]) -> _Value:
+        return _Value(_format_labels(list(zip(self.labelnames, values))))
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def track_in_progress(self):
+        return self._default.track_in_progress()
+
+    def render(self, lines: list[str]) -> None:
+        for child in self._snapshot():
+            lines.append(f"{self.name}{child.label_text} {_format_value(child.value)}")
+
+
+class _HistogramValue:
+    __slots__ = ("pairs", "bounds", "counts", "sum", "_lock")
+
+    def __init__(self, pairs: list[tuple[str, str]], bounds: tuple[float, ...]):
+        self.pairs = pairs
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at)
+
+
+class Histogram(_Metric):
+    """
+    Counts observations into fixed buckets, an observation costs a binary search and one uncontended lock.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS, max_series: Optional[int] = None,
+                 registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, max_series, registry)
+
+    def _new_child(self, values: tuple[str, ...]) -> _HistogramValue:
+        return _HistogramValue(list(zip(self.labelnames, values)), self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def render(self, lines: list[str]) -> None:
+        for child in self._snapshot():
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(child.pairs + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(child.pairs)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+def instrument(func: Callable[..., T], duration: _HistogramValue, in_flight: Optional[_Value] = None,
+               errors: Optional[_Value] = None) -> Callable[..., T]:
+    """
+    Wraps a function to observe the duration of every call, count the calls that raise and track the calls in
+    progress. The children are resolved up front, so a call only pays for the clock and the counter updates.
+    """
+
+    @functools.wraps(func)
+    def instrumented(*args, **kwargs) -> T:
+        if in_flight is not None:
+            in_flight.inc()
+        started_at = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            if errors is not None:
+                errors.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - started_at)
+            if in_flight is not None:
+                in_flight.dec()
+
+    return instrumented
+
+
+class EndpointLabels:
+    """
+    Labels HTTP requests by the path of the route they hit. Paths no route serves share the label "other", so
+    arbitrary URLs can't grow a metric. The routes are read from the app on the first request.
+    """
+
+    def __init__(self):
+        self._paths: Optional[frozenset[str]] = None
+
+    def __call__(self, scope) -> str:
+        if self._paths is None:
+            self._paths = frozenset(getattr(route, "path", None) for route in scope["app"].routes)
+        return scope["path"] if scope["path"] in self._paths else OVERFLOW_LABEL
+
+
+class HttpMetricsMiddleware:
+    """
+    ASGI middleware recording the latency, the count by status and the requests in flight of every endpoint.
+    The latency of a streamed response runs until its last chunk is sent.
+    """
+
+    def __init__(self, app, duration: Histogram, requests: Counter, in_flight: Gauge):
+        self.app = app
+        self.duration = duration
+        self.requests = requests
+        self.in_flight = in_flight
+        self._endpoint = EndpointLabels()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+
+        status_code = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = self.in_flight.labels(endpoint)
+        in_flight.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.duration.labels(endpoint).observe(time.perf_counter() - started_at)
+            self.requests.labels(endpoint, str(status_code)).inc()
+            in_flight.dec()
+
+
+def start_http_server(port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Serves the metrics on http://0.0.0.0:<port>/metrics from a daemon thread, for processes without an app.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scraped every few seconds, not worth a line each
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,25 +1,315 @@
+import heapq
+import os
+import queue
+import threading
 import time
+from collections import deque
+from typing import Optional
 
-from broker_simulator.database import Database
+import numpy as np
+
+from broker_simulator.custom_exceptions import DBException
+from broker_simulator.data_models import Order
+from broker_simulator.database import create_database, ORDERS_CHANNEL
+from broker_simulator.matching_engine import Fill, MatchingEngine, BOOK_ORDER_SIDES
+from broker_simulator.metrics import Counter, Gauge, Histogram, start_http_server
 from broker_simulator.service import Service
+from broker_simulator.stock_info import get_stock_prices, price_cache
+from broker_simulator.trigger_book import TriggerBook
+
+# minimum time in seconds between two price checks of the same symbol
+MIN_LATENCY = float(os.environ.get('ORDER_PROCESSOR_MIN_LATENCY', 1.0))
+STATS_INTERVAL = float(os.environ.get('ORDER_PROCESSOR_STATS_INTERVAL', 60.0))
+# an order that failed to execute is retried after a delay that doubles with every failure, up to the maximum
+RETRY_DELAY = float(os.environ.get('ORDER_PROCESSOR_RETRY_DELAY', 1.0))
+RETRY_MAX_DELAY = float(os.environ.get('ORDER_PROCESSOR_RETRY_MAX_DELAY', 300.0))
+# errors after which an order can never execute, such orders are deleted instead of retried
+PERMANENT_ERRORS = ("This user doesn't exist", "User doesn't own this stock", "This order doesn't exist")
+# port the standalone processor serves /metrics on, 0 to disable; in the app they are part of the app's /metrics
+METRICS_PORT = int(os.environ.get('ORDER_PROCESSOR_METRICS_PORT', 9101))
+
+EVENT_KINDS = ("price", "orders", "resync")
+
+cycle_duration = Histogram("broker_order_processor_cycle_duration_seconds",
+                           "Time spent handling one event of the order processor", ("event",))
+orders_scanned = Counter("broker_order_processor_orders_scanned",
+                         "Orders looked at: new orders loaded and orders whose trigger was crossed", ("event",))
+orders_executed = Counter("broker_order_processor_orders_executed", "Orders executed against the market price")
+order_execution_errors = Counter("broker_order_processor_order_execution_errors",
+                                 "Executions of triggered orders that failed and were put back in the book")
+fills_settled = Counter("broker_order_processor_fills", "Fills of matched orders, by settlement result", ("result",))
+execution_delay = Histogram("broker_order_processor_execution_delay_seconds",
+                            "Delay between observing a crossed trigger and committing the execution")
+pending_orders = Gauge("broker_order_processor_pending_orders", "Orders waiting for their trigger")
+resting_orders = Gauge("broker_order_processor_resting_orders", "Orders resting in the matching engine")
+queued_events = Gauge("broker_order_processor_queued_events", "Events waiting to be handled")
+
+
+class ExecutionDelayStats:
+    """
+    Tracks the delay between observing a crossed trigger and the order's execution being committed.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._recent: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, delay: float) -> None:
+        execution_delay.observe(delay)
+        with self._lock:
+            self._recent.append(delay)
+            self.count += 1
+            self.total += delay
+            self.max = max(self.max, delay)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            recent = np.array(self._recent) if self._recent else np.zeros(1)
+            return {
+                "executed": self.count,
+                "mean": self.total / self.count if self.count else 0.0,
+                "max": self.max,
+                "p50": float(np.percentile(recent, 50)),
+                "p99": float(np.percentile(recent, 99)),
+            }
+
+
+class OrderProcessor:
+    """
+    Matches pending orders against each other and executes them against the market as soon as their trigger is
+    crossed.
+
+    Three kinds of events are funnelled into one queue and handled by a single thread: price changes reported by
+    the shared price cache, order ids announced by the database when an order is submitted, and periodic price
+    polls that keep the cache fresh for every symbol with pending orders.
 
-db = Database()
-service = Service(db)
+    New limit and take_profit orders are first matched in the matching engine; the fills of a batch of new orders
+    are settled in one transaction. Whatever isn't matched rests in the book and still executes against the market
+    price once its trigger is crossed.
+    """
 
-FREQUENCY = 100
+    def __init__(self, service: Service, trigger_book: TriggerBook, min_latency: float = MIN_LATENCY,
+                 matching_engine: Optional[MatchingEngine] = None):
+        self.service = service
+        self.trigger_book = trigger_book
+        self.min_latency = min_latency
+        self.matching_engine = matching_engine or MatchingEngine()
+        if service.matching_engine is None:
+            service.matching_engine = self.matching_engine  # so orders deleted through the service leave the book
 
-def process_orders():
-    try:
-        orders = db.get_all_orders()
+        self.execution_delay = ExecutionDelayStats()
+        self.stop_event = threading.Event()
+
+        self._events: queue.Queue = queue.Queue()
+        self._failures: dict[int, int] = {}  # order id -> failed executions in a row
+        self._retries: list[tuple[float, int]] = []  # heap of (retry at, order id)
+        self._retrying: dict[int, Order] = {}
+        self._threads: list[threading.Thread] = []
+
+        price_cache.add_listener(self._on_price_change)
+        service.add_deleted_order_listener(self.forget)
+
+    def _on_price_change(self, stock: str, price: float) -> None:
+        self._events.put(("price", stock, price, time.monotonic()))
+
+    def load_orders(self) -> None:
+        # matched in the order they were submitted
+        self._add_orders(sorted(self.service.db.get_all_orders(), key=lambda order: order.id))
+
+    def _match(self, order: Order) -> list[Fill]:
+        side = BOOK_ORDER_SIDES.get(order.order_type)
+        if side is None or order.id in self.matching_engine:
+            return []
+        return self.matching_engine.submit(order.id, order.username, order.stock, side, order.trigger_price,
+                                           order.amount)
+
+    def _add_orders(self, orders: list[Order]) -> None:
+        orders_scanned.labels("orders").inc(len(orders))
+        fills: list[Fill] = []
         for order in orders:
-            if service.can_execute_order(order):
-                service.execute_order(order)
-    except Exception as e:
-        print(f"Error processing orders: {e}")
+            self.trigger_book.add(order)
+            fills.extend(self._match(order))
+
+        if fills:
+            self._settle(fills)
+
+    def _settle(self, fills: list[Fill]) -> None:
+        try:
+            failed = self.service.settle_fills(fills)
+        except Exception as e:
+            print(f"Error settling {len(fills)} fills: {e}")
+            failed = [(fill, f"{e}") for fill in fills]
+        fills_settled.labels("settled").inc(len(fills) - len(failed))
+        fills_settled.labels("failed").inc(len(failed))
+
+        # orders of fills that couldn't be settled leave the book, they only execute against the market from now on
+        for fill, reason in failed:
+            print(f"Error settling fill of orders {fill.buy_order_id} and {fill.sell_order_id}: {reason}")
+            self.matching_engine.cancel(fill.buy_order_id)
+            self.matching_engine.cancel(fill.sell_order_id)
+
+        # the trigger book follows the amounts left in the database, filled orders are gone from it
+        order_ids = {order_id for fill in fills for order_id in (fill.buy_order_id, fill.sell_order_id)}
+        remaining = self.service.db.get_orders(list(order_ids))
+        for order_id in order_ids - {order.id for order in remaining}:
+            self.trigger_book.remove(order_id)
+        for order in remaining:
+            self.trigger_book.add(order)
+
+    def _listen_for_orders(self) -> None:
+        listener = None
+
+        while not self.stop_event.is_set():
+            try:
+                if listener is None:
+                    listener = self.service.db.listen(ORDERS_CHANNEL)
+                    # notifications sent while disconnected are lost, catch up on anything newer than the book
+                    self._events.put(("resync", None, None, time.monotonic()))
+
+                payloads = listener.wait(timeout=1.0)
+                if payloads:
+                    self._events.put(("orders", [int(payload) for payload in payloads], None, time.monotonic()))
+            except Exception as e:
+                print(f"Error listening for orders: {e}")
+                if listener is not None:
+                    listener.close()
+                    listener = None
+                self.stop_event.wait(self.min_latency)
+
+    def _poll_prices(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                # changed prices reach _on_price_change through the cache
+                get_stock_prices(self.trigger_book.symbols())
+            except Exception as e:
+                print(f"Error fetching prices: {e}")
+
+            self.stop_event.wait(self.min_latency)
+
+    def _execute_triggered(self, stock: str, stock_price: float, observed_at: float) -> None:
+        triggered = self.trigger_book.pop_triggered(stock, stock_price)
+        orders_scanned.labels("price").inc(len(triggered))
+
+        for order in triggered:
+            try:
+                self.service.execute_order(order)
+                self.matching_engine.cancel(order.id)
+                self._failures.pop(order.id, None)
+                self.execution_delay.record(time.monotonic() - observed_at)
+                orders_executed.inc()
+            except DBException as e:
+                order_execution_errors.inc()
+                if e.message in PERMANENT_ERRORS:
+                    self._discard(order, e.message)
+                else:
+                    self._schedule_retry(order, e.message)
+            except Exception as e:
+                order_execution_errors.inc()
+                self._schedule_retry(order, f"{e}")
+
+    def _discard(self, order: Order, reason: str) -> None:
+        print(f"Deleting order {order.id}, it can never execute: {reason}")
+        self._failures.pop(order.id, None)
+        try:
+            self.service.delete_order(order.id)
+        except Exception as e:
+            print(f"Error deleting order {order.id}: {e}")
+            self.matching_engine.cancel(order.id)
+
+    def _schedule_retry(self, order: Order, reason: str) -> None:
+        failures = self._failures.get(order.id, 0) + 1
+        self._failures[order.id] = failures
+        delay = min(RETRY_DELAY * 2 ** min(failures - 1, 32), RETRY_MAX_DELAY)
+        print(f"Error executing order {order.id}, attempt {failures}, retrying in {delay:.0f}s: {reason}")
+
+        # out of the trigger book until then, so price changes in between don't retry it
+        self._retrying[order.id] = order
+        heapq.heappush(self._retries, (time.monotonic() + delay, order.id))
+
+    def forget(self, order_id: int) -> None:
+        """
+        Drops a deleted order waiting for a retry, it would otherwise be put back in the trigger book when due.
+        """
+        self._retrying.pop(order_id, None)
+        self._failures.pop(order_id, None)
+
+    def _retry_due(self) -> None:
+        now = time.monotonic()
+        due: list[Order] = []
+        while self._retries and self._retries[0][0] <= now:
+            _, order_id = heapq.heappop(self._retries)
+            order = self._retrying.pop(order_id, None)
+            if order is not None:
+                due.append(order)
+
+        if due:
+            self._handle_new_orders(due, now)
+
+    def _handle_new_orders(self, orders: list, observed_at: float) -> None:
+        self._add_orders(orders)
+
+        # new orders may already be crossed at the current price
+        for stock, stock_price in get_stock_prices(order.stock for order in orders).items():
+            if stock_price is not None:
+                self._execute_triggered(stock, stock_price, observed_at)
+
+    def _handle(self, kind: str, payload, stock_price: Optional[float], observed_at: float) -> None:
+        if kind == "price":
+            self._execute_triggered(payload, stock_price, observed_at)
+        elif kind == "orders":
+            self._handle_new_orders(self.service.db.get_orders(payload), observed_at)
+        elif kind == "resync":
+            self._handle_new_orders(self.service.db.get_orders_after(self.trigger_book.last_order_id), observed_at)
+
+    def run(self) -> None:
+        self.load_orders()
+
+        for target in (self._listen_for_orders, self._poll_prices):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        cycles = {kind: cycle_duration.labels(kind) for kind in EVENT_KINDS}
+        last_report = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                kind, payload, stock_price, observed_at = self._events.get(timeout=1.0)
+                with cycles[kind].time():
+                    self._handle(kind, payload, stock_price, observed_at)
+            except queue.Empty:
+                pass
+            except Exception as e:
+                print(f"Error processing orders: {e}")
+
+            try:
+                self._retry_due()
+            except Exception as e:
+                print(f"Error retrying orders: {e}")
+
+            pending_orders.set(len(self.trigger_book))
+            resting_orders.set(len(self.matching_engine))
+            queued_events.set(self._events.qsize())
+
+            if time.monotonic() - last_report >= STATS_INTERVAL:
+                print(f"Pending orders: {len(self.trigger_book)}, resting in the book: {len(self.matching_engine)}, "
+                      f"trigger-to-execution delay: {self.execution_delay.stats()}")
+                last_report = time.monotonic()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join()
+
 
+if __name__ == "__main__":
+    db = create_database()
+    trigger_book = TriggerBook()
+    service = Service(db, trigger_book)
 
-while True:
-    process_orders()
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
 
-    # save CPU resources, process orders only every 100 seconds
-    time.sleep(FREQUENCY)
\ No newline at end of file
+    OrderProcessor(service, trigger_book).run()
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from broker_simulator.single_flight import Flight, SingleFlight
+
+
+class PriceCache:
+    """
+    Thread-safe price cache with a time-to-live, LRU eviction and single-flight fetches.
+
+    Concurrent lookups of the same missing or stale symbol share one call to the upstream fetch function;
+    every other caller waits for that call and receives its result.
+    """
+
+    def __init__(self, fetch: Callable[[str], Optional[float]], ttl: float = 5.0, max_size: int = 1024,
+                 fetch_many: Optional[Callable[[list[str]], dict[str, Optional[float]]]] = None,
+                 on_lookup: Optional[Callable[[str, str], None]] = None):
+        if ttl < 0:
+            raise ValueError(f"ttl has to be non-negative. ttl provided: {ttl}")
+        if max_size <= 0:
+            raise ValueError(f"max_size has to be positive. max_size provided: {max_size}")
+
+        self.fetch = fetch
+        self.fetch_many = fetch_many or self._fetch_each
+        self.on_lookup = on_lookup  # called with (stock, "hit" | "miss" | "stale") for every lookup
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict()  # stock -> (price, fetched_at)
+        self._in_flight: SingleFlight[float] = SingleFlight()
+        self._listeners: list[Callable[[str, float], None]] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.fetch_errors = 0
+
+    def get(self, stock: str) -> Optional[float]:
+        return self.get_many([stock])[stock]
+
+    def get_many(self, stocks: Iterable[str]) -> dict[str, Optional[float]]:
+        """
+        Looks up several stocks at once. Stocks that are missing or stale and not already being fetched by another
+        thread are fetched together with a single call to `fetch_many`.
+        """
+        now = time.monotonic()
+
+        prices: dict[str, Optional[float]] = {}
+        waiting: dict[str, Flight[float]] = {}
+        leading: dict[str, Optional[tuple[float, float]]] = {}  # stock -> cached entry, None on a miss
+        lookups: list[tuple[str, str]] = []
+
+        with self._lock:
+            for stock in dict.fromkeys(stocks):
+                entry = self._entries.get(stock)
+                if entry is not None:
+                    price, fetched_at = entry
+                    if now - fetched_at < self.ttl:
+                        self.hits += 1
+                        self._entries.move_to_end(stock)
+                        prices[stock] = price
+                        lookups.append((stock, "hit"))
+                        continue
+                    self.stale += 1
+                    lookups.append((stock, "stale"))
+                else:
+                    self.misses += 1
+                    lookups.append((stock, "miss"))
+
+                flight, leader = self._in_flight.join(stock)
+                if leader:
+                    leading[stock] = entry
+                else:
+                    # another thread is already fetching this symbol, wait for its result
+                    self.coalesced += 1
+                    waiting[stock] = flight
+
+        if self.on_lookup is not None:
+            for stock, result in lookups:
+                self.on_lookup(stock, result)
+
+        if leading:
+            prices.update(self._fetch_leading(leading))
+
+        for stock, flight in waiting.items():
+            prices[stock] = flight.wait()
+
+        return prices
+
+    def _fetch_leading(self, leading: dict[str, Optional[tuple[float, float]]]) -> dict[str, Optional[float]]:
+        changed: list[tuple[str, float]] = []
+        error: Optional[BaseException] = None
+        try:
+            fetched = self.fetch_many(list(leading))
+        except BaseException as e:
+            error = e
+            fetched = {}
+            raise
+        finally:
+            with self._lock:
+                if error is not None:
+                    self.fetch_errors += 1
+                fetched_at = time.monotonic()
+                for stock, entry in leading.items():
+                    price = fetched.get(stock)
+                    if price is not None:
+                        if entry is None or entry[0] != price:
+                            changed.append((stock, price))
+                        self._store(stock, price, fetched_at)
+                    self._in_flight.land(stock, price, error)
+
+        for stock, price in changed:
+            for listener in self._listeners:
+                listener(stock, price)
+
+        return {stock: fetched.get(stock) for stock in leading}
+
+    def _fetch_each(self, stocks: list[str]) -> dict[str, Optional[float]]:
+        return {stock: self.fetch(stock) for stock in stocks}
+
+    def _store(self, stock: str, price: float, fetched_at: float) -> None:
+        self._entries[stock] = (price, fetched_at)
+        self._entries.move_to_end(stock)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def add_listener(self, listener: Callable[[str, float], None]) -> None:
+        """
+        Registers a callback invoked with (stock, price) whenever a fetch returns a price different from the cached one.
+        """
+        self._listeners.append(listener)
+
+    def invalidate(self, stock: Optional[str] = None) -> None:
+        with self._lock:
+            if stock is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(stock, None)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "fetch_errors": self.fetch_errors,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,233 @@
+import abc
+import math
+import os
+import zlib
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class PriceSource(abc.ABC):
+    @abc.abstractmethod
+    def get_price(self, stock: str) -> Optional[float]:
+        """
+        Returns the current price of a stock, or None if no price is available for it.
+        """
+        pass
+
+    def get_prices(self, stocks: list[str]) -> dict[str, Optional[float]]:
+        """
+        Returns the current prices of several stocks. Sources that can fetch many symbols at once override this.
+        """
+        return {stock: self.get_price(stock) for stock in stocks}
+
+
+class YFinancePriceSource(PriceSource):
+    def __init__(self):
+        import yfinance as yf  # imported lazily so offline sources don't require it
+        self._yf = yf
+
+    def get_price(self, stock: str) -> Optional[float]:
+        """
+        Fetches the latest closing stock price for a given stock symbol using yfinance.
+
+        :param stock: The stock symbol to fetch the price for.
+        :return: The latest closing stock price as a float. Returns None if data is not available.
+        """
+        ticker = self._yf.Ticker(stock)
+        try:
+            # Get the most recent day's data
+            latest_data = ticker.history(period='1d')
+            # Check if the data is not empty
+            if not latest_data.empty:
+                return latest_data['Close'].iloc[0]
+            else:
+                print("No data available for the specified stock symbol.")
+                return None
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return None
+
+    def get_prices(self, stocks: list[str]) -> dict[str, Optional[float]]:
+        """
+        Fetches the latest closing prices of several stocks with one multi-ticker yfinance download.
+
+        :param stocks: The stock symbols to fetch the prices for.
+        :return: The latest closing price per stock, None for stocks without data.
+        """
+        if len(stocks) <= 1:
+            return super().get_prices(stocks)
+
+        try:
+            latest_data = self._yf.download(stocks, period='1d', group_by='column', threads=True, progress=False)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return {stock: None for stock in stocks}
+
+        if latest_data.empty:
+            print("No data available for the specified stock symbols.")
+            return {stock: None for stock in stocks}
+
+        # the last non-missing close of each ticker
+        closes = latest_data['Close'].ffill().iloc[-1]
+        return {stock: (None if pd.isna(closes.get(stock)) else float(closes[stock])) for stock in stocks}
+
+
+class SimulatedClock:
+    """
+    Maps wall-clock time onto simulated market time.
+
+    Simulated time advances `speed` seconds per wall-clock second, starting at `start` (a unix timestamp) when the
+    clock is created or at `wall_start` if given, so that several processes can share the same simulated timeline.
+    With speed 0 the clock only moves through `advance`.
+    """
+
+    def __init__(self, start: Optional[float] = None, speed: float = 1.0, wall_start: Optional[float] = None):
+        self.start = start
+        self.speed = speed
+        self.wall_start = time.time() if wall_start is None else wall_start
+        self._offset = 0.0
+
+    def elapsed(self) -> float:
+        return (time.time() - self.wall_start) * self.speed + self._offset
+
+    def now(self) -> Optional[float]:
+        if self.start is None:
+            return None
+        return self.start + self.elapsed()
+
+    def advance(self, seconds: float) -> None:
+        self._offset += seconds
+
+
+class ReplayPriceSource(PriceSource):
+    """
+    Serves prices from historical bars stored locally, one file per symbol (`<SYMBOL>.csv` or `<SYMBOL>.parquet`).
+
+    The price returned is the close of the last bar at or before the simulated clock's current time. When the clock
+    has no start, every symbol is replayed from its own first bar. Only the files present in `data_dir` when the source
+    is created are served, symbols are looked up among them and never used to build a path.
+    """
+
+    timestamp_columns = ("Date", "Datetime", "timestamp")
+
+    def __init__(self, data_dir: str, clock: SimulatedClock, price_column: str = "Close"):
+        self.data_dir = data_dir
+        self.clock = clock
+        self.price_column = price_column
+
+        self._lock = threading.Lock()
+        self._files = self._index_files(data_dir)  # stock -> path of its bars
+        self._series: dict[str, tuple[np.ndarray, np.ndarray]] = {}  # stock -> (timestamps, prices)
+
+    @staticmethod
+    def _index_files(data_dir: str) -> dict[str, str]:
+        files: dict[str, str] = {}
+        # parquet wins over csv when a symbol has both
+        for extension in (".csv", ".parquet"):
+            for filename in os.listdir(data_dir):
+                stock, file_extension = os.path.splitext(filename)
+                if file_extension == extension:
+                    files[stock] = os.path.join(data_dir, filename)
+        return files
+
+    def _find_file(self, stock: str) -> Optional[str]:
+        return self._files.get(stock)
+
+    def _load_series(self, stock: str) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        path = self._find_file(stock)
+        if path is None:
+            return None
+
+        if path.endswith(".parquet"):
+            bars = pd.read_parquet(path, memory_map=True)
+        else:
+            bars = pd.read_csv(path, memory_map=True)
+
+        timestamp_column = next((c for c in self.timestamp_columns if c in bars.columns), None)
+        if timestamp_column is not None:
+            timestamps = pd.to_datetime(bars[timestamp_column], utc=True)
+        elif isinstance(bars.index, pd.DatetimeIndex):
+            timestamps = bars.index.tz_localize("UTC") if bars.index.tz is None else bars.index
+        else:
+            raise ValueError(f"No timestamp column found in {path}")
+
+        # seconds since epoch, sorted so that lookups can use binary search
+        seconds = np.asarray(timestamps.astype("int64"), dtype=np.int64) // 1_000_000_000
+        prices = bars[self.price_column].to_numpy(dtype=np.float64)
+        order = np.argsort(seconds, kind="stable")
+        return seconds[order], prices[order]
+
+    def series(self, stock: str) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        # unknown symbols aren't cached, so the cache holds at most one series per file
+        if stock not in self._files:
+            return None
+
+        with self._lock:
+            if stock not in self._series:
+                self._series[stock] = self._load_series(stock)
+            return self._series[stock]
+
+    def get_price(self, stock: str) -> Optional[float]:
+        series = self.series(stock)
+        if series is None or len(series[0]) == 0:
+            return None
+
+        timestamps, prices = series
+        now = self.clock.now()
+        if now is None:
+            now = timestamps[0] + self.clock.elapsed()
+
+        index = np.searchsorted(timestamps, now, side="right") - 1
+        if index < 0:
+            return None
+        return float(prices[index])
+
+
+class SyntheticPriceSource(PriceSource):
+    """
+    Made-up but deterministic prices for any symbol, for load tests and simulations without market data.
+
+    Each symbol oscillates around a base price derived from its name, as a sum of two sine waves whose phases are
+    also derived from the name, so every process sharing the clock sees the same prices.
+    """
+
+    def __init__(self, clock: SimulatedClock, amplitude: float = 0.05, period: float = 3600.0):
+        self.clock = clock
+        self.amplitude = amplitude
+        self.period = period  # simulated seconds
+
+    def get_price(self, stock: str) -> Optional[float]:
+        seed = zlib.crc32(stock.encode())
+        base_price = 10.0 + seed % 490
+        phase = (seed >> 9) % 1000 / 1000 * 2 * math.pi
+
+        angle = 2 * math.pi * self.clock.elapsed() / self.period + phase
+        return base_price * (1 + self.amplitude * math.sin(angle) + self.amplitude / 3 * math.sin(7 * angle))
+
+
+def create_price_source() -> PriceSource:
+    """
+    Builds the price source selected by the PRICE_SOURCE environment variable ("yfinance", "replay" or
+    "synthetic"). The clock of the offline sources is configured by the PRICE_REPLAY_* variables.
+    """
+    source = os.environ.get('PRICE_SOURCE', 'yfinance')
+
+    if source == 'yfinance':
+        return YFinancePriceSource()
+
+    start = os.environ.get('PRICE_REPLAY_START')
+    wall_start = os.environ.get('PRICE_REPLAY_WALL_START')
+    clock = SimulatedClock(start=pd.Timestamp(start, tz="UTC").timestamp() if start else None,
+                           speed=float(os.environ.get('PRICE_REPLAY_SPEED', 1.0)),
+                           wall_start=float(wall_start) if wall_start else None)
+
+    if source == 'replay':
+        return ReplayPriceSource(os.environ['PRICE_REPLAY_DIR'], clock)
+    elif source == 'synthetic':
+        return SyntheticPriceSource(clock)
+    else:
+        raise ValueError(f"Unknown price source: {source}. Only yfinance, replay and synthetic are supported")
@@ -0,0 +1,277 @@
+import asyncio
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+from dotenv import load_dotenv
+
+from broker_simulator.metrics import EndpointLabels
+
+load_dotenv()  # load .env variables
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0))  # fraction of requests profiled
+PROFILING_ENDPOINTS = [endpoint for endpoint in os.environ.get('PROFILING_ENDPOINTS', '').split(',') if endpoint]
+PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL', 0.005))  # seconds between two stack samples
+PROFILING_MAX_DEPTH = int(os.environ.get('PROFILING_MAX_DEPTH', 128))
+PROFILING_MAX_STACKS = int(os.environ.get('PROFILING_MAX_STACKS', 10_000))  # distinct stacks kept per endpoint
+PROFILING_HEADER = os.environ.get('PROFILING_HEADER', 'x-profile').lower()
+
+TRUNCATED_STACK = "[truncated]"
+
+# endpoint of the profiled request being served, copied to the worker threads that run its blocking calls
+profiled_endpoint: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profiled_endpoint", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of selected requests, cheap enough to leave switched on in production.
+
+    While at least one profiled request is in progress, a background thread takes the stacks of all threads with
+    sys._current_frames() every `interval` seconds and keeps those of the threads working on a profiled request: the
+    event loop thread while the request's task is the one running, and the worker threads running its blocking calls.
+    Samples are aggregated per endpoint as folded stacks, the input format of flamegraph.pl and speedscope. Requests
+    that aren't profiled cost one flag check; profiled ones aren't slowed down beyond the GIL taken by the sampler.
+    The sampler needs the GIL too, so Python code that doesn't release it is sampled at most once per switch
+    interval (sys.getswitchinterval(), 5 ms by default) whatever `interval` is set to.
+    """
+
+    def __init__(self, enabled: bool = PROFILING_ENABLED, sample_rate: float = PROFILING_SAMPLE_RATE,
+                 endpoints: Iterable[str] = PROFILING_ENDPOINTS, interval: float = PROFILING_INTERVAL,
+                 max_depth: int = PROFILING_MAX_DEPTH, max_stacks: int = PROFILING_MAX_STACKS):
+        self.configure(enabled, sample_rate, endpoints, interval)
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+
+        self._lock = threading.Lock()
+        self._threads: dict[int, str] = {}  # thread id -> endpoint of the blocking call it runs
+        # event loop thread id -> (loop, task -> endpoint of the request it serves)
+        self._tasks: dict[int, tuple[asyncio.AbstractEventLoop, dict[asyncio.Task, str]]] = {}
+        self._active = 0
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+        self._stacks: dict[str, Counter] = defaultdict(Counter)
+        self._requests: Counter = Counter()
+        self._profiled_time: Counter = Counter()
+        self.samples = 0
+
+    def configure(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+                  endpoints: Optional[Iterable[str]] = None, interval: Optional[float] = None) -> None:
+        """
+        Changes the settings of a running profiler, settings left as None are kept.
+        """
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate has to be between 0 and 1. sample_rate provided: {sample_rate}")
+        if interval is not None and interval <= 0:
+            raise ValueError(f"interval has to be positive. interval provided: {interval}")
+
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if endpoints is not None:
+            self.endpoints = frozenset(endpoints)
+        if interval is not None:
+            self.interval = interval
+        if enabled is not None:
+            self.enabled = enabled
+
+    def should_profile(self, endpoint: str, headers: Iterable[tuple[bytes, bytes]]) -> bool:
+        """
+        Profiles requests carrying the profiling header, requests to the selected endpoints and a random
+        `sample_rate` fraction of the rest, all only while the profiler is enabled.
+        """
+        if not self.enabled:
+            return False
+        if endpoint in self.endpoints or random.random() < self.sample_rate:
+            return True
+        header = PROFILING_HEADER.encode()
+        return any(name == header for name, _ in headers)
+
+    def _start(self) -> None:
+        # with self._lock held
+        self._active += 1
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_forever, name="profiler", daemon=True)
+            self._sampler.start()
+        self._wake.set()
+
+    def _finish(self) -> None:
+        # with self._lock held
+        self._active -= 1
+        if self._active == 0:
+            self._wake.clear()
+
+    @contextmanager
+    def profile_task(self, endpoint: str) -> Iterator[None]:
+        """
+        Samples the current task on the event loop thread for the duration of the block.
+        """
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        thread_id = threading.get_ident()
+        started_at = time.perf_counter()
+
+        with self._lock:
+            self._tasks.setdefault(thread_id, (loop, {}))[1][task] = endpoint
+            self._start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                tasks = self._tasks[thread_id][1]
+                del tasks[task]
+                if not tasks:
+                    del self._tasks[thread_id]
+                self._requests[endpoint] += 1
+                self._profiled_time[endpoint] += time.perf_counter() - started_at
+                self._finish()
+
+    @contextmanager
+    def profile_thread(self, endpoint: str) -> Iterator[None]:
+        """
+        Samples the current thread for the duration of the block, used for the blocking calls of a profiled request.
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = endpoint
+            self._start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._threads[thread_id]
+                self._finish()
+
+    def _fold(self, frame) -> str:
+        names: list[str] = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            targets = list(self._threads.items())
+            for thread_id, (loop, tasks) in self._tasks.items():
+                # the task the loop is running right now, None while the loop waits for I/O
+                endpoint = tasks.get(asyncio.current_task(loop))
+                if endpoint is not None:
+                    targets.append((thread_id, endpoint))
+
+            for thread_id, endpoint in targets:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stacks = self._stacks[endpoint]
+                stack = self._fold(frame)
+                if stack not in stacks and len(stacks) >= self.max_stacks:
+                    stack = TRUNCATED_STACK
+                stacks[stack] += 1
+                self.samples += 1
+
+    def _sample_forever(self) -> None:
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            try:
+                self._sample()
+            except Exception as e:
+                print(f"Error sampling stacks: {e}")
+
+    def folded_stacks(self, endpoint: Optional[str] = None) -> str:
+        """
+        :param endpoint: The endpoint to return the stacks of, None for all of them under a root frame per endpoint.
+        :return: One "frame;frame;...;frame count" line per distinct stack, the format flamegraph.pl reads.
+        """
+        with self._lock:
+            if endpoint is not None:
+                lines = [f"{stack} {count}" for stack, count in self._stacks.get(endpoint, Counter()).items()]
+            else:
+                lines = [f"{name};{stack} {count}" for name, stacks in self._stacks.items()
+                         for stack, count in stacks.items()]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def dump(self, filename: str, endpoint: Optional[str] = None) -> int:
+        """
+        Writes the folded stacks to a file.
+
+        :return: The number of distinct stacks written.
+        """
+        folded = self.folded_stacks(endpoint)
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, "w") as file:
+            file.write(folded)
+        return folded.count("\n")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self._requests.clear()
+            self._profiled_time.clear()
+            self.samples = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "endpoints": sorted(self.endpoints),
+                "interval": self.interval,
+                "in_progress": self._active,
+                "samples": self.samples,
+                "profiled": {
+                    endpoint: {
+                        "requests": self._requests[endpoint],
+                        "seconds": self._profiled_time[endpoint],
+                        "samples": sum(self._stacks[endpoint].values()),
+                        "stacks": len(self._stacks[endpoint]),
+                    }
+                    for endpoint in self._requests
+                },
+            }
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests the profiler selects, labelled by the path of the route they hit.
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+        self._endpoint = EndpointLabels()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+
+        if not self.profiler.should_profile(endpoint, scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        token = profiled_endpoint.set(endpoint)
+        try:
+            with self.profiler.profile_task(endpoint):
+                await self.app(scope, receive, send)
+        finally:
+            profiled_endpoint.reset(token)
+
+
+profiler = SamplingProfiler()
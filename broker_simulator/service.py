@@ -1,12 +1,46 @@
-from broker_simulator.data_models import Order
-from broker_simulator.custom_exceptions import ServiceException
-from broker_simulator.stock_info import get_stock_price
-from broker_simulator.database import Database
+import json
+import os
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from broker_simulator.data_models import Order, BatchOperation
+from broker_simulator.custom_exceptions import DBException, ServiceException
+from broker_simulator.stock_info import get_stock_price, get_stock_prices
+from broker_simulator.database import Database, ORDER_FILLS_CHANNEL
+from broker_simulator.fees import calculate_fee
+from broker_simulator.matching_engine import Fill, MatchingEngine
+from broker_simulator.snapshot_cache import SnapshotCache
+from broker_simulator.streaming import EventBus, account_topic
+from broker_simulator.trigger_book import TriggerBook
+
+BATCH_OPERATIONS = ("buy", "sell", "submit_order")
+BATCH_MODES = ("all_or_nothing", "best_effort")
+BATCH_MAX_OPERATIONS = 1_000
+
+ORDER_TYPES = ("limit", "stop_loss", "take_profit")
+ORDER_COLUMNS = ("id", "username", "stock", "order_type", "trigger_price", "amount")
+ORDER_BOOK_PAGE_SIZE = int(os.environ.get('ORDER_BOOK_PAGE_SIZE', 100))
+ORDER_BOOK_MAX_PAGE_SIZE = int(os.environ.get('ORDER_BOOK_MAX_PAGE_SIZE', 1_000))
+ORDER_BOOK_CACHE_TTL = float(os.environ.get('ORDER_BOOK_CACHE_TTL', 1.0))  # seconds
 
 
 class Service:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, trigger_book: Optional[TriggerBook] = None,
+                 event_bus: Optional[EventBus] = None, matching_engine: Optional[MatchingEngine] = None):
         self.db = db
+        self.trigger_book = trigger_book
+        self.event_bus = event_bus
+        self.matching_engine = matching_engine
+        self._deleted_order_listeners: list[Callable[[int], None]] = []
+
+        # order book pages are shared by every caller polling the same page within the TTL
+        self.order_book_cache = SnapshotCache(ORDER_BOOK_CACHE_TTL)
+
+    def _publish(self, username: str, event: dict) -> None:
+        if self.event_bus is not None:
+            self.event_bus.publish(account_topic(username), event)
 
     def user_exists(self, username: str) -> bool:
         return self.db.user_exists(username)
@@ -30,55 +64,317 @@ class Service:
             raise ServiceException(f"Amount has to be positive. Amount provided: {amount}")
 
         self.db.topup(username, amount)
+        self._publish(username, {"type": "topup", "amount": amount})
 
     def get_portfolio(self, username: str) -> dict[str, float]:
         return self.db.get_portfolio(username)
 
+    def get_account(self, username: str) -> dict:
+        # balance and portfolio from the same snapshot
+        with self.db.snapshot():
+            return {"balance": self.get_balance(username), "portfolio": self.get_portfolio(username)}
+
     @staticmethod
     def _calculate_fee(total: float) -> float:
-        return total * 0.001  # 0.1% of the total
+        return calculate_fee(total)
 
     @staticmethod
     def stock_price(stock: str) -> float:
         return get_stock_price(stock)
 
-    def buy_stock(self, username: str, stock: str, amount: float, commit=True) -> None:
+    @staticmethod
+    def stock_prices(stocks: Iterable[str]) -> dict[str, Optional[float]]:
+        return get_stock_prices(stocks)
+
+    def buy_stock(self, username: str, stock: str, amount: float, commit=True,
+                  stock_price: Optional[float] = None) -> None:
         if amount <= 0:
             raise ServiceException(f"Amount has to be positive. Amount provided: {amount}")
 
-        stock_price = Service.stock_price(stock)
+        if stock_price is None:
+            stock_price = Service.stock_price(stock)
 
         total = stock_price * amount
 
         fee = self._calculate_fee(total)
         self.db.buy_stock(username, stock, amount, total, fee, commit=commit)
 
-    def sell_stock(self, username: str, stock: str, amount: float, commit=True) -> None:
+        if commit:
+            self._publish(username, {"type": "buy", "stock": stock, "amount": amount, "price": float(stock_price)})
+
+    def sell_stock(self, username: str, stock: str, amount: float, commit=True,
+                   stock_price: Optional[float] = None) -> None:
         if amount <= 0:
             raise ServiceException(f"Amount has to be positive. Amount provided: {amount}")
 
-        stock_price = Service.stock_price(stock)
+        if stock_price is None:
+            stock_price = Service.stock_price(stock)
 
         total = stock_price * amount
 
         fee = self._calculate_fee(total)
         self.db.sell_stock(username, stock, amount, total, fee, commit=commit)
 
+        if commit:
+            self._publish(username, {"type": "sell", "stock": stock, "amount": amount, "price": float(stock_price)})
+
     def get_net_worth(self, username: str) -> float:
-        cash = self.get_balance(username)
-        portfolio = self.get_portfolio(username)
+        return self.get_net_worth_breakdown(username)["net_worth"]
+
+    def get_net_worth_breakdown(self, username: str) -> dict:
+        # balance and portfolio are read from the same snapshot, all holdings are priced in one batch
+        with self.db.snapshot():
+            cash = self.get_balance(username)
+            portfolio = self.get_portfolio(username)
+
+        stocks = list(portfolio)
+        stock_prices = Service.stock_prices(stocks)
+
+        missing = [stock for stock in stocks if stock_prices[stock] is None]
+        if missing:
+            raise ServiceException(f"No price available for {', '.join(missing)}")
+
+        amounts = np.fromiter(portfolio.values(), dtype=np.float64, count=len(stocks))
+        prices = np.fromiter((stock_prices[stock] for stock in stocks), dtype=np.float64, count=len(stocks))
+        values = amounts * prices
+
+        return {
+            "net_worth": cash + float(values.sum()),
+            "cash": cash,
+            "holdings": {stock: {"amount": float(amount), "price": float(price), "value": float(value)}
+                         for stock, amount, price, value in zip(stocks, amounts, prices, values)},
+        }
+
+    def submit_order(self, username: str, order_type: str, stock: str, amount: float, trigger_price: float) -> int:
+        order_id = self.db.submit_order(username, order_type, stock, amount, trigger_price)
+
+        if self.trigger_book is not None:
+            self.trigger_book.add(Order(id=order_id, username=username, stock=stock, order_type=order_type,
+                                        trigger_price=trigger_price, amount=amount))
+
+        self._publish(username, {"type": "order_submitted", "order_id": order_id, "order_type": order_type,
+                                 "stock": stock, "amount": amount, "trigger_price": trigger_price})
+        return order_id
 
-        net_worth = cash
-        for stock, amount in portfolio.items():
-            net_worth += Service.stock_price(stock) * amount
+    def add_deleted_order_listener(self, listener: Callable[[int], None]) -> None:
+        """
+        Registers a callback invoked with the order id whenever an order is deleted through the service.
+        """
+        self._deleted_order_listeners.append(listener)
 
-        return net_worth
+    def delete_order(self, order_id: int) -> None:
+        self.db.delete_order(order_id)
 
-    def submit_order(self, username: str, order_type: str, stock: str, amount: float, trigger_price: float):
-        self.db.submit_order(username, order_type, stock, amount, trigger_price)
+        if self.trigger_book is not None:
+            self.trigger_book.remove(order_id)
+        # a deleted order left resting would keep matching, and every batch it matched in would fail to settle
+        if self.matching_engine is not None:
+            self.matching_engine.cancel(order_id)
+        for listener in self._deleted_order_listeners:
+            listener(order_id)
 
-    def get_order_book(self) -> list[Order]:
-        return self.db.get_all_orders()
+    def _execute_batch_operation(self, username: str, operation: BatchOperation,
+                                 stock_prices: dict[str, Optional[float]]) -> Optional[int]:
+        if operation.operation == "submit_order":
+            if operation.order_type is None or operation.trigger_price is None:
+                raise ServiceException("submit_order operations need an order_type and a trigger_price")
+            return self.db.submit_order(username, operation.order_type, operation.stock, operation.amount,
+                                        operation.trigger_price)
+
+        stock_price = stock_prices[operation.stock]
+        if stock_price is None:
+            raise ServiceException(f"No price available for {operation.stock}")
+
+        if operation.operation == "buy":
+            self.buy_stock(username, operation.stock, operation.amount, commit=False, stock_price=stock_price)
+        else:
+            self.sell_stock(username, operation.stock, operation.amount, commit=False, stock_price=stock_price)
+        return None
+
+    def execute_batch(self, username: str, operations: list[BatchOperation], mode: str) -> tuple[bool, list[dict]]:
+        """
+        Executes buy, sell and submit_order operations in one transaction, pricing every distinct stock once.
+
+        In all_or_nothing mode the first failure rolls the whole batch back, in best_effort mode every operation
+        runs in its own savepoint so failed operations are rolled back individually and the rest is committed.
+
+        :return: Whether the batch was committed and one result per operation.
+        """
+        if mode not in BATCH_MODES:
+            raise ServiceException(f"Batch mode is {mode}, only {' and '.join(BATCH_MODES)} are accepted")
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise ServiceException(f"A batch can contain at most {BATCH_MAX_OPERATIONS} operations. "
+                                   f"Operations provided: {len(operations)}")
+        for operation in operations:
+            if operation.operation not in BATCH_OPERATIONS:
+                raise ServiceException(f"Operation is {operation.operation}, "
+                                       f"only {', '.join(BATCH_OPERATIONS)} operations are accepted")
+
+        stock_prices = Service.stock_prices(operation.stock for operation in operations
+                                            if operation.operation != "submit_order")
+
+        results: list[dict] = []
+        submitted_orders: list[Order] = []
+
+        try:
+            with self.db.transaction():
+                for operation in operations:
+                    try:
+                        if mode == "all_or_nothing":
+                            order_id = self._execute_batch_operation(username, operation, stock_prices)
+                        else:
+                            with self.db.savepoint():
+                                order_id = self._execute_batch_operation(username, operation, stock_prices)
+                    except Exception as e:
+                        results.append({"success": False, "order_id": None, "detail": f"{e}"})
+                        if mode == "all_or_nothing":
+                            raise
+                        continue
+
+                    results.append({"success": True, "order_id": order_id, "detail": None})
+                    if order_id is not None:
+                        submitted_orders.append(Order(id=order_id, username=username, stock=operation.stock,
+                                                      order_type=operation.order_type,
+                                                      trigger_price=operation.trigger_price,
+                                                      amount=operation.amount))
+        except Exception as e:
+            if mode != "all_or_nothing":
+                raise ServiceException(f"{e}")
+
+            if not results or results[-1]["success"]:  # the commit itself failed
+                results.append({"success": False, "order_id": None, "detail": f"{e}"})
+
+            # everything that succeeded before the failure has been rolled back, the rest was never attempted
+            for result in results[:-1]:
+                result.update(success=False, order_id=None, detail="Rolled back")
+            results.extend({"success": False, "order_id": None, "detail": "Not executed"}
+                           for _ in range(len(operations) - len(results)))
+            return False, results
+
+        if self.trigger_book is not None:
+            for order in submitted_orders:
+                self.trigger_book.add(order)
+
+        self._publish(username, {"type": "batch", "executed": sum(result["success"] for result in results)})
+        return True, results
+
+    def get_order_book(self, after: int = 0, limit: int = ORDER_BOOK_PAGE_SIZE, stock: Optional[str] = None,
+                       order_type: Optional[str] = None, username: Optional[str] = None, use_cache: bool = True) -> dict:
+        """
+        One page of pending orders in id order, optionally filtered by stock, order type and user.
+
+        :param after: Cursor, the `next_cursor` of the previous page or 0 for the first page.
+        :return: The orders of the page and the cursor of the next page, None if this is the last page.
+        """
+        if not 0 < limit <= ORDER_BOOK_MAX_PAGE_SIZE:
+            raise ServiceException(f"Limit has to be between 1 and {ORDER_BOOK_MAX_PAGE_SIZE}. "
+                                   f"Limit provided: {limit}")
+        if order_type is not None and order_type not in ORDER_TYPES:
+            raise ServiceException(f"Order is of type {order_type}, "
+                                   f"Only limit, stop_loss and take_profit orders are accepted")
+
+        def load() -> dict:
+            rows = self.db.get_orders_page(after, limit, stock, order_type, username)
+            return {"order_book": [dict(zip(ORDER_COLUMNS, row)) for row in rows],
+                    "next_cursor": rows[-1][0] if len(rows) == limit else None}
+
+        if not use_cache:
+            return load()
+        return self.order_book_cache.get((after, limit, stock, order_type, username), load)
+
+    def get_order_book_depth(self, stock: str, levels: int) -> dict:
+        if levels <= 0:
+            raise ServiceException(f"Levels have to be positive. Levels provided: {levels}")
+
+        if self.matching_engine is not None:
+            return self.matching_engine.depth(stock, levels)
+
+        # the book lives in the order processor's process, its resting orders are the pending rows
+        depth = self.db.get_order_book_depth(stock, levels)
+        return {"stock": stock, **{side: [{"price": price, "amount": amount, "orders": count}
+                                          for price, amount, count in depth[side]] for side in ("bids", "asks")}}
+
+    def get_top_of_book(self, stock: str) -> dict:
+        if self.matching_engine is not None:
+            return self.matching_engine.top_of_book(stock)
+
+        depth = self.get_order_book_depth(stock, 1)
+        bid, ask = (depth["bids"] or [None])[0], (depth["asks"] or [None])[0]
+        return {
+            "stock": stock,
+            "bid": bid["price"] if bid else None,
+            "bid_amount": bid["amount"] if bid else 0.0,
+            "ask": ask["price"] if ask else None,
+            "ask_amount": ask["amount"] if ask else 0.0,
+        }
+
+    @staticmethod
+    def _fill_notifications(fill: Fill) -> list[str]:
+        return [json.dumps({"order_id": order_id, "username": username, "stock": fill.stock, "order_type": order_type,
+                            "amount": fill.amount, "price": fill.price})
+                for order_id, username, order_type in ((fill.buy_order_id, fill.buyer, "limit"),
+                                                       (fill.sell_order_id, fill.seller, "take_profit"))]
+
+    def _settle_fill(self, fill: Fill) -> None:
+        total = fill.price * fill.amount
+        fee = self._calculate_fee(total)
+
+        self.db.buy_stock(fill.buyer, fill.stock, fill.amount, total, fee, commit=False)
+        self.db.sell_stock(fill.seller, fill.stock, fill.amount, total, fee, commit=False)
+        self.db.fill_order(fill.buy_order_id, fill.amount, commit=False)
+        self.db.fill_order(fill.sell_order_id, fill.amount, commit=False)
+        self.db.notify_many(ORDER_FILLS_CHANNEL, self._fill_notifications(fill))
+
+    def _settle_fills_at_once(self, fills: list[Fill]) -> None:
+        cash_changes: dict[str, float] = defaultdict(float)
+        position_changes: dict[tuple[str, str], float] = defaultdict(float)
+        filled_orders: dict[int, float] = defaultdict(float)
+
+        for fill in fills:
+            total = fill.price * fill.amount
+            fee = self._calculate_fee(total)
+
+            cash_changes[fill.buyer] -= total + fee
+            cash_changes[fill.seller] += total - fee
+            position_changes[(fill.buyer, fill.stock)] += fill.amount
+            position_changes[(fill.seller, fill.stock)] -= fill.amount
+            filled_orders[fill.buy_order_id] += fill.amount
+            filled_orders[fill.sell_order_id] += fill.amount
+
+        sold_positions = {(fill.seller, fill.stock) for fill in fills}
+        self.db.settle_fills(cash_changes, position_changes, sold_positions, filled_orders, commit=False)
+        self.db.notify_many(ORDER_FILLS_CHANNEL,
+                            [notification for fill in fills for notification in self._fill_notifications(fill)])
+
+    def settle_fills(self, fills: list[Fill]) -> list[tuple[Fill, str]]:
+        """
+        Persists the fills of matched orders in one transaction: both sides pay or receive the traded value and the
+        broker's fee, and the filled amount is taken off both orders.
+
+        The net effect of the whole batch is applied at once. If that fails, the fills are applied one by one, each
+        in its own savepoint, so a fill that can't be settled (e.g. the seller no longer owns the stock or an order
+        was deleted) is rolled back on its own and the rest is committed.
+
+        :return: The fills that were rolled back, with the reason.
+        """
+        failed: list[tuple[Fill, str]] = []
+
+        with self.db.transaction():
+            try:
+                with self.db.savepoint():
+                    self._settle_fills_at_once(fills)
+                return failed
+            except Exception:
+                pass
+
+            for fill in fills:
+                try:
+                    with self.db.savepoint():
+                        self._settle_fill(fill)
+                except Exception as e:
+                    failed.append((fill, f"{e}"))
+
+        return failed
 
     @staticmethod
     def can_execute_order(order: Order) -> bool:
@@ -94,22 +390,31 @@ class Service:
                                    f"Only limit, stop_loss and take_profit orders are accepted")
 
     def execute_order(self, order: Order) -> None:
-        if order.order_type == "limit":
-            try:
-                self.buy_stock(order.username, order.stock, order.amount, commit=False)
-                self.db.delete_order(order.id, commit=False)
-                self.db.conn.commit()
-            except Exception as e:
-                self.db.conn.rollback()
-                raise ServiceException(f"{e}")
-        elif order.order_type == "stop_loss" or order.order_type == "take_profit":
-            try:
-                self.sell_stock(order.username, order.stock, order.amount, commit=False)
-                self.db.delete_order(order.id, commit=False)
-                self.db.conn.commit()
-            except Exception as e:
-                self.db.conn.rollback()
-                raise ServiceException(f"{e}")
-        else:
+        if order.order_type not in ("limit", "stop_loss", "take_profit"):
             raise ServiceException(f"Order is of type {order.order_type}, "
                                    f"Only limit, stop_loss and take_profit orders are accepted")
+
+        stock_price = Service.stock_price(order.stock)
+        if stock_price is None:
+            raise ServiceException(f"No price available for {order.stock}")
+
+        fill = {"order_id": order.id, "username": order.username, "stock": order.stock,
+                "order_type": order.order_type, "amount": order.amount, "price": float(stock_price)}
+
+        try:
+            with self.db.transaction():
+                if order.order_type == "limit":
+                    self.buy_stock(order.username, order.stock, order.amount, commit=False, stock_price=stock_price)
+                else:
+                    self.sell_stock(order.username, order.stock, order.amount, commit=False, stock_price=stock_price)
+                self.db.delete_order(order.id, commit=False)
+
+                # the fill is announced to other processes (e.g. the app's WebSocket streams) once committed
+                self.db.notify(ORDER_FILLS_CHANNEL, json.dumps(fill))
+        except DBException:
+            raise  # kept as is so the order processor can tell orders that can never execute
+        except Exception as e:
+            raise ServiceException(f"{e}")
+
+        if self.trigger_book is not None:
+            self.trigger_book.remove(order.id)
@@ -0,0 +1,57 @@
+import threading
+from typing import Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Flight(Generic[T]):
+    """
+    A load in progress, shared by the caller running it and every caller waiting for its result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[T] = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Optional[T]:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight(Generic[T]):
+    """
+    The loads in progress by key, so that concurrent misses of the same key share one load: the first caller leads
+    the load, the others wait for its result.
+
+    Not thread-safe on its own, `join` and `land` are called with the lock of the owning cache held so that looking
+    up the cache and joining a flight are one step.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, Flight[T]] = {}
+
+    def join(self, key: Hashable) -> tuple[Flight[T], bool]:
+        """
+        :return: The flight loading the key, started if there was none, and whether the caller leads it.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = self._flights[key] = Flight()
+        return flight, True
+
+    def land(self, key: Hashable, value: Optional[T] = None, error: Optional[BaseException] = None) -> None:
+        """
+        Hands the result of the load to the callers waiting for it, later misses of the key start a new flight.
+        """
+        flight = self._flights.pop(key)
+        flight.value = value
+        flight.error = error
+        flight.done.set()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
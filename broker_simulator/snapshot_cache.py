@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from broker_simulator.single_flight import SingleFlight
+
+
+class SnapshotCache:
+    """
+    Thread-safe cache of query results that are shared by every caller for a short time-to-live, with LRU eviction
+    and single-flight loads: concurrent misses of the same key share one call to the loader.
+    """
+
+    def __init__(self, ttl: float = 1.0, max_size: int = 256):
+        if ttl < 0:
+            raise ValueError(f"ttl has to be non-negative. ttl provided: {ttl}")
+        if max_size <= 0:
+            raise ValueError(f"max_size has to be positive. max_size provided: {max_size}")
+
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()  # key -> (value, loaded_at)
+        self._in_flight: SingleFlight[Any] = SingleFlight()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            flight, leader = self._in_flight.join(key)
+            if leader:
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.land(key, error=e)
+            raise
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._in_flight.land(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
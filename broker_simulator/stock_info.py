@@ -1,24 +1,67 @@
-from typing import Optional
-import yfinance as yf
+import os
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+from broker_simulator.metrics import Counter, Histogram, instrument
+from broker_simulator.price_cache import PriceCache
+from broker_simulator.price_source import create_price_source
+
+load_dotenv()  # load .env variables
+
+PRICE_CACHE_TTL = float(os.environ.get('PRICE_CACHE_TTL', 5.0))  # seconds
+PRICE_CACHE_MAX_SIZE = int(os.environ.get('PRICE_CACHE_MAX_SIZE', 1024))
+# symbols come from requests, past this many the rest are counted together under "other"
+PRICE_METRICS_MAX_SYMBOLS = int(os.environ.get('PRICE_METRICS_MAX_SYMBOLS', PRICE_CACHE_MAX_SIZE))
+
+price_lookups = {
+    result: Counter(f"broker_price_cache_{name}", f"Price cache lookups that were a {result}, per symbol", ("stock",),
+                    max_series=PRICE_METRICS_MAX_SYMBOLS)
+    for result, name in (("hit", "hits"), ("miss", "misses"), ("stale", "stale"))
+}
+price_lookup_duration = Histogram("broker_price_lookup_duration_seconds",
+                                  "Duration of price lookups, cached or not", ("function",))
+price_fetch_duration = Histogram("broker_price_fetch_duration_seconds",
+                                 "Duration of price fetches from the price source")
+price_fetch_errors = Counter("broker_price_fetch_errors", "Price fetches from the price source that raised")
+
+
+def _count_lookup(stock: str, result: str) -> None:
+    price_lookups[result].labels(stock).inc()
+
+
+price_source = create_price_source()
+price_cache = PriceCache(instrument(price_source.get_price, price_fetch_duration.labels(),
+                                    errors=price_fetch_errors.labels()),
+                         ttl=PRICE_CACHE_TTL, max_size=PRICE_CACHE_MAX_SIZE,
+                         fetch_many=instrument(price_source.get_prices, price_fetch_duration.labels(),
+                                               errors=price_fetch_errors.labels()),
+                         on_lookup=_count_lookup)
 
 
 def get_stock_price(stock: str) -> Optional[float]:
     """
-    Fetches the latest closing stock price for a given stock symbol using yfinance.
+    Returns the latest closing stock price for a given stock symbol, served from the shared price cache.
 
     :param stock: The stock symbol to fetch the price for.
     :return: The latest closing stock price as a float. Returns None if data is not available.
     """
-    ticker = yf.Ticker(stock)
-    try:
-        # Get the most recent day's data
-        latest_data = ticker.history(period='1d')
-        # Check if the data is not empty
-        if not latest_data.empty:
-            return latest_data['Close'].iloc[0]
-        else:
-            print("No data available for the specified stock symbol.")
-            return None
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+    return price_cache.get(stock)
+
+
+def get_stock_prices(stocks: Iterable[str]) -> dict[str, Optional[float]]:
+    """
+    Returns the latest closing prices of several stocks, fetching every one that isn't cached in a single batch.
+
+    :param stocks: The stock symbols to fetch the prices for.
+    :return: The latest closing price per stock, None for stocks without data.
+    """
+    return price_cache.get_many(stocks)
+
+
+get_stock_price = instrument(get_stock_price, price_lookup_duration.labels("get_stock_price"))
+get_stock_prices = instrument(get_stock_prices, price_lookup_duration.labels("get_stock_prices"))
+
+
+def get_price_cache_stats() -> dict[str, float]:
+    return price_cache.stats()
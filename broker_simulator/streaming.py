@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+from broker_simulator.concurrency import run_blocking
+from broker_simulator.database import Database, ORDER_FILLS_CHANNEL
+
+PRICE_STREAM_INTERVAL = float(os.environ.get('PRICE_STREAM_INTERVAL', 1.0))  # seconds
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 256))
+
+
+def price_topic(stock: str) -> str:
+    return f"prices:{stock}"
+
+
+def account_topic(username: str) -> str:
+    return f"account:{username}"
+
+
+class EventBus:
+    """
+    Fans events out to the asyncio queues of the WebSocket connections subscribed to a topic.
+
+    `publish` may be called from any thread, events are handed to each queue on the event loop that owns it. A
+    subscriber whose queue is full misses events instead of slowing down the publisher.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._loops: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, topic: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers[topic].add(queue)
+            self._loops[queue] = asyncio.get_running_loop()
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def unsubscribe_all(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            for topic in [topic for topic, subscribers in self._subscribers.items() if queue in subscribers]:
+                self._subscribers[topic].discard(queue)
+                if not self._subscribers[topic]:
+                    del self._subscribers[topic]
+            self._loops.pop(queue, None)
+
+    def topics(self, prefix: str = "") -> list[str]:
+        with self._lock:
+            return [topic for topic in self._subscribers if topic.startswith(prefix)]
+
+    def _put(self, queue: asyncio.Queue, event: dict) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            with self._lock:
+                self.dropped += 1
+
+    def publish(self, topic: str, event: dict) -> None:
+        with self._lock:
+            subscribers = [(queue, self._loops[queue]) for queue in self._subscribers.get(topic, ())]
+
+        closed = 0
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:  # the subscriber's event loop has been closed
+                closed += 1
+
+        with self._lock:
+            self.dropped += closed
+            self.published += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "topics": len(self._subscribers),
+                "subscriptions": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "published": self.published,
+                "dropped": self.dropped,
+            }
+
+
+class PriceStreamer:
+    """
+    Polls the prices of every stock someone is subscribed to and publishes the ones that changed.
+    """
+
+    def __init__(self, event_bus: EventBus, get_prices: Callable[[Iterable[str]], dict[str, Optional[float]]],
+                 interval: float = PRICE_STREAM_INTERVAL):
+        self.event_bus = event_bus
+        self.get_prices = get_prices
+        self.interval = interval
+
+        self._last_prices: dict[str, float] = {}
+
+    async def run(self) -> None:
+        prefix = price_topic("")
+        while True:
+            stocks = [topic[len(prefix):] for topic in self.event_bus.topics(prefix)]
+            if stocks:
+                try:
+                    stock_prices = await run_blocking(self.get_prices, stocks)
+                except Exception as e:
+                    print(f"Error fetching streamed prices: {e}")
+                    stock_prices = {}
+
+                for stock, stock_price in stock_prices.items():
+                    if stock_price is not None and self._last_prices.get(stock) != stock_price:
+                        self._last_prices[stock] = stock_price
+                        self.event_bus.publish(price_topic(stock),
+                                               {"type": "price", "stock": stock, "price": float(stock_price)})
+
+            # forget prices nobody listens to anymore so a new subscriber gets the next tick
+            for stock in set(self._last_prices) - set(stocks):
+                del self._last_prices[stock]
+
+            await asyncio.sleep(self.interval)
+
+
+class OrderFillListener:
+    """
+    Forwards the order fills announced by the order processor, which usually runs in another process, to the event
+    bus.
+    """
+
+    def __init__(self, event_bus: EventBus, db: Database):
+        self.event_bus = event_bus
+        self.db = db
+        self.stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _listen(self) -> None:
+        listener = None
+
+        while not self.stop_event.is_set():
+            try:
+                if listener is None:
+                    listener = self.db.listen(ORDER_FILLS_CHANNEL)
+
+                for payload in listener.wait(timeout=1.0):
+                    fill = json.loads(payload)
+                    self.event_bus.publish(account_topic(fill["username"]), {"type": "order_fill", **fill})
+            except Exception as e:
+                print(f"Error listening for order fills: {e}")
+                if listener is not None:
+                    listener.close()
+                    listener = None
+                self.stop_event.wait(1.0)
+
+        if listener is not None:
+            listener.close()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
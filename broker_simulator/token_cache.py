@@ -0,0 +1,69 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache of tokens whose signature has already been verified, keyed by the token's SHA-256 digest.
+
+    Entries are dropped once the token's `exp` claim has passed, so a cached token is never accepted for longer than
+    `jwt.decode` would accept it.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        if max_size <= 0:
+            raise ValueError(f"max_size has to be positive. max_size provided: {max_size}")
+
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[bytes, tuple[str, Optional[float]]] = OrderedDict()  # digest -> (username, exp)
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        digest = self._digest(token)
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            username, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[digest]
+                self.expired += 1
+                return None
+
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return username
+
+    def put(self, token: str, username: str, expires_at: Optional[float]) -> None:
+        digest = self._digest(token)
+
+        with self._lock:
+            self._entries[digest] = (username, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+            }
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from broker_simulator.custom_exceptions import ServiceException
+from broker_simulator.data_models import Order
+
+# limit and stop_loss orders trigger once the price falls to the trigger price, take_profit once it rises to it
+FALLING_TRIGGER_TYPES = ("limit", "stop_loss")
+RISING_TRIGGER_TYPES = ("take_profit",)
+
+_COMPACTION_THRESHOLD = 64
+
+
+class TriggerBook:
+    """
+    In-memory index of pending orders keyed by symbol.
+
+    Per symbol, orders that trigger on a falling price are kept in a max-heap of trigger prices and orders that
+    trigger on a rising price in a min-heap, so a price update only touches the orders whose trigger has been
+    crossed. Removals are lazy: heap entries of removed orders are skipped when they reach the top and the heaps
+    are rebuilt once stale entries outnumber live ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders: dict[int, Order] = {}
+        self._entry_ids: dict[int, int] = {}  # order id -> sequence number of its live heap entry
+        self._sequence = itertools.count()
+
+        # stock -> heap of (key, sequence number, order id), key is -trigger_price for falling triggers
+        self._falling: dict[str, list[tuple[float, int, int]]] = defaultdict(list)
+        self._rising: dict[str, list[tuple[float, int, int]]] = defaultdict(list)
+        self._live: dict[str, int] = defaultdict(int)
+        self._stale: dict[str, int] = defaultdict(int)
+
+        self.last_order_id = 0
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._orders
+
+    def symbols(self) -> list[str]:
+        with self._lock:
+            return [stock for stock, live in self._live.items() if live > 0]
+
+    def get(self, order_id: int) -> Optional[Order]:
+        return self._orders.get(order_id)
+
+    def add(self, order: Order) -> None:
+        if order.order_type in FALLING_TRIGGER_TYPES:
+            key = -order.trigger_price
+        elif order.order_type in RISING_TRIGGER_TYPES:
+            key = order.trigger_price
+        else:
+            raise ServiceException(f"Order is of type {order.order_type}, "
+                                   f"Only limit, stop_loss and take_profit orders are accepted")
+
+        with self._lock:
+            if order.id in self._orders:
+                self._discard(order.id)
+
+            sequence = next(self._sequence)
+            heap = self._falling if order.order_type in FALLING_TRIGGER_TYPES else self._rising
+            heapq.heappush(heap[order.stock], (key, sequence, order.id))
+
+            self._orders[order.id] = order
+            self._entry_ids[order.id] = sequence
+            self._live[order.stock] += 1
+            self.last_order_id = max(self.last_order_id, order.id)
+
+    def remove(self, order_id: int) -> Optional[Order]:
+        with self._lock:
+            return self._discard(order_id)
+
+    def _discard(self, order_id: int) -> Optional[Order]:
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+
+        del self._entry_ids[order_id]
+        self._live[order.stock] -= 1
+        self._stale[order.stock] += 1
+
+        if self._stale[order.stock] > max(self._live[order.stock], _COMPACTION_THRESHOLD):
+            self._compact(order.stock)
+
+        return order
+
+    def _compact(self, stock: str) -> None:
+        for heaps in (self._falling, self._rising):
+            heaps[stock] = [entry for entry in heaps[stock] if self._entry_ids.get(entry[2]) == entry[1]]
+            heapq.heapify(heaps[stock])
+        self._stale[stock] = 0
+
+    def _is_live(self, entry: tuple[float, int, int]) -> bool:
+        return self._entry_ids.get(entry[2]) == entry[1]
+
+    def pop_triggered(self, stock: str, price: float) -> list[Order]:
+        """
+        Removes and returns the orders for a stock whose trigger has been crossed at the given price.
+        """
+        triggered: list[Order] = []
+
+        with self._lock:
+            falling = self._falling.get(stock, [])
+            while falling and (not self._is_live(falling[0]) or price <= -falling[0][0]):
+                entry = heapq.heappop(falling)
+                if self._is_live(entry):
+                    triggered.append(self._pop_entry(entry))
+                else:
+                    self._stale[stock] -= 1
+
+            rising = self._rising.get(stock, [])
+            while rising and (not self._is_live(rising[0]) or price >= rising[0][0]):
+                entry = heapq.heappop(rising)
+                if self._is_live(entry):
+                    triggered.append(self._pop_entry(entry))
+                else:
+                    self._stale[stock] -= 1
+
+        return triggered
+
+    def _pop_entry(self, entry: tuple[float, int, int]) -> Order:
+        order = self._orders.pop(entry[2])
+        del self._entry_ids[entry[2]]
+        self._live[order.stock] -= 1
+        return order
@@ -1,21 +1,183 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
 import matplotlib.pyplot as plt
+import numpy as np
+
+from utils.timeseries import is_timeseries_file, read_timeseries
+
+# a 10 inch wide figure has no more than a couple of thousand pixel columns
+MAX_PLOT_POINTS = 4_000
+DOWNSAMPLING_METHODS = ("minmax", "lttb")
+
+
+def load_log(filename: str) -> tuple[Optional[np.ndarray], np.ndarray]:
+    """
+    Loads a net worth log without going through Python floats.
+
+    Time-series files are memory-mapped, so only the pages that are read are loaded. The old text logs, one value
+    per line, are parsed by NumPy straight into an array.
+
+    :return: The timestamps of the samples (None for text logs) and their net worths.
+    """
+    if is_timeseries_file(filename):
+        series = read_timeseries(filename)
+        return series["timestamp"], series["net_worth"]
+
+    return None, np.fromfile(filename, dtype=np.float64, sep="\n")
+
+
+def min_max_downsample(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Picks the minimum and the maximum of every bucket of samples, so a line plot of the picked samples covers the
+    same pixels as a plot of all of them.
+
+    :return: The sorted indices of the picked samples.
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+
+    n_buckets = max(max_points // 2, 1)
+    bucket_size = n // n_buckets
+    full = bucket_size * n_buckets
+
+    # equal-sized buckets reduced in one pass, the few samples left over form a bucket of their own
+    head = np.asarray(y[:full]).reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    picked = [[0], head.argmin(axis=1) + offsets, head.argmax(axis=1) + offsets, [n - 1]]
+
+    if full < n:
+        tail = np.asarray(y[full:])
+        picked.append([full + tail.argmin(), full + tail.argmax()])
+
+    return np.unique(np.concatenate(picked))
+
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last samples and from every bucket in between the sample
+    forming the largest triangle with the sample kept from the previous bucket and the average of the next bucket.
+
+    :return: The sorted indices of the picked samples.
+    """
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    bounds = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = bounds[i], bounds[i + 1]
+        next_start, next_end = (bounds[i + 1], bounds[i + 2]) if i + 2 < len(bounds) else (n - 1, n)
+        next_x = np.mean(x[next_start:next_end])
+        next_y = np.mean(y[next_start:next_end])
+
+        bucket_x = np.asarray(x[start:end], dtype=np.float64)
+        bucket_y = np.asarray(y[start:end], dtype=np.float64)
+        areas = np.abs((x[previous] - next_x) * (bucket_y - y[previous])
+                       - (x[previous] - bucket_x) * (next_y - y[previous]))
 
+        previous = start + int(areas.argmax())
+        indices[i + 1] = previous
 
-def analyze_logs(filename, save_location):
-    with open(filename, 'r') as file:
-        data = [float(line.strip()) for line in file]
+    return indices
+
+
+def downsample(x: np.ndarray, y: np.ndarray, max_points: int = MAX_PLOT_POINTS,
+               method: str = "minmax") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduces a series to at most about `max_points` samples that plot like the whole series.
+    """
+    if method == "minmax":
+        indices = min_max_downsample(y, max_points)
+    elif method == "lttb":
+        indices = lttb_downsample(x, y, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method {method}, expected one of {', '.join(DOWNSAMPLING_METHODS)}")
+
+    return np.asarray(x[indices]), np.asarray(y[indices])
+
+
+def load_plot_series(filename: str, max_points: int = MAX_PLOT_POINTS,
+                     method: str = "minmax") -> tuple[bool, np.ndarray, np.ndarray]:
+    """
+    Loads and downsamples a log for plotting, x is the timestamp when the log has one and the sample number otherwise.
+
+    :return: Whether x are timestamps, and the downsampled x and net worths.
+    """
+    timestamps, net_worth = load_log(filename)
+    has_timestamps = timestamps is not None
+    x = timestamps if has_timestamps else np.arange(len(net_worth), dtype=np.float64)
+
+    x, y = downsample(x, net_worth, max_points, method)
+    return has_timestamps, x, y
+
+
+def _plot(series: list[tuple[str, bool, np.ndarray, np.ndarray]], save_location: str, title: str) -> None:
+    # dates only when every series has them, sample numbers of different logs can't be put on a common time axis
+    use_dates = all(has_timestamps for _, has_timestamps, _, _ in series)
 
     plt.figure(figsize=(10, 6))
-    plt.plot(data, label='Net Worth')
-    plt.xlabel('Time')
+    for label, _, x, y in series:
+        if use_dates:
+            x = (x * 1e6).astype(np.int64).astype('datetime64[us]')
+        plt.plot(x, y, label=label)
+    if use_dates:
+        plt.gcf().autofmt_xdate()
+    plt.xlabel('Time' if use_dates else 'Sample')
     plt.ylabel('Value')
-    plt.title('Net Worth Over Time')
+    plt.title(title)
     plt.legend()
     plt.grid(True)
 
     plt.savefig(save_location)
     plt.close()
 
+
+def analyze_logs(filename, save_location, max_points: int = MAX_PLOT_POINTS, method: str = "minmax"):
+    has_timestamps, x, y = load_plot_series(filename, max_points, method)
+    _plot([('Net Worth', has_timestamps, x, y)], save_location, 'Net Worth Over Time')
+
+
+def compare_logs(filenames: list[str], save_location: str, max_points: int = MAX_PLOT_POINTS, method: str = "minmax",
+                 workers: Optional[int] = None, labels: Optional[list[str]] = None) -> None:
+    """
+    Plots the net worth of many logs into one chart. The logs are loaded and downsampled in parallel, one process per
+    core by default, and only the downsampled series are sent back for plotting.
+    """
+    labels = labels or [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        loaded = list(executor.map(load_plot_series, filenames, [max_points] * len(filenames),
+                                   [method] * len(filenames)))
+
+    _plot([(label, *series) for label, series in zip(labels, loaded)], save_location, 'Net Worth Comparison')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plots the net worth of one or more bot logs.")
+    parser.add_argument("filenames", nargs="+", help="time-series (.nws) or text logs")
+    parser.add_argument("-o", "--output", required=True, help="image to save the chart to")
+    parser.add_argument("--max-points", type=int, default=MAX_PLOT_POINTS, help="points plotted per log")
+    parser.add_argument("--method", choices=DOWNSAMPLING_METHODS, default="minmax")
+    parser.add_argument("--workers", type=int, default=None, help="processes loading logs, defaults to one per core")
+    args = parser.parse_args()
+
+    if len(args.filenames) == 1:
+        analyze_logs(args.filenames[0], args.output, args.max_points, args.method)
+    else:
+        compare_logs(args.filenames, args.output, args.max_points, args.method, args.workers)
+
+
+if __name__ == "__main__":
+    main()
+
 #analyze_logs('../logs/transaction_cost_bot.txt', 'transaction_cost.png')
 #analyze_logs('../logs/no_transaction_cost_bot.txt', 'no_transaction_cost.png')
 #analyze_logs('../logs/random_bot.txt', 'random_bot.png')
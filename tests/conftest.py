@@ -0,0 +1,5 @@
+import os
+
+# made-up prices, so the broker modules import without network access or market data
+os.environ.setdefault('PRICE_SOURCE', 'synthetic')
+os.environ.setdefault('JWT_SECRET_KEY', 'test')
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from backtesting.engine import Account, Orders, Strategy, run_backtest
+from backtesting.market_data import MarketData
+
+AAA, BBB = 0, 1
+
+
+class ScriptedStrategy(Strategy):
+    """
+    Places the orders of a fixed script, one list of (method, args) per step.
+    """
+
+    def __init__(self, script: list[list[tuple]]):
+        self.script = script
+
+    def on_step(self, step: int, prices: np.ndarray, account: Account, orders: Orders) -> None:
+        for method, *args in self.script[step]:
+            getattr(orders, method)(*args)
+
+
+def test_fills_and_fees_of_a_scripted_run():
+    market_data = MarketData(np.array([0, 1, 2]), ["AAA", "BBB"],
+                             np.array([[100.0, np.nan], [90.0, 50.0], [110.0, 55.0]]))
+    strategy = ScriptedStrategy([
+        [("buy", AAA, 2.0),
+         ("buy", BBB, 1.0),  # no price yet, rejected
+         ("sell", BBB, 1.0),  # nothing to sell, rejected
+         ("submit_order", "limit", AAA, 1.0, 95.0),
+         ("submit_order", "take_profit", AAA, 2.0, 105.0)],
+        [("buy", BBB, 4.0),
+         ("submit_order", "stop_loss", BBB, 0.0, 40.0)],  # amount isn't positive, rejected
+        [("sell", BBB, 4.0)],
+    ])
+
+    result = run_backtest(market_data, strategy, 1_000.0)
+
+    # step 0: buys 2 AAA at 100 for 200 + 0.2 in fees
+    # step 1: buys 4 BBB at 50 for 200 + 0.2, then the limit order buys 1 AAA at 90 for 90 + 0.09
+    # step 2: sells 4 BBB at 55 for 220 - 0.22, then the take_profit order sells 2 AAA at 110 for 220 - 0.22
+    assert result.cash == pytest.approx([799.8, 509.51, 949.07])
+    assert result.positions_value == pytest.approx([200.0, 470.0, 110.0])
+    assert result.holdings.tolist() == [1.0, 0.0]
+    assert result.summary() == pytest.approx({
+        "steps": 3,
+        "start_net_worth": 999.8,
+        "final_net_worth": 1059.07,
+        "total_return": 1059.07 / 999.8 - 1,
+        "max_drawdown": (999.8 - 979.51) / 999.8,
+        "trades": 5,
+        "rejected": 3,
+        "fees": 0.93,
+        "pending_orders": 0,
+    })
+
+
+def test_triggered_sells_of_an_empty_position_are_rejected():
+    market_data = MarketData(np.array([0, 1, 2]), ["AAA"], np.array([[100.0], [80.0], [70.0]]))
+    # the stock is bought after the stop_loss order triggered, the order mustn't sell it later
+    strategy = ScriptedStrategy([[("submit_order", "stop_loss", AAA, 1.0, 90.0)], [], [("buy", AAA, 1.0)]])
+
+    result = run_backtest(market_data, strategy, 1_000.0)
+
+    assert result.summary()["trades"] == 1
+    assert result.rejected == 1
+    assert result.pending_orders == 0
+    assert result.holdings.tolist() == [1.0]
@@ -0,0 +1,128 @@
+import pytest
+
+from broker_simulator.custom_exceptions import ServiceException
+from broker_simulator.matching_engine import Fill, MatchingEngine
+
+STOCK = "MSFT"
+
+
+@pytest.fixture
+def engine() -> MatchingEngine:
+    return MatchingEngine()
+
+
+def test_resting_orders_match_best_price_first_then_oldest_first(engine):
+    engine.submit(1, "seller_1", STOCK, "sell", 101.0, 1.0)
+    engine.submit(2, "seller_2", STOCK, "sell", 101.0, 1.0)
+    engine.submit(3, "seller_3", STOCK, "sell", 100.0, 1.0)
+
+    fills = engine.submit(4, "buyer", STOCK, "buy", 101.0, 3.0)
+
+    assert [(fill.sell_order_id, fill.price) for fill in fills] == [(3, 100.0), (1, 101.0), (2, 101.0)]
+    assert len(engine) == 0
+
+
+def test_orders_that_dont_cross_rest_in_the_book(engine):
+    assert engine.submit(1, "seller", STOCK, "sell", 101.0, 2.0) == []
+    assert engine.submit(2, "buyer", STOCK, "buy", 100.0, 3.0) == []
+
+    assert engine.top_of_book(STOCK) == {"stock": STOCK, "bid": 100.0, "bid_amount": 3.0, "ask": 101.0,
+                                         "ask_amount": 2.0}
+    assert len(engine) == 2
+
+
+def test_fills_trade_at_the_resting_price(engine):
+    engine.submit(1, "buyer", STOCK, "buy", 102.0, 1.0)
+
+    fills = engine.submit(2, "seller", STOCK, "sell", 100.0, 1.0)
+
+    assert fills == [Fill(STOCK, 102.0, 1.0, 1, "buyer", 2, "seller", 0.0, 0.0)]
+
+
+def test_partial_fills_report_the_remaining_amounts(engine):
+    engine.submit(1, "seller", STOCK, "sell", 100.0, 10.0)
+
+    fills = engine.submit(2, "buyer", STOCK, "buy", 100.0, 4.0)
+    assert fills == [Fill(STOCK, 100.0, 4.0, 2, "buyer", 1, "seller", 0.0, 6.0)]
+    assert engine.top_of_book(STOCK)["ask_amount"] == 6.0
+    assert 1 in engine and 2 not in engine
+
+    # the incoming order takes what is left and rests with the rest of its amount
+    fills = engine.submit(3, "buyer", STOCK, "buy", 100.0, 10.0)
+    assert fills == [Fill(STOCK, 100.0, 6.0, 3, "buyer", 1, "seller", 4.0, 0.0)]
+    assert 1 not in engine and 3 in engine
+    assert engine.top_of_book(STOCK) == {"stock": STOCK, "bid": 100.0, "bid_amount": 4.0, "ask": None,
+                                         "ask_amount": 0.0}
+
+
+def test_cancelled_orders_are_skipped_when_matching(engine):
+    engine.submit(1, "seller_1", STOCK, "sell", 100.0, 1.0)
+    engine.submit(2, "seller_2", STOCK, "sell", 100.0, 1.0)
+
+    assert engine.cancel(1)
+    assert engine.top_of_book(STOCK)["ask_amount"] == 1.0
+
+    fills = engine.submit(3, "buyer", STOCK, "buy", 100.0, 2.0)
+    assert [fill.sell_order_id for fill in fills] == [2]
+    assert fills[0].buy_remaining == 1.0
+
+    # filled and cancelled orders are no longer in the book
+    assert not engine.cancel(1)
+    assert not engine.cancel(2)
+    assert engine.cancel(3)
+    assert len(engine) == 0
+
+
+def test_cancelling_the_best_level_exposes_the_next_one(engine):
+    engine.submit(1, "buyer_1", STOCK, "buy", 101.0, 1.0)
+    engine.submit(2, "buyer_2", STOCK, "buy", 100.0, 2.0)
+
+    engine.cancel(1)
+
+    assert engine.top_of_book(STOCK)["bid"] == 100.0
+    fills = engine.submit(3, "seller", STOCK, "sell", 99.0, 1.0)
+    assert [(fill.buy_order_id, fill.price) for fill in fills] == [(2, 100.0)]
+
+
+def test_best_price_survives_heap_compaction(engine):
+    # enough cancelled levels to have the heap of prices rebuilt several times
+    for order_id in range(1, 501):
+        engine.submit(order_id, "buyer", STOCK, "buy", 100.0 + order_id / 100, 1.0)
+    for order_id in range(1, 501):
+        if order_id % 7 != 0:
+            engine.cancel(order_id)
+
+    assert engine.top_of_book(STOCK)["bid"] == 100.0 + 497 / 100
+    fills = engine.submit(1000, "seller", STOCK, "sell", 0.0, 3.0)
+    assert [fill.buy_order_id for fill in fills] == [497, 490, 483]
+
+
+def test_depth_aggregates_price_levels(engine):
+    engine.submit(1, "buyer", STOCK, "buy", 100.0, 1.0)
+    engine.submit(2, "buyer", STOCK, "buy", 100.0, 2.0)
+    engine.submit(3, "buyer", STOCK, "buy", 99.0, 5.0)
+    engine.submit(4, "seller", STOCK, "sell", 102.0, 1.0)
+
+    assert engine.depth(STOCK, levels=1) == {
+        "stock": STOCK,
+        "bids": [{"price": 100.0, "amount": 3.0, "orders": 2}],
+        "asks": [{"price": 102.0, "amount": 1.0, "orders": 1}],
+    }
+
+
+def test_books_are_kept_per_stock(engine):
+    engine.submit(1, "seller", "AAPL", "sell", 100.0, 1.0)
+
+    assert engine.submit(2, "buyer", STOCK, "buy", 100.0, 1.0) == []
+    assert engine.symbols() == ["AAPL", STOCK]
+
+
+def test_invalid_orders_are_rejected(engine):
+    engine.submit(1, "buyer", STOCK, "buy", 100.0, 1.0)
+
+    with pytest.raises(ServiceException):
+        engine.submit(1, "buyer", STOCK, "buy", 100.0, 1.0)
+    with pytest.raises(ServiceException):
+        engine.submit(2, "buyer", STOCK, "hold", 100.0, 1.0)
+    with pytest.raises(ServiceException):
+        engine.submit(3, "buyer", STOCK, "buy", 100.0, 0.0)
@@ -0,0 +1,70 @@
+import pytest
+
+from broker_simulator.custom_exceptions import DBException
+from broker_simulator.memory_database import InMemoryDatabase
+from broker_simulator.order_processor import OrderProcessor
+from broker_simulator.service import Service
+from broker_simulator.trigger_book import TriggerBook
+
+USERNAME = "order_processor_test_user"
+STOCK = "MSFT"
+# a limit order that buys at any price, so it is triggered as soon as it is loaded
+TRIGGER_PRICE = 1e12
+
+
+@pytest.fixture
+def processor() -> OrderProcessor:
+    db = InMemoryDatabase()
+    db.create_user(USERNAME, "-", "-")
+    db.topup(USERNAME, 1_000.0)
+    trigger_book = TriggerBook()
+    return OrderProcessor(Service(db, trigger_book), trigger_book)
+
+
+def _submit(processor: OrderProcessor):
+    order_id = processor.service.db.submit_order(USERNAME, "limit", STOCK, 1.0, TRIGGER_PRICE)
+    (order,) = processor.service.db.get_orders([order_id])
+    return order
+
+
+def _assert_nothing_traded(processor: OrderProcessor) -> None:
+    assert processor.service.get_balance(USERNAME) == 1_000.0
+    assert processor.service.get_portfolio(USERNAME) == {}
+
+
+def test_an_order_deleted_while_waiting_for_a_retry_is_not_executed(processor, monkeypatch):
+    order = _submit(processor)
+
+    def fail_once(_):
+        raise DBException("Operation failed: could not serialize access")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(processor.service, "execute_order", fail_once)
+        processor._handle_new_orders([order], 0.0)
+    assert order.id in processor._retrying
+
+    processor.service.delete_order(order.id)
+    assert order.id not in processor._retrying and order.id not in processor._failures
+
+    # make the retry due right away
+    processor._retries = [(0.0, order.id)]
+    processor._retry_due()
+
+    assert order.id not in processor.trigger_book
+    _assert_nothing_traded(processor)
+
+
+def test_executing_a_deleted_order_rolls_back_and_discards_it(processor):
+    order = _submit(processor)
+    processor.service.db.delete_order(order.id)
+
+    with pytest.raises(DBException, match="This order doesn't exist"):
+        processor.service.execute_order(order)
+    _assert_nothing_traded(processor)
+
+    # e.g. a retry that was already due when the order was deleted
+    processor._handle_new_orders([order], 0.0)
+
+    assert order.id not in processor.trigger_book and order.id not in processor._retrying
+    assert order.id not in processor.matching_engine
+    _assert_nothing_traded(processor)
@@ -0,0 +1,216 @@
+from contextlib import contextmanager
+
+import pytest
+
+from broker_simulator.custom_exceptions import DBException
+from broker_simulator.matching_engine import Fill
+from broker_simulator.memory_database import InMemoryDatabase
+from broker_simulator.service import Service
+
+STOCK = "MSFT"
+PREFIX = "settlement_test_"
+BUYER, SELLER, OTHER_SELLER = f"{PREFIX}buyer", f"{PREFIX}seller", f"{PREFIX}other_seller"
+USERS = (BUYER, SELLER, OTHER_SELLER)
+BACKENDS = ("memory", "postgres")
+
+
+def _create_db(backend: str):
+    if backend == "memory":
+        return InMemoryDatabase()
+
+    # only run against Postgres when one is configured, e.g. through .env, with the tables of schemas.txt
+    from broker_simulator.database import Database
+
+    try:
+        db = Database()
+        db.user_exists(BUYER)
+    except Exception as e:
+        pytest.skip(f"Postgres isn't available: {e}")
+    return db
+
+
+@contextmanager
+def _accounts(db):
+    """
+    A buyer with 10,000 in cash, a seller with 10 shares and a seller with nothing, deleted afterwards.
+    """
+    for username in USERS:
+        if db.user_exists(username):
+            db.delete_user(username)
+        db.create_user(username, "-", "-")
+
+    db.topup(BUYER, 10_000.0)
+    db.buy_stock(SELLER, STOCK, 10.0, 0.0, 0.0)
+    try:
+        yield db
+    finally:
+        for username in USERS:
+            if db.user_exists(username):
+                db.delete_user(username)
+
+
+def _state(db, order_ids: list[int]) -> dict:
+    orders = {order.id: order.amount for order in db.get_orders(order_ids)}
+    return {
+        "balances": {username: round(db.get_balance(username)[0][0], 6) for username in USERS},
+        "portfolios": {username: db.get_portfolio(username) for username in USERS},
+        # ids differ between backends, orders are compared by the position they were submitted in
+        "orders": [orders.get(order_id) for order_id in order_ids],
+    }
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_a_failing_fill_is_rolled_back_on_its_own(backend):
+    with _accounts(_create_db(backend)) as db:
+        buy_1 = db.submit_order(BUYER, "limit", STOCK, 5.0, 100.0)
+        sell_1 = db.submit_order(SELLER, "take_profit", STOCK, 5.0, 100.0)
+        buy_2 = db.submit_order(BUYER, "limit", STOCK, 2.0, 100.0)
+        sell_2 = db.submit_order(OTHER_SELLER, "take_profit", STOCK, 2.0, 100.0)  # doesn't own any MSFT
+
+        good = Fill(STOCK, 100.0, 3.0, buy_1, BUYER, sell_1, SELLER, 2.0, 2.0)
+        bad = Fill(STOCK, 100.0, 2.0, buy_2, BUYER, sell_2, OTHER_SELLER, 0.0, 0.0)
+
+        failed = Service(db).settle_fills([good, bad])
+
+        assert failed == [(bad, "User doesn't own this stock")]
+        # 3 shares at 100 with a fee of 0.1% on both sides
+        assert _state(db, [buy_1, sell_1, buy_2, sell_2]) == {
+            "balances": {BUYER: 10_000.0 - 300.0 - 0.3, SELLER: 300.0 - 0.3, OTHER_SELLER: 0.0},
+            "portfolios": {BUYER: {STOCK: 3.0}, SELLER: {STOCK: 7.0}, OTHER_SELLER: {}},
+            "orders": [2.0, 2.0, 2.0, 2.0],
+        }
+
+
+def _settle_scenario(db, settle) -> dict:
+    with _accounts(db):
+        buy = db.submit_order(BUYER, "limit", STOCK, 12.0, 101.0)
+        sell = db.submit_order(SELLER, "take_profit", STOCK, 10.0, 100.0)
+        # the second fill takes the seller's whole position and what is left of the sell order
+        settle(Service(db), [Fill(STOCK, 100.0, 4.0, buy, BUYER, sell, SELLER, 8.0, 6.0),
+                             Fill(STOCK, 100.5, 6.0, buy, BUYER, sell, SELLER, 2.0, 0.0)])
+        return _state(db, [buy, sell])
+
+
+def _settle_one_by_one(service: Service, fills: list[Fill]) -> None:
+    with service.db.transaction():
+        for fill in fills:
+            service._settle_fill(fill)
+
+
+def _settle_at_once(service: Service, fills: list[Fill]) -> None:
+    assert service.settle_fills(fills) == []
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_a_batch_settles_like_its_fills_one_by_one(backend):
+    db = _create_db(backend)
+
+    one_by_one = _settle_scenario(db, _settle_one_by_one)
+    at_once = _settle_scenario(db, _settle_at_once)
+
+    assert at_once == one_by_one
+    assert at_once == {
+        "balances": {BUYER: round(10_000.0 - 1003.0 - 1.003, 6), SELLER: round(1003.0 - 1.003, 6),
+                     OTHER_SELLER: 0.0},
+        "portfolios": {BUYER: {STOCK: 10.0}, SELLER: {}, OTHER_SELLER: {}},
+        "orders": [2.0, None],
+    }
+
+
+def test_postgres_and_memory_backends_settle_alike():
+    postgres = _create_db("postgres")
+
+    assert _settle_scenario(postgres, _settle_at_once) == _settle_scenario(InMemoryDatabase(), _settle_at_once)
+
+    def settle_directly(service: Service, fills: list[Fill]) -> None:
+        # a user both buying and selling, a position sold out and a buy order filled completely
+        buy, sell = fills[0].buy_order_id, fills[0].sell_order_id
+        service.db.settle_fills(cash_changes={BUYER: -300.3, SELLER: 499.5},
+                                position_changes={(BUYER, STOCK): 3.0, (SELLER, STOCK): -10.0},
+                                sold_positions={(SELLER, STOCK)},
+                                filled_orders={buy: 12.0, sell: 5.0})
+
+    assert _settle_scenario(postgres, settle_directly) == _settle_scenario(InMemoryDatabase(), settle_directly)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_only_the_fill_that_oversells_a_position_fails(backend):
+    with _accounts(_create_db(backend)) as db:
+        buy = db.submit_order(BUYER, "limit", STOCK, 15.0, 100.0)
+        sell = db.submit_order(SELLER, "take_profit", STOCK, 15.0, 100.0)  # for more than the 10 shares owned
+
+        sells_all = Fill(STOCK, 100.0, 10.0, buy, BUYER, sell, SELLER, 5.0, 5.0)
+        oversells = Fill(STOCK, 100.0, 5.0, buy, BUYER, sell, SELLER, 0.0, 0.0)
+
+        failed = Service(db).settle_fills([sells_all, oversells])
+
+        # one by one, the position is gone once it is sold out
+        assert failed == [(oversells, "User doesn't own this stock")]
+        assert _state(db, [buy, sell]) == {
+            "balances": {BUYER: 10_000.0 - 1000.0 - 1.0, SELLER: 1000.0 - 1.0, OTHER_SELLER: 0.0},
+            "portfolios": {BUYER: {STOCK: 10.0}, SELLER: {}, OTHER_SELLER: {}},
+            "orders": [5.0, 5.0],
+        }
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_a_fill_of_a_deleted_order_fails(backend):
+    with _accounts(_create_db(backend)) as db:
+        buy_1 = db.submit_order(BUYER, "limit", STOCK, 2.0, 100.0)
+        sell_1 = db.submit_order(SELLER, "take_profit", STOCK, 2.0, 100.0)
+        buy_2 = db.submit_order(BUYER, "limit", STOCK, 3.0, 100.0)
+        sell_2 = db.submit_order(SELLER, "take_profit", STOCK, 3.0, 100.0)
+        db.delete_order(buy_2)
+
+        good = Fill(STOCK, 100.0, 2.0, buy_1, BUYER, sell_1, SELLER, 0.0, 0.0)
+        bad = Fill(STOCK, 100.0, 3.0, buy_2, BUYER, sell_2, SELLER, 0.0, 0.0)
+
+        failed = Service(db).settle_fills([good, bad])
+
+        assert failed == [(bad, "This order doesn't exist")]
+        assert _state(db, [buy_1, sell_1, buy_2, sell_2]) == {
+            "balances": {BUYER: 10_000.0 - 200.0 - 0.2, SELLER: 200.0 - 0.2, OTHER_SELLER: 0.0},
+            "portfolios": {BUYER: {STOCK: 2.0}, SELLER: {STOCK: 8.0}, OTHER_SELLER: {}},
+            "orders": [None, None, None, 3.0],
+        }
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_partial_fills_reduce_the_orders(backend):
+    with _accounts(_create_db(backend)) as db:
+        buy = db.submit_order(BUYER, "limit", STOCK, 10.0, 100.0)
+        sell = db.submit_order(SELLER, "take_profit", STOCK, 8.0, 100.0)
+
+        failed = Service(db).settle_fills([Fill(STOCK, 100.0, 3.0, buy, BUYER, sell, SELLER, 7.0, 5.0),
+                                           Fill(STOCK, 100.0, 2.0, buy, BUYER, sell, SELLER, 5.0, 3.0)])
+
+        assert failed == []
+        assert _state(db, [buy, sell]) == {
+            "balances": {BUYER: 10_000.0 - 500.0 - 0.5, SELLER: 500.0 - 0.5, OTHER_SELLER: 0.0},
+            "portfolios": {BUYER: {STOCK: 5.0}, SELLER: {STOCK: 5.0}, OTHER_SELLER: {}},
+            "orders": [5.0, 3.0],
+        }
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("changes, error", [
+    ({"position_changes": {(SELLER, STOCK): -15.0}}, "User doesn't own this stock"),
+    ({"sold_positions": {(OTHER_SELLER, STOCK)}}, "User doesn't own this stock"),
+    ({"filled_orders": {-1: 1.0}}, "This order doesn't exist"),
+    ({"cash_changes": {f"{PREFIX}nobody": 1.0}}, "This user doesn't exist"),
+])
+def test_settle_fills_fails_as_a_whole(backend, changes, error):
+    with _accounts(_create_db(backend)) as db:
+        buy = db.submit_order(BUYER, "limit", STOCK, 5.0, 100.0)
+        before = _state(db, [buy])
+
+        arguments = {"cash_changes": {BUYER: -100.1, SELLER: 99.9},
+                     "position_changes": {(BUYER, STOCK): 1.0, (SELLER, STOCK): -1.0},
+                     "sold_positions": {(SELLER, STOCK)},
+                     "filled_orders": {buy: 1.0}}
+        for name, change in changes.items():
+            arguments[name] = arguments[name] | change
+
+        with pytest.raises(DBException, match=error):
+            db.settle_fills(**arguments)
+        assert _state(db, [buy]) == before
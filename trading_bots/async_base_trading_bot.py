@@ -0,0 +1,92 @@
+import abc
+import asyncio
+from typing import Optional
+
+from utils.auth_session import AsyncAuthSession, AuthSession
+from utils.broker_connector import AsyncBrokerClient
+from utils.broker_response_parser import parse_net_worth_breakdown
+from utils.timeseries import TimeSeriesWriter
+
+
+class AsyncBaseTradingBot(abc.ABC):
+    """
+    Trading bot that runs as a task on an event loop shared with many other bots.
+
+    Bots talk to the broker through one shared AsyncBrokerClient and must await between operations (every broker
+    call does) so that the other bots get to run. `run` should return once `stopped` is set.
+    """
+
+    starting_cash = 0.0
+    log_frequency: Optional[float] = None  # seconds between net worth log entries, None to only log when stopped
+
+    def __init__(self, client: AsyncBrokerClient, username: str, password: str, log_filename: str):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.log_filename = log_filename
+        self.log_writer = TimeSeriesWriter(log_filename)
+
+        self.auth_session = AsyncAuthSession(client, username, password, AuthSession.token_file_for(username))
+
+        self._stop_event = asyncio.Event()
+
+    async def setup(self):
+        await self.client.create_user(self.username, self.password)  # will not create a user if it already exists
+        await self.auth_session.start()
+
+        if self.starting_cash:
+            await self.topup(self.starting_cash)
+
+    async def auth_token(self) -> str:
+        return await self.auth_session.access_token()
+
+    async def topup(self, amount: float):
+        await self.client.topup(await self.auth_token(), amount)
+
+    async def log_net_worth(self):
+        breakdown = parse_net_worth_breakdown(await self.client.get_net_worth(await self.auth_token(), breakdown=True))
+        self.log_writer.append(breakdown["net_worth"], breakdown["cash"], breakdown["net_worth"] - breakdown["cash"])
+
+    async def log_continuous(self):
+        while not self.stopped:
+            try:
+                await self.log_net_worth()
+            except Exception as e:
+                print(f"Error logging net worth of {self.username}: {e}")
+
+            if await self.sleep(self.log_frequency):
+                return
+
+    async def sleep(self, seconds: float) -> bool:
+        """
+        Sleeps without holding up shutdown.
+
+        :return: True if the bot was stopped while sleeping.
+        """
+        if seconds <= 0:
+            await asyncio.sleep(0)  # still give the other bots a turn
+            return self.stopped
+
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        return self.stopped
+
+    async def wait_until_stopped(self):
+        await self._stop_event.wait()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        # writes the buffered log samples
+        self.log_writer.close()
+
+    @abc.abstractmethod
+    async def run(self):
+        pass
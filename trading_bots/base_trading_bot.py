@@ -3,8 +3,8 @@ import sys
 import signal
 import threading
 
-from utils.broker_connector import authenticate, topup, create_user
-from utils.broker_response_parser import parse_auth_token
+from utils.auth_session import AuthSession
+from utils.broker_connector import topup, create_user
 from utils.logger import Logger
 
 
@@ -15,15 +15,19 @@ class BaseTradingBot(abc.ABC):
 
         create_user(username, password)  # will not create a user if it already exists
 
-        self.auth_token = parse_auth_token(authenticate(username, password))
+        self.auth_session = AuthSession(username, password, AuthSession.token_file_for(username))
 
-        self.logger = Logger(username, password, log_filename)
+        self.logger = Logger(username, password, log_filename, auth_session=self.auth_session)
 
         self.logger_thread = None
 
         signal.signal(signal.SIGINT, self.shutdown)
         signal.signal(signal.SIGTERM, self.shutdown)
 
+    @property
+    def auth_token(self) -> str:
+        return self.auth_session.access_token
+
     def log(self, frequency: int | None):
         self.logger_thread = threading.Thread(target=self.logger.log_continuous, args=(frequency,))
         self.logger_thread.start()
@@ -35,6 +39,7 @@ class BaseTradingBot(abc.ABC):
         self.logger.stop()
         if self.logger_thread is not None:
             self.logger_thread.join()
+        self.logger.close()
         sys.exit(0)
 
     @abc.abstractmethod
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import os
+import signal
+from typing import Callable
+
+from trading_bots.async_base_trading_bot import AsyncBaseTradingBot
+from trading_bots.magnificent_seven_trading_bot import AsyncMagnificentSevenTradingBot
+from trading_bots.random_trading_bot import AsyncRandomTradingBot
+from utils.broker_connector import AsyncBrokerClient
+
+# logins are bcrypt checks on the broker, starting hundreds of bots at once would only queue up there
+BOT_SETUP_CONCURRENCY = int(os.environ.get('BOT_SETUP_CONCURRENCY', 16))
+BOT_SHUTDOWN_TIMEOUT = float(os.environ.get('BOT_SHUTDOWN_TIMEOUT', 10.0))  # seconds
+
+BOTS: dict[str, type[AsyncBaseTradingBot]] = {
+    "random": AsyncRandomTradingBot,
+    "magnificent_seven": AsyncMagnificentSevenTradingBot,
+}
+
+
+class BotRunner:
+    """
+    Runs many async trading bots concurrently on one event loop.
+
+    SIGINT and SIGTERM stop every bot; bots still busy after the shutdown timeout are cancelled. The net worth of
+    every bot is logged once more before the runner returns.
+    """
+
+    def __init__(self, client: AsyncBrokerClient, setup_concurrency: int = BOT_SETUP_CONCURRENCY,
+                 shutdown_timeout: float = BOT_SHUTDOWN_TIMEOUT):
+        self.client = client
+        self.setup_concurrency = setup_concurrency
+        self.shutdown_timeout = shutdown_timeout
+
+        self.bots: list[AsyncBaseTradingBot] = []
+        self._stop_event = asyncio.Event()
+
+    def add(self, bot: AsyncBaseTradingBot) -> None:
+        self.bots.append(bot)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        for bot in self.bots:
+            bot.stop()
+
+    async def _setup(self, bot: AsyncBaseTradingBot, semaphore: asyncio.Semaphore) -> bool:
+        async with semaphore:
+            if self._stop_event.is_set():
+                return False
+            try:
+                await bot.setup()
+                return True
+            except Exception as e:
+                print(f"Error setting up {bot.username}: {e}")
+                return False
+
+    @staticmethod
+    async def _run_bot(bot: AsyncBaseTradingBot) -> None:
+        try:
+            await bot.run()
+        except Exception as e:
+            print(f"Error running {bot.username}: {e}")
+
+    @staticmethod
+    async def _log_final(bot: AsyncBaseTradingBot) -> None:
+        try:
+            await bot.log_net_worth()
+        except Exception as e:
+            print(f"Error logging net worth of {bot.username}: {e}")
+        finally:
+            bot.close()
+
+    async def _shutdown(self, tasks: list[asyncio.Task]) -> None:
+        self.stop()
+
+        _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout) if tasks else (set(), set())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        try:
+            semaphore = asyncio.Semaphore(self.setup_concurrency)
+            ready = await asyncio.gather(*(self._setup(bot, semaphore) for bot in self.bots))
+            bots = [bot for bot, is_ready in zip(self.bots, ready) if is_ready]
+
+            run_tasks = [asyncio.create_task(self._run_bot(bot), name=f"run-{bot.username}") for bot in bots]
+            log_tasks = [asyncio.create_task(bot.log_continuous(), name=f"log-{bot.username}")
+                         for bot in bots if bot.log_frequency is not None]
+            print(f"Running {len(bots)} of {len(self.bots)} bots")
+
+            # until every bot is done trading or the runner is stopped
+            stopped = asyncio.create_task(self._stop_event.wait())
+            finished = asyncio.gather(*run_tasks)
+            await asyncio.wait([stopped, finished], return_when=asyncio.FIRST_COMPLETED)
+            stopped.cancel()
+
+            await self._shutdown(run_tasks + log_tasks)
+            await asyncio.gather(*(self._log_final(bot) for bot in bots))
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            await self.client.close()
+
+
+async def run_bots(create_bots: Callable[[AsyncBrokerClient], list[AsyncBaseTradingBot]], **client_kwargs) -> None:
+    """
+    Runs the bots built by `create_bots` around one shared client until they finish or the process is signalled.
+    """
+    client = AsyncBrokerClient(**client_kwargs)
+    runner = BotRunner(client)
+    for bot in create_bots(client):
+        runner.add(bot)
+    await runner.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs many trading bots of one kind in a single process.")
+    parser.add_argument("bot", choices=sorted(BOTS))
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--username-prefix", default=None, help="defaults to <bot>_bot")
+    parser.add_argument("--password", default="1234")
+    parser.add_argument("--log-dir", default="logs")
+    parser.add_argument("--pool-size", type=int, default=100, help="keep-alive connections shared by all bots")
+    args = parser.parse_args()
+
+    bot_class = BOTS[args.bot]
+    prefix = args.username_prefix or f"{args.bot}_bot"
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    def create_bots(client: AsyncBrokerClient) -> list[AsyncBaseTradingBot]:
+        return [bot_class(client, f"{prefix}_{i}", args.password, os.path.join(args.log_dir, f"{prefix}_{i}.nws"))
+                for i in range(args.count)]
+
+    asyncio.run(run_bots(create_bots, pool_size=args.pool_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, Optional
+
+import yaml
+from pydantic import BaseModel
+
+from trading_bots.async_base_trading_bot import AsyncBaseTradingBot
+from trading_bots.bot_runner import BOTS, BotRunner
+from utils.broker_connector import AsyncBrokerClient, BROKER_URL
+from utils.request_stats import RequestStats, summarize
+
+
+class BotGroup(BaseModel):
+    bot: str  # a name from bot_runner.BOTS or a dotted path to an AsyncBaseTradingBot subclass
+    count: int = 1
+    username: str = "{bot}_bot_{i}"  # formatted with the group's bot name and the instance index
+    password: str = "1234"
+    log_filename: str = "logs/{username}.nws"
+    starting_cash: Optional[float] = None  # defaults to the bot class's starting_cash
+    params: dict[str, Any] = {}  # extra keyword arguments of the bot class
+
+
+class FleetConfig(BaseModel):
+    broker_url: str = BROKER_URL
+    workers: Optional[int] = None  # defaults to the number of cores
+    pool_size: int = 100  # keep-alive connections per worker
+    report_interval: float = 10.0  # seconds
+    groups: list[BotGroup]
+
+
+def load_fleet_config(path: str) -> FleetConfig:
+    with open(path, 'r') as f:
+        if path.endswith((".yaml", ".yml")):
+            return FleetConfig(**yaml.safe_load(f))
+        return FleetConfig(**json.load(f))
+
+
+def resolve_bot_class(bot: str) -> type[AsyncBaseTradingBot]:
+    if bot in BOTS:
+        return BOTS[bot]
+
+    module_name, _, class_name = bot.rpartition(".")
+    bot_class = getattr(importlib.import_module(module_name), class_name)
+    if not issubclass(bot_class, AsyncBaseTradingBot):
+        raise ValueError(f"{bot} is not an AsyncBaseTradingBot")
+    return bot_class
+
+
+def _create_bots(config: FleetConfig, client: AsyncBrokerClient, worker_id: int,
+                 workers: int) -> list[AsyncBaseTradingBot]:
+    # instances of every group are dealt out round-robin so each worker gets a similar mix
+    bots = []
+    for group in config.groups:
+        bot_class = resolve_bot_class(group.bot)
+        for i in range(worker_id, group.count, workers):
+            username = group.username.format(bot=group.bot.rpartition(".")[2], i=i)
+            log_filename = group.log_filename.format(username=username)
+            os.makedirs(os.path.dirname(log_filename) or ".", exist_ok=True)
+
+            bot = bot_class(client, username, group.password, log_filename, **group.params)
+            if group.starting_cash is not None:
+                bot.starting_cash = group.starting_cash
+            bots.append(bot)
+    return bots
+
+
+async def _run_worker(config: FleetConfig, worker_id: int, workers: int, reports: multiprocessing.Queue) -> None:
+    request_stats = RequestStats()
+    client = AsyncBrokerClient(config.broker_url, pool_size=config.pool_size, request_stats=request_stats)
+    runner = BotRunner(client)
+    for bot in _create_bots(config, client, worker_id, workers):
+        runner.add(bot)
+
+    runner_task = asyncio.create_task(runner.run())
+    while not runner_task.done():
+        await asyncio.wait([runner_task], timeout=config.report_interval)
+        reports.put(("stats", worker_id, request_stats.snapshot()))
+    runner_task.result()
+
+
+def _worker_main(config: FleetConfig, worker_id: int, workers: int, reports: multiprocessing.Queue) -> None:
+    # drop the handlers inherited from the parent, the BotRunner installs its own
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        asyncio.run(_run_worker(config, worker_id, workers, reports))
+    except Exception as e:
+        print(f"Worker {worker_id} failed: {e}")
+    finally:
+        reports.put(("done", worker_id, None))
+
+
+def _format_stats(stats: dict[str, float]) -> str:
+    return (f"{stats['orders_per_second']:.1f} orders/s, {stats['requests_per_second']:.1f} requests/s, "
+            f"{stats['error_rate']:.2%} errors, p50 {stats['p50'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms")
+
+
+class Fleet:
+    """
+    Spreads the bots of a fleet config over one process per core, each running its share on a BotRunner.
+
+    Workers report their request stats every `report_interval` seconds; the parent prints them per worker and for
+    the whole fleet, and a summary of the whole run once every worker has stopped. SIGINT and SIGTERM received by
+    the parent are forwarded to the workers, which shut their bots down gracefully.
+    """
+
+    def __init__(self, config: FleetConfig):
+        self.config = config
+        self.workers = config.workers or os.cpu_count() or 1
+
+        self._reports: multiprocessing.Queue = multiprocessing.Queue()
+        self._processes: list[multiprocessing.Process] = []
+        self._history: dict[int, list[dict]] = {}
+
+    def _forward_signal(self, signum, frame) -> None:
+        for process in self._processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    def _print_latest(self, latest: dict[int, dict]) -> None:
+        for worker_id in sorted(latest):
+            print(f"worker {worker_id}: {_format_stats(summarize([latest[worker_id]]))}")
+        print(f"fleet: {_format_stats(summarize(latest.values()))}")
+
+    def run(self) -> dict[str, float]:
+        """
+        :return: The stats of the whole run, summed over all workers.
+        """
+        previous_handlers = {signum: signal.signal(signum, self._forward_signal)
+                             for signum in (signal.SIGINT, signal.SIGTERM)}
+        started = time.monotonic()
+
+        try:
+            for worker_id in range(self.workers):
+                process = multiprocessing.Process(target=_worker_main, name=f"fleet-worker-{worker_id}",
+                                                  args=(self.config, worker_id, self.workers, self._reports))
+                process.start()
+                self._processes.append(process)
+                self._history[worker_id] = []
+
+            running = set(self._history)
+            latest: dict[int, dict] = {}
+            last_report = time.monotonic()
+            while running:
+                try:
+                    kind, worker_id, snapshot = self._reports.get(timeout=1.0)
+                except queue.Empty:
+                    running = {worker_id for worker_id in running if self._processes[worker_id].is_alive()}
+                    continue
+
+                if kind == "done":
+                    running.discard(worker_id)
+                else:
+                    self._history[worker_id].append(snapshot)
+                    latest[worker_id] = snapshot
+
+                if time.monotonic() - last_report >= self.config.report_interval and latest:
+                    self._print_latest(latest)
+                    latest = {}
+                    last_report = time.monotonic()
+
+            for process in self._processes:
+                process.join()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        duration = time.monotonic() - started
+        for worker_id, snapshots in self._history.items():
+            print(f"worker {worker_id} total: {_format_stats(summarize(snapshots, duration))}")
+        total = summarize([snapshot for snapshots in self._history.values() for snapshot in snapshots], duration)
+        print(f"fleet total over {duration:.0f} s: {_format_stats(total)}")
+        return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a fleet of trading bots over one process per core.")
+    parser.add_argument("config", help="YAML or JSON fleet config, see trading_bots/fleet_example.yaml")
+    args = parser.parse_args()
+
+    Fleet(load_fleet_config(args.config)).run()
+
+
+if __name__ == "__main__":
+    main()
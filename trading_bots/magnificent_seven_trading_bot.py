@@ -1,9 +1,11 @@
+from trading_bots.async_base_trading_bot import AsyncBaseTradingBot
 from trading_bots.base_trading_bot import BaseTradingBot
 from utils.broker_connector import buy_stock
+from utils.stock_symbols import MAGNIFICENT_SEVEN_STOCKS
 
 
 class MagnificentSevenTradingBot(BaseTradingBot):
-    magnificent_seven_stocks = ["GOOG", "AMZN", "AAPL", "MSFT", "META", "NVDA", "TSLA"]
+    magnificent_seven_stocks = MAGNIFICENT_SEVEN_STOCKS
 
     def __init__(self, username: str, password: str, log_filename: str):
         super().__init__(username, password, log_filename)
@@ -16,24 +18,36 @@ class MagnificentSevenTradingBot(BaseTradingBot):
         self.log(300)
 
     def run(self):
-        while True:
-            pass
+        # buy and hold, only the logger has work left to do
+        self.logger_thread.join()
 
 
-# Clean
-try:
-    from utils.broker_connector import authenticate, delete_user
-    from utils.broker_response_parser import parse_auth_token
+class AsyncMagnificentSevenTradingBot(AsyncBaseTradingBot):
+    starting_cash = 3_000
+    log_frequency = 300
 
-    username = "magnificent_seven_bot"
-    pwd = "1234"
+    async def run(self):
+        token = await self.auth_token()
+        for stock in MagnificentSevenTradingBot.magnificent_seven_stocks:
+            await self.client.buy_stock(token, stock, 1)
+
+        await self.wait_until_stopped()
+
+
+if __name__ == "__main__":
+    # Clean
+    try:
+        from utils.broker_connector import authenticate, delete_user
+        from utils.broker_response_parser import parse_auth_token
 
-    auth_token = parse_auth_token(authenticate(username, pwd))
-    delete_user(auth_token)
+        username = "magnificent_seven_bot"
+        pwd = "1234"
 
-except:
-    pass
+        auth_token = parse_auth_token(authenticate(username, pwd))
+        delete_user(auth_token)
 
+    except:
+        pass
 
-bot = MagnificentSevenTradingBot("magnificent_seven_bot", "1234", "magnificent_seven_bot.txt")
-bot.run()
+    bot = MagnificentSevenTradingBot("magnificent_seven_bot", "1234", "magnificent_seven_bot.nws")
+    bot.run()
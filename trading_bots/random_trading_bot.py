@@ -1,18 +1,26 @@
+import functools
+
 import pandas as pd
 import random
 import time
+from trading_bots.async_base_trading_bot import AsyncBaseTradingBot
 from trading_bots.base_trading_bot import BaseTradingBot
 from utils.broker_connector import buy_stock, sell_stock, get_stock_price, authenticate, delete_user, get_balance, \
-    get_portfolio
+    get_portfolio, AsyncBrokerClient
 from utils.broker_response_parser import parse_auth_token, parse_stock_price, parse_balance, parse_portfolio
 
 
+@functools.lru_cache(maxsize=None)
+def load_stock_symbols() -> tuple[str, ...]:
+    return tuple(pd.read_csv("trading_bots/stock_symbols.csv")["Symbol"])
+
+
 class RandomTradingBot(BaseTradingBot):
     def __init__(self, username: str, password: str, log_filename: str):
         super().__init__(username, password, log_filename)
 
         self.operations = ["BUY", "SELL"]
-        self.stocks = pd.read_csv("trading_bots/stock_symbols.csv")["Symbol"].array
+        self.stocks = load_stock_symbols()
 
         self.topup(1_000)
 
@@ -59,16 +67,78 @@ class RandomTradingBot(BaseTradingBot):
             sell_stock(self.auth_token, stock, sell_amount)
 
 
-# Clean
-try:
-    username = "random_bot"
-    pwd = "1234"
+class AsyncRandomTradingBot(AsyncBaseTradingBot):
+    starting_cash = 1_000
+    log_frequency = 100
+
+    def __init__(self, client: AsyncBrokerClient, username: str, password: str, log_filename: str,
+                 trade_interval: float = 0.0):
+        super().__init__(client, username, password, log_filename)
+
+        # seconds between two operations, 0 trades as fast as the broker answers
+        self.trade_interval = trade_interval
+
+        self.operations = ["BUY", "SELL"]
+        self.stocks = load_stock_symbols()
+
+    async def run(self):
+        while not self.stopped:
+            operation = random.choice(self.operations)
+
+            try:
+                if operation == "BUY":
+                    await self.random_buy_operation()
+                elif operation == "SELL":
+                    await self.random_sell_operation()
+            except Exception as e:
+                print(f"Error trading for {self.username}: {e}")
+
+            if await self.sleep(self.trade_interval):
+                return
+
+    async def random_buy_operation(self):
+        stock = None
+        stock_price = None
+
+        while stock_price is None:
+            if self.stopped:
+                return
+            try:
+                stock = random.choice(self.stocks)
+                stock_price = parse_stock_price(await self.client.get_stock_price(stock))
+            except Exception:
+                pass
+
+        token = await self.auth_token()
+        balance = parse_balance(await self.client.get_balance(token))
+        max_amount_to_buy = balance / stock_price
+
+        if max_amount_to_buy != 0:
+            buy_amount = random.uniform(0, max_amount_to_buy)
+            await self.client.buy_stock(token, stock, buy_amount)
+
+    async def random_sell_operation(self):
+        token = await self.auth_token()
+        portfolio = parse_portfolio(await self.client.get_portfolio(token))
+        portfolio_stocks = list(portfolio.keys())
+
+        if len(portfolio_stocks) != 0:
+            stock = random.choice(portfolio_stocks)
+            sell_amount = random.uniform(0, portfolio[stock])
+            await self.client.sell_stock(token, stock, sell_amount)
+
+
+if __name__ == "__main__":
+    # Clean
+    try:
+        username = "random_bot"
+        pwd = "1234"
 
-    auth_token = parse_auth_token(authenticate(username, pwd))
-    delete_user(auth_token)
+        auth_token = parse_auth_token(authenticate(username, pwd))
+        delete_user(auth_token)
 
-except:
-    pass
+    except:
+        pass
 
-bot = RandomTradingBot("random_bot", "1234", "random_bot.txt")
-bot.run()
+    bot = RandomTradingBot("random_bot", "1234", "random_bot.nws")
+    bot.run()
@@ -17,5 +17,6 @@ class TransactionCostTradingBot(BaseTradingBot):
             sell_stock(self.auth_token, TransactionCostTradingBot.stock, 1)
 
 
-bot = TransactionCostTradingBot("transaction_cost_bot", "1234", "transaction_cost_bot.txt")
-bot.run()
+if __name__ == "__main__":
+    bot = TransactionCostTradingBot("transaction_cost_bot", "1234", "transaction_cost_bot.nws")
+    bot.run()
@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from utils.broker_connector import authenticate, refresh_access_token, AsyncBrokerClient
+from utils.broker_response_parser import parse_auth_token, parse_refresh_token
+
+TOKEN_DIR = os.environ.get('BOT_TOKEN_DIR', 'tokens')
+
+# refresh access tokens this many seconds before they expire
+EXPIRY_MARGIN = 30
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """
+    Reads the `exp` claim of a JWT without verifying it.
+
+    :return: The expiry as a unix timestamp, None if the token doesn't expire or can't be read.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return claims.get("exp")
+    except (IndexError, ValueError):
+        return None
+
+
+def _expires_soon(token: str) -> bool:
+    expiry = token_expiry(token)
+    return expiry is not None and expiry - time.time() < EXPIRY_MARGIN
+
+
+def _load_refresh_token(token_file: Optional[str]) -> Optional[str]:
+    if token_file is None or not os.path.exists(token_file):
+        return None
+    with open(token_file, 'r') as f:
+        return f.read().strip() or None
+
+
+def _save_refresh_token(token_file: Optional[str], refresh_token: str) -> None:
+    if token_file is None:
+        return
+    os.makedirs(os.path.dirname(token_file) or ".", exist_ok=True)
+    with open(token_file, 'w') as f:
+        f.write(refresh_token)
+
+
+class AuthSession:
+    """
+    Holds the access and refresh tokens of one user.
+
+    The refresh token is kept in `token_file` so a restarted bot exchanges it for a new access token instead of
+    logging in with its password again, which saves the broker a bcrypt check. Access tokens are refreshed shortly
+    before they expire.
+    """
+
+    def __init__(self, username: str, password: str, token_file: Optional[str] = None):
+        self.username = username
+        self.password = password
+        self.token_file = token_file
+
+        self._lock = threading.Lock()
+        self._access_token: Optional[str] = None
+        self._refresh_token: Optional[str] = _load_refresh_token(token_file)
+
+        if self._refresh_token is None or not self._refresh():
+            self._login()
+
+    def _login(self) -> None:
+        response = authenticate(self.username, self.password)
+        self._access_token = parse_auth_token(response)
+        self._refresh_token = parse_refresh_token(response)
+        _save_refresh_token(self.token_file, self._refresh_token)
+
+    def _refresh(self) -> bool:
+        response = refresh_access_token(self._refresh_token)
+        if response.status_code != 200:
+            return False
+        self._access_token = parse_auth_token(response)
+        return True
+
+    @property
+    def access_token(self) -> str:
+        with self._lock:
+            if _expires_soon(self._access_token):
+                if token_expiry(self._refresh_token) is None or _expires_soon(self._refresh_token) \
+                        or not self._refresh():
+                    self._login()
+            return self._access_token
+
+    @staticmethod
+    def token_file_for(username: str) -> str:
+        return os.path.join(TOKEN_DIR, f"{username}.token")
+
+
+class AsyncAuthSession:
+    """
+    asyncio counterpart of AuthSession, talking to the broker through a shared AsyncBrokerClient.
+
+    `start` must be awaited before the first `access_token` call.
+    """
+
+    def __init__(self, client: AsyncBrokerClient, username: str, password: str, token_file: Optional[str] = None):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.token_file = token_file
+
+        self._lock = asyncio.Lock()
+        self._access_token: Optional[str] = None
+        self._refresh_token: Optional[str] = None
+
+    async def start(self) -> None:
+        self._refresh_token = _load_refresh_token(self.token_file)
+        if self._refresh_token is None or not await self._refresh():
+            await self._login()
+
+    async def _login(self) -> None:
+        response = await self.client.authenticate(self.username, self.password)
+        self._access_token = parse_auth_token(response)
+        self._refresh_token = parse_refresh_token(response)
+        _save_refresh_token(self.token_file, self._refresh_token)
+
+    async def _refresh(self) -> bool:
+        response = await self.client.refresh_access_token(self._refresh_token)
+        if response.status_code != 200:
+            return False
+        self._access_token = parse_auth_token(response)
+        return True
+
+    async def access_token(self) -> str:
+        async with self._lock:
+            if _expires_soon(self._access_token):
+                if token_expiry(self._refresh_token) is None or _expires_soon(self._refresh_token) \
+                        or not await self._refresh():
+                    await self._login()
+            return self._access_token
@@ -1,116 +1,319 @@
+import abc
+import asyncio
+import os
+import time
+from typing import Optional
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.request_stats import RequestStats
 
 HTTP_STRING = "http://"
 IP = "127.0.0.1"
 PORT = 5000
 
+BROKER_URL = os.environ.get('BROKER_URL', f"{HTTP_STRING}{IP}:{PORT}")
+BROKER_TIMEOUT = float(os.environ.get('BROKER_TIMEOUT', 30.0))  # seconds
+BROKER_RETRIES = int(os.environ.get('BROKER_RETRIES', 3))
+BROKER_BACKOFF_FACTOR = float(os.environ.get('BROKER_BACKOFF_FACTOR', 0.5))  # seconds, doubled after every retry
+BROKER_POOL_SIZE = int(os.environ.get('BROKER_POOL_SIZE', 10))
 
-def _create_endpoint(path: str):
-    return f"{HTTP_STRING}{IP}:{PORT}/{path}"
+# only safe to repeat once the request may have reached the broker, other methods are retried on connection errors
+RETRY_STATUSES = (502, 503, 504)
+RETRY_METHODS = frozenset({"GET"})
 
 
 def _get_authorization_header(bearer_token: str):
     return {"Authorization": f"Bearer {bearer_token}"}
 
 
-def create_user(username: str, password: str) -> requests.Response:
-    endpoint = _create_endpoint("create_user")
-    body = {
-        "username": username,
-        "password": password,
-    }
+class _BrokerApi(abc.ABC):
+    """
+    Endpoints of the broker, shared by the sync and async clients which only differ in how `_request` is sent.
+    """
 
-    return requests.post(endpoint, json=body)
+    @abc.abstractmethod
+    def _request(self, method: str, path: str, body: dict | None = None, bearer_token: str | None = None,
+                 params: dict | None = None):
+        pass
 
+    def create_user(self, username: str, password: str):
+        body = {
+            "username": username,
+            "password": password,
+        }
 
-def authenticate(username: str, password: str) -> requests.Response:
-    endpoint = _create_endpoint("login")
-    body = {
-        "username": username,
-        "password": password,
-    }
+        return self._request("POST", "create_user", body)
 
-    return requests.post(endpoint, json=body)
+    def authenticate(self, username: str, password: str):
+        body = {
+            "username": username,
+            "password": password,
+        }
 
+        return self._request("POST", "login", body)
 
-def delete_user(bearer_token: str) -> requests.Response:
-    endpoint = _create_endpoint("delete_user")
-    headers = _get_authorization_header(bearer_token)
+    def refresh_access_token(self, refresh_token: str):
+        body = {
+            "refresh_token": refresh_token,
+        }
 
-    return requests.post(endpoint, headers=headers)
+        return self._request("POST", "refresh", body)
 
+    def delete_user(self, bearer_token: str):
+        return self._request("POST", "delete_user", bearer_token=bearer_token)
 
-def get_balance(bearer_token: str) -> requests.Response:
-    endpoint = _create_endpoint("get_balance")
-    headers = _get_authorization_header(bearer_token)
+    def get_balance(self, bearer_token: str):
+        return self._request("GET", "get_balance", bearer_token=bearer_token)
 
-    return requests.get(endpoint, headers=headers)
+    def topup(self, bearer_token: str, amount: float):
+        body = {
+            "amount": amount,
+        }
 
+        return self._request("PUT", "topup", body, bearer_token)
 
-def topup(bearer_token: str, amount: float) -> requests.Response:
-    endpoint = _create_endpoint("topup")
-    body = {
-        "amount": amount,
-    }
-    headers = _get_authorization_header(bearer_token)
+    def get_stock_price(self, stock: str):
+        body = {
+            "stock": stock,
+        }
 
-    return requests.put(endpoint, json=body, headers=headers)
+        return self._request("GET", "get_stock_price", body)
 
+    def buy_stock(self, bearer_token: str, stock: str, amount: float):
+        body = {
+            "stock": stock,
+            "amount": amount
+        }
 
-def get_stock_price(stock: str) -> requests.Response:
-    endpoint = _create_endpoint("get_stock_price")
-    body = {
-        "stock": stock,
-    }
+        return self._request("PUT", "buy", body, bearer_token)
 
-    return requests.get(endpoint, json=body)
+    def sell_stock(self, bearer_token: str, stock: str, amount: float):
+        body = {
+            "stock": stock,
+            "amount": amount
+        }
 
+        return self._request("PUT", "sell", body, bearer_token)
 
-def buy_stock(bearer_token: str, stock: str, amount: float) -> requests.Response:
-    endpoint = _create_endpoint("buy")
-    body = {
-        "stock": stock,
-        "amount": amount
-    }
-    headers = _get_authorization_header(bearer_token)
+    def get_portfolio(self, bearer_token: str):
+        return self._request("GET", "get_portfolio", bearer_token=bearer_token)
 
-    return requests.put(endpoint, json=body, headers=headers)
+    def get_net_worth(self, bearer_token: str, breakdown: bool = False):
+        params = {"breakdown": "true"} if breakdown else None
+        return self._request("GET", "get_net_worth", bearer_token=bearer_token, params=params)
 
+    def submit_order(self, bearer_token: str, order_type: str, stock: str, amount: float, trigger_price: float):
+        body = {
+            "order_type": order_type,
+            "stock": stock,
+            "amount": amount,
+            "trigger_price": trigger_price
+        }
 
-def sell_stock(bearer_token: str, stock: str, amount: float) -> requests.Response:
-    endpoint = _create_endpoint("sell")
-    body = {
-        "stock": stock,
-        "amount": amount
-    }
-    headers = _get_authorization_header(bearer_token)
+        return self._request("PUT", "submit_order", body, bearer_token)
+
+    def get_order_book(self, bearer_token: str, after: int = 0, limit: int | None = None, stock: str | None = None,
+                       order_type: str | None = None, username: str | None = None):
+        params = {"after": after, "limit": limit, "stock": stock, "order_type": order_type, "username": username}
+        return self._request("GET", "get_order_book", bearer_token=bearer_token,
+                             params={key: value for key, value in params.items() if value is not None})
+
+    def get_top_of_book(self, stock: str):
+        return self._request("GET", "get_top_of_book", params={"stock": stock})
+
+    def get_order_book_depth(self, stock: str, levels: int = 10):
+        return self._request("GET", "get_order_book_depth", params={"stock": stock, "levels": levels})
+
+    def batch(self, bearer_token: str, operations: list[dict], mode: str = "all_or_nothing"):
+        body = {
+            "operations": operations,
+            "mode": mode
+        }
+
+        return self._request("POST", "batch", body, bearer_token)
 
-    return requests.put(endpoint, json=body, headers=headers)
 
+class BrokerClient(_BrokerApi):
+    """
+    Broker client that keeps its connections alive between requests.
+
+    Requests that fail to connect are retried with exponential backoff, GET requests are also retried when the
+    broker answers 502, 503 or 504.
+    """
+
+    def __init__(self, base_url: str = BROKER_URL, timeout: float = BROKER_TIMEOUT, retries: int = BROKER_RETRIES,
+                 backoff_factor: float = BROKER_BACKOFF_FACTOR, pool_size: int = BROKER_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES, allowed_methods=RETRY_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method: str, path: str, body: dict | None = None, bearer_token: str | None = None,
+                 params: dict | None = None) -> requests.Response:
+        headers = _get_authorization_header(bearer_token) if bearer_token is not None else None
+        return self.session.request(method, f"{self.base_url}/{path}", json=body, headers=headers, params=params,
+                                    timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncBrokerClient(_BrokerApi):
+    """
+    asyncio twin of BrokerClient built on httpx, one instance can be shared by many concurrent tasks.
+
+    When given `request_stats`, the latency of every request (including its retries) is recorded there and any
+    response other than 2xx counts as an error.
+    """
+
+    def __init__(self, base_url: str = BROKER_URL, timeout: float = BROKER_TIMEOUT, retries: int = BROKER_RETRIES,
+                 backoff_factor: float = BROKER_BACKOFF_FACTOR, pool_size: int = BROKER_POOL_SIZE,
+                 request_stats: Optional[RequestStats] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.request_stats = request_stats
+
+        # a transport such as httpx.ASGITransport(app) talks to an app in the same process instead
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=timeout, transport=transport,
+                                        limits=httpx.Limits(max_connections=pool_size,
+                                                            max_keepalive_connections=pool_size))
+
+    async def _request(self, method: str, path: str, body: dict | None = None, bearer_token: str | None = None,
+                       params: dict | None = None) -> httpx.Response:
+        if self.request_stats is None:
+            return await self._send(method, path, body, bearer_token, params)
+
+        started = time.perf_counter()
+        success = False
+        try:
+            response = await self._send(method, path, body, bearer_token, params)
+            success = response.is_success
+            return response
+        finally:
+            self.request_stats.record(path, time.perf_counter() - started, success)
+
+    async def _send(self, method: str, path: str, body: dict | None, bearer_token: str | None,
+                    params: dict | None) -> httpx.Response:
+        headers = _get_authorization_header(bearer_token) if bearer_token is not None else None
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, f"/{path}", json=body, headers=headers, params=params)
+                if (response.status_code not in RETRY_STATUSES or method not in RETRY_METHODS
+                        or attempt >= self.retries):
+                    return response
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt >= self.retries:
+                    raise
+
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+            attempt += 1
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+_default_client = BrokerClient()
+
+
+def create_user(username: str, password: str) -> requests.Response:
+    return _default_client.create_user(username, password)
 
-def get_portfolio(bearer_token: str) -> requests.Response:
-    endpoint = _create_endpoint("get_portfolio")
-    headers = _get_authorization_header(bearer_token)
 
-    return requests.get(endpoint, headers=headers)
+def authenticate(username: str, password: str) -> requests.Response:
+    return _default_client.authenticate(username, password)
+
+
+def refresh_access_token(refresh_token: str) -> requests.Response:
+    return _default_client.refresh_access_token(refresh_token)
+
+
+def delete_user(bearer_token: str) -> requests.Response:
+    return _default_client.delete_user(bearer_token)
 
 
-def get_net_worth(bearer_token: str) -> requests.Response:
-    endpoint = _create_endpoint("get_net_worth")
-    headers = _get_authorization_header(bearer_token)
+def get_balance(bearer_token: str) -> requests.Response:
+    return _default_client.get_balance(bearer_token)
 
-    return requests.get(endpoint, headers=headers)
+
+def topup(bearer_token: str, amount: float) -> requests.Response:
+    return _default_client.topup(bearer_token, amount)
+
+
+def get_stock_price(stock: str) -> requests.Response:
+    return _default_client.get_stock_price(stock)
+
+
+def buy_stock(bearer_token: str, stock: str, amount: float) -> requests.Response:
+    return _default_client.buy_stock(bearer_token, stock, amount)
+
+
+def sell_stock(bearer_token: str, stock: str, amount: float) -> requests.Response:
+    return _default_client.sell_stock(bearer_token, stock, amount)
+
+
+def get_portfolio(bearer_token: str) -> requests.Response:
+    return _default_client.get_portfolio(bearer_token)
+
+
+def get_net_worth(bearer_token: str, breakdown: bool = False) -> requests.Response:
+    return _default_client.get_net_worth(bearer_token, breakdown)
 
 
 def submit_order(bearer_token: str, order_type: str, stock: str,
                  amount: float, trigger_price: float) -> requests.Response:
-    endpoint = _create_endpoint("submit_order")
-    body = {
-        "order_type": order_type,
-        "stock": stock,
-        "amount": amount,
-        "trigger_price": trigger_price
-    }
-    headers = _get_authorization_header(bearer_token)
-
-    return requests.put(endpoint, json=body, headers=headers)
\ No newline at end of file
+    return _default_client.submit_order(bearer_token, order_type, stock, amount, trigger_price)
+
+
+def get_order_book(bearer_token: str, after: int = 0, limit: int | None = None, stock: str | None = None,
+                   order_type: str | None = None, username: str | None = None) -> requests.Response:
+    return _default_client.get_order_book(bearer_token, after, limit, stock, order_type, username)
+
+
+def get_top_of_book(stock: str) -> requests.Response:
+    return _default_client.get_top_of_book(stock)
+
+
+def get_order_book_depth(stock: str, levels: int = 10) -> requests.Response:
+    return _default_client.get_order_book_depth(stock, levels)
+
+
+def buy_operation(stock: str, amount: float) -> dict:
+    return {"operation": "buy", "stock": stock, "amount": amount}
+
+
+def sell_operation(stock: str, amount: float) -> dict:
+    return {"operation": "sell", "stock": stock, "amount": amount}
+
+
+def submit_order_operation(order_type: str, stock: str, amount: float, trigger_price: float) -> dict:
+    return {"operation": "submit_order", "order_type": order_type, "stock": stock, "amount": amount,
+            "trigger_price": trigger_price}
+
+
+def batch(bearer_token: str, operations: list[dict], mode: str = "all_or_nothing") -> requests.Response:
+    return _default_client.batch(bearer_token, operations, mode)
@@ -1,23 +1,47 @@
+import orjson
 import requests
-import ast
+
+
+# the broker sends numbers and objects as JSON values, orjson decodes the body straight from bytes
+def _parse_json(response: requests.Response) -> dict:
+    return orjson.loads(response.content)
 
 
 def parse_auth_token(auth_response: requests.Response) -> str:
-    return auth_response.json()["access_token"]
+    return _parse_json(auth_response)["access_token"]
+
+
+def parse_refresh_token(auth_response: requests.Response) -> str:
+    return _parse_json(auth_response)["refresh_token"]
 
 
 def parse_balance(balance_response: requests.Response) -> float:
-    return float(balance_response.json()["balance"])
+    return _parse_json(balance_response)["balance"]
 
 
 def parse_stock_price(stock_price_response: requests.Response) -> float:
-    return float(stock_price_response.json()["stock_price"])
+    stock_price = _parse_json(stock_price_response)["stock_price"]
+    if stock_price is None:
+        raise ValueError("No price available")
+    return stock_price
 
 
 def parse_net_worth(net_worth_response: requests.Response) -> float:
-    return float(net_worth_response.json()["net_worth"])
+    return _parse_json(net_worth_response)["net_worth"]
+
+
+def parse_net_worth_breakdown(net_worth_response: requests.Response) -> dict:
+    # requested with breakdown=true: net_worth, cash and holdings
+    return _parse_json(net_worth_response)["breakdown"]
 
 
 def parse_portfolio(portfolio_response: requests.Response) -> dict[str, float]:
-    portfolio_str = portfolio_response.json()["portfolio"]
-    return ast.literal_eval(portfolio_str)
+    return _parse_json(portfolio_response)["portfolio"]
+
+
+def parse_order_id(submit_order_response: requests.Response) -> int:
+    return _parse_json(submit_order_response)["order_id"]
+
+
+def parse_batch_results(batch_response: requests.Response) -> list[dict]:
+    return _parse_json(batch_response)["results"]
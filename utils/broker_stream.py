@@ -0,0 +1,62 @@
+import orjson
+from typing import Iterator
+
+from websockets.sync.client import connect, ClientConnection
+
+from utils.broker_connector import BROKER_URL
+
+
+def _create_ws_endpoint(path: str, base_url: str = BROKER_URL):
+    # ws:// for http:// and wss:// for https://
+    return f"ws{base_url.rstrip('/').removeprefix('http')}/{path}"
+
+
+class _Stream:
+    def __init__(self, connection: ClientConnection):
+        self.connection = connection
+
+    def receive(self, timeout: float | None = None) -> dict:
+        """
+        Blocks until the next event arrives, raises TimeoutError if none arrives within `timeout` seconds.
+        """
+        return orjson.loads(self.connection.recv(timeout=timeout))
+
+    def __iter__(self) -> Iterator[dict]:
+        for message in self.connection:
+            yield orjson.loads(message)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PriceStream(_Stream):
+    """
+    Receives a {"type": "price", "stock": ..., "price": ...} event whenever the price of a subscribed stock changes.
+    """
+
+    def __init__(self, stocks: list[str]):
+        super().__init__(connect(_create_ws_endpoint("ws/prices")))
+        self.subscribe(stocks)
+
+    def subscribe(self, stocks: list[str]):
+        self.connection.send(orjson.dumps({"subscribe": stocks}).decode())
+
+    def unsubscribe(self, stocks: list[str]):
+        self.connection.send(orjson.dumps({"unsubscribe": stocks}).decode())
+
+
+class AccountStream(_Stream):
+    """
+    Receives an event for every change to the user's account (topup, buy, sell, order_submitted, order_fill, batch),
+    each carrying the resulting balance and portfolio. The first event is a snapshot of the current state.
+    """
+
+    def __init__(self, bearer_token: str):
+        super().__init__(connect(_create_ws_endpoint("ws/account"),
+                                 additional_headers={"Authorization": f"Bearer {bearer_token}"}))
@@ -1,33 +1,49 @@
-import time
 import threading
-from utils.broker_connector import authenticate, get_net_worth
-from utils.broker_response_parser import parse_auth_token, parse_net_worth
+from typing import Optional
+
+from utils.auth_session import AuthSession
+from utils.broker_connector import get_net_worth
+from utils.broker_response_parser import parse_net_worth_breakdown
+from utils.timeseries import TimeSeriesWriter, LOG_BUFFER_SIZE, LOG_FLUSH_INTERVAL
 
 
 class Logger:
-    def __init__(self, username: str, password: str, filename: str):
+    """
+    Samples a user's net worth, cash and positions value into a binary time-series file (see utils.timeseries).
+
+    Samples are buffered and written in batches; `stop` or `close` write whatever is still buffered.
+    """
+
+    def __init__(self, username: str, password: str, filename: str, auth_session: Optional[AuthSession] = None,
+                 buffer_size: int = LOG_BUFFER_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
         self.username = username
         self.password = password
 
-        self.auth_token = parse_auth_token(authenticate(username, password))
+        # share the bot's session when possible instead of logging in a second time
+        self.auth_session = auth_session or AuthSession(username, password)
 
         self.filename = filename
+        self.writer = TimeSeriesWriter(filename, buffer_size, flush_interval)
 
         self.stop_event = threading.Event()
 
     def log_continuous(self, frequency: int | None):
-        while not self.stop_event.is_set():
-            net_worth = parse_net_worth(get_net_worth(self.auth_token))
-            with open(self.filename, 'a') as f:
-                f.write(f"{net_worth}\n")
+        try:
+            while not self.stop_event.is_set():
+                self.log_manual()
 
-            if frequency is not None:
-                time.sleep(frequency)
+                if frequency is not None:
+                    self.stop_event.wait(frequency)  # wakes up as soon as the logger is stopped
+        finally:
+            self.writer.flush()
 
     def log_manual(self):
-        net_worth = parse_net_worth(get_net_worth(self.auth_token))
-        with open(self.filename, 'a') as f:
-            f.write(f"{net_worth}\n")
+        breakdown = parse_net_worth_breakdown(get_net_worth(self.auth_session.access_token, breakdown=True))
+        self.writer.append(breakdown["net_worth"], breakdown["cash"], breakdown["net_worth"] - breakdown["cash"])
 
     def stop(self):
         self.stop_event.set()
+
+    def close(self):
+        self.stop()
+        self.writer.close()
@@ -0,0 +1,89 @@
+import time
+from typing import Iterable
+
+import numpy as np
+
+# upper bounds in seconds of the latency buckets, 5% apart from 0.1 ms to a minute so histograms of different
+# processes can be added up and still give percentiles within a few percent
+LATENCY_BUCKETS = np.geomspace(1e-4, 60.0, 274)
+
+# endpoints that place orders
+ORDER_PATHS = frozenset({"buy", "sell", "submit_order", "batch"})
+
+
+class RequestStats:
+    """
+    Counts the requests sent to the broker, their errors and latencies, since the last snapshot.
+
+    Not thread-safe, it is meant to be updated from one event loop.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self.started = time.monotonic()
+        self.requests = 0
+        self.orders = 0
+        self.errors = 0
+        self.latency_counts = np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64)
+
+    def record(self, path: str, latency: float, success: bool) -> None:
+        self.requests += 1
+        if path in ORDER_PATHS:
+            self.orders += 1
+        if not success:
+            self.errors += 1
+        self.latency_counts[np.searchsorted(LATENCY_BUCKETS, latency)] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns the counts since the previous snapshot and starts counting anew.
+        """
+        snapshot = {
+            "interval": time.monotonic() - self.started,
+            "requests": self.requests,
+            "orders": self.orders,
+            "errors": self.errors,
+            "latency_counts": self.latency_counts.tolist(),
+        }
+        self._reset()
+        return snapshot
+
+
+def histogram_percentile(latency_counts: np.ndarray, percentile: float) -> float:
+    """
+    :return: The upper bound in seconds of the bucket holding the given percentile, 0 for an empty histogram.
+    """
+    total = latency_counts.sum()
+    if total == 0:
+        return 0.0
+    index = int(np.searchsorted(np.cumsum(latency_counts), total * percentile / 100))
+    return float(LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)])
+
+
+def summarize(snapshots: Iterable[dict], interval: float | None = None) -> dict[str, float]:
+    """
+    Merges snapshots, e.g. of several workers over the same period or of one worker over consecutive periods.
+
+    :param interval: The wall-clock seconds the snapshots cover, defaults to the longest snapshot interval.
+    """
+    snapshots = list(snapshots)
+    requests = sum(snapshot["requests"] for snapshot in snapshots)
+    orders = sum(snapshot["orders"] for snapshot in snapshots)
+    errors = sum(snapshot["errors"] for snapshot in snapshots)
+    latency_counts = np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64)
+    for snapshot in snapshots:
+        latency_counts += np.asarray(snapshot["latency_counts"], dtype=np.int64)
+
+    if interval is None:
+        interval = max((snapshot["interval"] for snapshot in snapshots), default=0.0)
+
+    return {
+        "requests": requests,
+        "orders_per_second": orders / interval if interval else 0.0,
+        "requests_per_second": requests / interval if interval else 0.0,
+        "error_rate": errors / requests if requests else 0.0,
+        "p50": histogram_percentile(latency_counts, 50),
+        "p99": histogram_percentile(latency_counts, 99),
+    }
@@ -0,0 +1 @@
+MAGNIFICENT_SEVEN_STOCKS = ["GOOG", "AMZN", "AAPL", "MSFT", "META", "NVDA", "TSLA"]
@@ -0,0 +1,145 @@
+import argparse
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+# a file is this magic string followed by the raw records, little-endian
+MAGIC = b"NWTS\x00\x01\x00\x00"
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),  # unix seconds
+    ("net_worth", "<f8"),
+    ("cash", "<f8"),  # NaN when unknown
+    ("positions_value", "<f8"),  # NaN when unknown
+])
+
+LOG_BUFFER_SIZE = int(os.environ.get('LOG_BUFFER_SIZE', 256))  # samples
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 60.0))  # seconds
+
+
+def is_timeseries_file(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class TimeSeriesWriter:
+    """
+    Appends timestamped net worth samples to a binary time-series file.
+
+    Samples are buffered and written in one go once `buffer_size` samples are waiting or `flush_interval` seconds
+    have passed since the last write, and when the writer is flushed or closed. Thread-safe.
+    """
+
+    def __init__(self, filename: str, buffer_size: int = LOG_BUFFER_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.filename = filename
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._buffer = np.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            if not is_timeseries_file(filename):
+                raise ValueError(f"{filename} exists and is not a time-series file")
+            self._truncate_partial_record()
+        else:
+            with open(filename, 'wb') as f:
+                f.write(MAGIC)
+
+        self._file = open(filename, 'ab')
+
+    def _truncate_partial_record(self) -> None:
+        # a crash in the middle of a write can leave part of a record behind, later records would be misaligned
+        excess = (os.path.getsize(self.filename) - len(MAGIC)) % RECORD_DTYPE.itemsize
+        if excess:
+            with open(self.filename, 'r+b') as f:
+                f.truncate(os.path.getsize(self.filename) - excess)
+
+    def append(self, net_worth: float, cash: float = np.nan, positions_value: float = np.nan,
+               timestamp: Optional[float] = None) -> None:
+        with self._lock:
+            self._buffer[self._count] = (time.time() if timestamp is None else timestamp, net_worth, cash,
+                                         positions_value)
+            self._count += 1
+
+            if self._count == len(self._buffer) or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._count:
+            self._file.write(self._buffer[:self._count].tobytes())
+            self._file.flush()
+            self._count = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_timeseries(filename: str, records: np.ndarray) -> None:
+    """
+    Writes a whole series at once, `records` is an array of RECORD_DTYPE.
+    """
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes())
+
+
+def read_timeseries(filename: str) -> np.ndarray:
+    """
+    Memory-maps a time-series file, so only the parts that are accessed are read.
+
+    :return: A read-only structured array with the fields of RECORD_DTYPE, e.g. `series["net_worth"]`.
+    """
+    if not is_timeseries_file(filename):
+        raise ValueError(f"{filename} is not a time-series file")
+
+    count = (os.path.getsize(filename) - len(MAGIC)) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(filename, dtype=RECORD_DTYPE, mode='r', offset=len(MAGIC), shape=(count,))
+
+
+def export_text(filename: str, output: str, with_timestamps: bool = False) -> None:
+    """
+    Writes the net worths of a time-series file as text, one per line like the original log files, or as CSV with
+    every column when `with_timestamps` is set.
+    """
+    series = read_timeseries(filename)
+    with open(output, 'w') as f:
+        if with_timestamps:
+            f.write(",".join(RECORD_DTYPE.names) + "\n")
+            f.writelines(",".join(str(float(value)) for value in record) + "\n" for record in series)
+        else:
+            f.writelines(f"{float(net_worth)}\n" for net_worth in series["net_worth"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports a binary net worth time-series file as text.")
+    parser.add_argument("filename")
+    parser.add_argument("output")
+    parser.add_argument("--with-timestamps", action="store_true", help="write a CSV with every column")
+    args = parser.parse_args()
+
+    export_text(args.filename, args.output, args.with_timestamps)
+
+
+if __name__ == "__main__":
+    main()